@@ -0,0 +1,698 @@
+#
+# Import all necessary libraries
+#
+
+import aiohttp
+import asyncio
+import functools
+import time
+
+from teslarequest import (
+  API_VERSION, OWNERAPI_CLIENT_TOKENS_URL, OWNERAPI_VERSION,
+  REQUEST_TOKEN, REQUEST_VEHICLES, REQUEST_DATA_COMMANDS, REQUEST_DATA_ALL, REQUEST_DATA_ALL_STATES,
+  REQUEST_DATA_STATE_VEHICLE, REQUEST_DATA_STATE_CHARGE, REQUEST_DATA_STATE_DRIVE,
+  COMMAND_WAKE_UP, CACHE_EXPIRATION_LIMIT, WAKE_DEADLINE, POOL_CONNECTIONS, POOL_MAXSIZE,
+  KEY_API_ID, KEY_API_SECRET, KEY_API_BASEURL,
+  KEY_TOKEN, KEY_TOKEN_CREATION, KEY_TOKEN_EXPIRATION, KEY_TOKEN_TYPE, KEY_TOKEN_REFRESH,
+  KEY_TOKEN_URL, KEY_TOKEN_ID, KEY_TOKEN_SECRET,
+  KEY_VEHICLES, KEY_VEHICLE_COUNT, KEY_VEHICLE_NAME, KEY_VEHICLE_ID,
+  KEY_VEHICLE_ONLINE_STATE, KEY_VEHICLE_INSERVICE_STATE,
+  KEY_RESPONSE, KEY_CACHE_EXPIRATION,
+  KEY_STATE_VEHICLE_DOOR_DRIVER_FRONT, KEY_STATE_VEHICLE_DOOR_DRIVER_REAR,
+  KEY_STATE_VEHICLE_DOOR_PASSENGER_FRONT, KEY_STATE_VEHICLE_DOOR_PASSENGER_REAR,
+  KEY_STATE_VEHICLE_DOOR_TRUNK_FRONT, KEY_STATE_VEHICLE_DOOR_TRUNK_REAR,
+  KEY_STATE_VEHICLE_LOCKED, KEY_STATE_VEHICLE_HOMELINK, KEY_STATE_VEHICLE_SENTRY,
+  KEY_STATE_CHARGE_STATE, KEY_STATE_CHARGE_PENDING, KEY_STATE_CHARGE_LIMIT, KEY_STATE_DRIVE_SHIFT,
+  VALUE_STATE_CHARGE_CHARGING_READY, VALUE_STATE_CHARGE_CHARGING_NOW, VALUE_STATE_CHARGE_BATTERY_LEVEL,
+  VALUE_STATE_ONLINE_ASLEEP, VALUE_STATE_ONLINE_ONLINE, VALUE_STATE_PARKED, VALUE_STATE_UNKNOWN,
+  STATUS_CODE_OK, STATUS_CODE_NOT_FOUND, STATUS_CODE_REQUEST_TIMEOUT,
+  STATUS_RESPONSE, STATUS_RESPONSE_RESULT,
+  WakeStrategy, StateCache, validate_owner_api_parameters,
+)
+
+
+#
+# Define some global constants
+#
+
+VERSION= '0.0.1'
+
+
+#
+# Build a pooled, keep-alive HTTP session (share one across AsyncTeslaRequest instances to share the pool)
+#
+def create_session(pool_connections= POOL_CONNECTIONS, pool_maxsize= POOL_MAXSIZE):
+  connector= aiohttp.TCPConnector(limit= pool_connections * pool_maxsize,
+    limit_per_host= pool_maxsize)
+
+  return aiohttp.ClientSession(connector= connector)
+
+
+#
+# Define our asynchronous Tesla API class (same surface as TeslaRequest, with coroutines for network access)
+#
+class AsyncTeslaRequest:
+
+  # Constructor (no network access -- await connect() or use create())
+  def __init__(self, arguments):
+    # First, validate our debug and quiet flags
+    if hasattr(arguments, 'debug'):
+      self.__debug= arguments.debug
+    else:
+      self.__debug= False
+
+    if hasattr(arguments, 'quiet'):
+      self.__quiet= arguments.quiet
+    else:
+      self.__quiet= False
+
+
+    # Guard fetches so concurrent coroutines for one vehicle share a single request
+    self.__vehicle_locks= {}
+
+    # Instantiate internal cache (by vehicle ID, so a reordered listing never mixes cars up)
+    # and its optional persistent backing (blocking SQLite, so always called off the event loop)
+    self.__cache= {}
+    self.__cache_store_owned= False
+    if getattr(arguments, 'cache_store', None) is not None:
+      self.__cache_store= arguments.cache_store
+    elif getattr(arguments, 'cache_file', None):
+      self.__cache_store= StateCache(arguments.cache_file)
+      self.__cache_store_owned= True
+    else:
+      self.__cache_store= None
+
+    # Validate required values
+    self.__token_refreshed= False
+    if hasattr(arguments, 'token'):
+      self.__token= arguments.token
+    else:
+      self.__token= None
+
+    if hasattr(arguments, 'e_mail'):
+      self.__e_mail= arguments.e_mail
+    else:
+      self.__e_mail= None
+    if hasattr(arguments, 'password'):
+      self.__password= arguments.password
+    else:
+      self.__password= None
+
+    if hasattr(arguments, 'cache_expiration_limit'):
+      self.__cache_expiration_limit= arguments.cache_expiration_limit
+    else:
+      self.__cache_expiration_limit= CACHE_EXPIRATION_LIMIT
+
+    # Wake-up policy and the times we last saw each vehicle online
+    if getattr(arguments, 'wake_strategy', None) is not None:
+      self.__wake_strategy= arguments.wake_strategy
+    else:
+      self.__wake_strategy= WakeStrategy(
+        deadline= getattr(arguments, 'wake_deadline', WAKE_DEADLINE))
+    self.__online_timestamps= {}
+
+    # Fetch all state groups in one round-trip unless told otherwise
+    self.__bulk_state= getattr(arguments, 'bulk_state', True)
+
+    # Use a caller-supplied session (shared pool) or build our own on connect()
+    self.__pool_connections= getattr(arguments, 'pool_connections', POOL_CONNECTIONS)
+    self.__pool_maxsize= getattr(arguments, 'pool_maxsize', POOL_MAXSIZE)
+    if getattr(arguments, 'session', None) is not None:
+      self.__session= arguments.session
+      self.__session_owned= False
+    else:
+      self.__session= None
+      self.__session_owned= True
+
+    self.__vehicles= None
+
+
+  # Construct and connect in one step
+  @classmethod
+  async def create(cls, arguments):
+    request= cls(arguments)
+    await request.connect()
+    return request
+
+
+  # Support "async with AsyncTeslaRequest(options) as request:"
+  async def __aenter__(self):
+    await self.connect()
+    return self
+
+
+  async def __aexit__(self, exc_type, exc, traceback):
+    await self.close()
+
+
+  # Validate our token and load owned vehicles
+  async def connect(self):
+    if self.__session is None:
+      self.__session= create_session(self.__pool_connections, self.__pool_maxsize)
+
+    await self.__cache_token()
+    await self.__cache_vehicles()
+
+
+  # Issue a request and return its status code and decoded JSON body (None if there is none)
+  async def __send(self, method, request, **kwargs):
+    async with self.__session.request(method, request, **kwargs) as response:
+      try:
+        body= await response.json(content_type= None)
+      except ValueError:
+        body= None
+
+      return response.status, body
+
+
+  # Obtain Owner API parameters from our special place
+  async def __get_owner_api_parameters(self):
+    status, owner_api= await self.__send('GET', OWNERAPI_CLIENT_TOKENS_URL)
+
+    if status == STATUS_CODE_OK:
+      return validate_owner_api_parameters(owner_api)
+    else:
+      if self.__debug:
+        raise Exception('Could not obtain Owner API parameters (status code {})'.format(
+          status), self)
+      else:
+        raise Exception('Could not obtain Owner API parameters (status code {})'.format(
+          status))
+
+
+  # Validate current access token or obtain and cache a refreshed or a new one
+  async def __cache_token(self):
+    if self.__token:
+      if not self.__is_token_valid():
+        await self.__refresh_token()
+
+    else:
+      if self.__e_mail and self.__password:
+        await self.__get_token()
+      else:
+        raise Exception('Could not obtain a token (no credentials to obtain a new one)!', self)
+
+
+  # Request a token with the specified grant and remember it along with its Owner API parameters
+  async def __request_token(self, owner_api, payload):
+    request= owner_api[API_VERSION][KEY_API_BASEURL] + REQUEST_TOKEN
+    status, token= await self.__send('POST', request, json= payload)
+
+    if status == STATUS_CODE_OK:
+      self.__token= token
+      self.__token[KEY_TOKEN_URL]= owner_api[API_VERSION][KEY_API_BASEURL]
+      self.__token[KEY_TOKEN_ID]= owner_api[API_VERSION][KEY_API_ID]
+      self.__token[KEY_TOKEN_SECRET]= owner_api[API_VERSION][KEY_API_SECRET]
+      self.__token_refreshed= True
+
+      return self.__token_refreshed
+    else:
+      if self.__debug:
+        raise Exception('Failed to obtain token (status code {})'.format(
+          status), self, request, payload)
+      else:
+        raise Exception('Failed to obtain token (status code {})'.format(
+          status))
+
+
+  # Refresh access token
+  async def __refresh_token(self):
+    try:
+      owner_api= {API_VERSION : {
+        KEY_API_BASEURL : self.__token[KEY_TOKEN_URL],
+        KEY_API_ID : self.__token[KEY_TOKEN_ID],
+        KEY_API_SECRET : self.__token[KEY_TOKEN_SECRET],
+      }}
+      payload= {
+        'grant_type' : 'refresh_token',
+        'client_id' : self.__token[KEY_TOKEN_ID],
+        'client_secret' : self.__token[KEY_TOKEN_SECRET],
+        'refresh_token' : self.__token[KEY_TOKEN_REFRESH]
+      }
+    except Exception as error:
+      if self.__debug:
+        print('Failed to formulate refresh token request')
+      raise error
+
+    return await self.__request_token(owner_api, payload)
+
+
+  # Obtain new access token
+  async def __get_token(self):
+    try:
+      owner_api= await self.__get_owner_api_parameters()
+      payload= {
+        'grant_type' : 'password',
+        'client_id' : owner_api[API_VERSION][KEY_API_ID],
+        'client_secret' : owner_api[API_VERSION][KEY_API_SECRET],
+        'email' : self.__e_mail,
+        'password' : self.__password,
+      }
+    except Exception as error:
+      if self.__debug:
+        print('Failed to formulate new token request')
+      raise error
+
+    return await self.__request_token(owner_api, payload)
+
+
+  # Validate our current token
+  def __is_token_valid(self):
+    return (
+      time.time() < (self.__token[KEY_TOKEN_CREATION] + self.__token[KEY_TOKEN_EXPIRATION])
+      )
+
+
+  # Obtain owned vehicles
+  async def __cache_vehicles(self):
+    request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES
+    status, vehicles= await self.__send('GET', request, headers= self.get_headers())
+
+    if status == STATUS_CODE_OK:
+      self.__vehicles= vehicles
+
+      listed= time.time()
+      self.__online_timestamps= {}
+      for vehicle_index in range(0, len(self.__vehicles[KEY_VEHICLES])):
+        if self.get_vehicle_online_state(vehicle_index) == VALUE_STATE_ONLINE_ONLINE:
+          self.__online_timestamps[self.get_vehicle_id(vehicle_index)]= listed
+
+      return True
+    else:
+      if self.__debug:
+        raise Exception('Failed to obtain owned vehicles (status code {})'.format(
+          status), self, request)
+      else:
+        raise Exception('Failed to obtain owned vehicles (status code {})'.format(
+          status))
+
+
+  # Obtain and cache indicated state of the specified vehicle
+  async def __cache_state(self, vehicle_index, state_type):
+    attempts= await self.__wake_up(vehicle_index)
+
+    if self.get_vehicle_online_state(vehicle_index) == VALUE_STATE_ONLINE_ONLINE:
+      if self.__bulk_state and (state_type in REQUEST_DATA_ALL_STATES):
+        if (await self.__cache_all_states(vehicle_index)
+          and state_type in self.__cache.get(self.get_vehicle_id(vehicle_index), {})):
+            return
+
+      headers= self.get_headers()
+      request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
+        + '/' + str(self.get_vehicle_id(vehicle_index)) \
+        + REQUEST_DATA_COMMANDS[state_type] + state_type
+
+      status, body= await self.__send('GET', request, headers= headers)
+
+      if (status == STATUS_CODE_REQUEST_TIMEOUT) and (attempts == 0):
+        # the car dozed off since we last saw it online -- wake it up and try again
+        self.__set_online_state(vehicle_index, VALUE_STATE_ONLINE_ASLEEP)
+        return await self.__cache_state(vehicle_index, state_type)
+
+      if status == STATUS_CODE_OK:
+        state= body[KEY_RESPONSE]
+        state[KEY_CACHE_EXPIRATION]= time.time() + self.__cache_expiration_limit
+        self.__set_online_state(vehicle_index, VALUE_STATE_ONLINE_ONLINE)
+        await self.__store_state(vehicle_index, state_type, state)
+
+      else:
+        if self.__debug:
+          raise Exception('Could not obtain state of vehicle'
+            + ' named "{}" (status code {}) after {} attempt{}'.format(
+              self.get_vehicle_name(vehicle_index), status, attempts,
+              '' if attempts == 1 else 's'),
+            self, request, headers)
+        else:
+          raise Exception('Could not obtain state of vehicle'
+            + ' named "{}" (status code {})'.format(
+              self.get_vehicle_name(vehicle_index), status))
+
+
+  # Obtain and cache all state groups of the specified vehicle in a single request
+  # (returns False to fall back on the per-type requests)
+  async def __cache_all_states(self, vehicle_index):
+    request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
+      + '/' + str(self.get_vehicle_id(vehicle_index)) \
+      + REQUEST_DATA_ALL
+
+    status, body= await self.__send('GET', request, headers= self.get_headers())
+
+    if status == STATUS_CODE_OK:
+      states= body[KEY_RESPONSE]
+      expiration= time.time() + self.__cache_expiration_limit
+      self.__set_online_state(vehicle_index, VALUE_STATE_ONLINE_ONLINE)
+
+      for state_type in REQUEST_DATA_ALL_STATES:
+        if state_type in states:
+          state= states[state_type]
+          state[KEY_CACHE_EXPIRATION]= expiration
+          await self.__store_state(vehicle_index, state_type, state)
+
+      return True
+    else:
+      if status == STATUS_CODE_NOT_FOUND:
+        # combined endpoint is not offered -- stop asking for it
+        self.__bulk_state= False
+
+      if self.__debug:
+        print('Could not obtain combined state of vehicle named "{}" (status code {}),'
+          ' falling back to individual requests'.format(
+            self.get_vehicle_name(vehicle_index), status))
+
+      return False
+
+
+  # Call a (blocking) method of the persistent store on the default executor
+  async def __call_store(self, method, *arguments):
+    return await asyncio.get_running_loop().run_in_executor(None,
+      functools.partial(method, *arguments))
+
+
+  # Cache state for the specified vehicle (writing through to the persistent store)
+  async def __store_state(self, vehicle_index, state_type, state):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    self.__cache.setdefault(vehicle_id, {})[state_type]= state
+
+    if self.__cache_store:
+      await self.__call_store(self.__cache_store.put, vehicle_id, state_type, state)
+
+
+  # Load still valid state for the specified vehicle from the persistent store
+  async def __load_state(self, vehicle_index, state_type):
+    if self.__cache_store:
+      vehicle_id= self.get_vehicle_id(vehicle_index)
+      state= await self.__call_store(self.__cache_store.get, vehicle_id, state_type)
+
+      if state and (state[KEY_CACHE_EXPIRATION] >= time.time()):
+        self.__cache.setdefault(vehicle_id, {})[state_type]= state
+        return True
+
+    return False
+
+
+  # Return state for the specified vehicle
+  async def __get_state(self, vehicle_index, state_type):
+    try:
+      # one fetch per vehicle at a time -- concurrent callers wait and then hit the cache
+      vehicle_id= self.get_vehicle_id(vehicle_index)
+      async with self.__get_vehicle_lock(vehicle_id):
+        if ((vehicle_id not in self.__cache)
+          or (state_type not in self.__cache[vehicle_id])
+          or (self.__cache[vehicle_id][state_type][KEY_CACHE_EXPIRATION] < time.time())):
+            if not await self.__load_state(vehicle_index, state_type):
+              await self.__cache_state(vehicle_index, state_type)
+
+        return self.__cache[vehicle_id][state_type]
+
+    except Exception as error:
+      if self.__debug:
+        print('Could not obtain state of vehicle named "{}" from cache'.format(
+          self.get_vehicle_name(vehicle_index)))
+      raise error
+
+
+  # Return the lock serializing network access for the specified vehicle ID
+  def __get_vehicle_lock(self, vehicle_id):
+    if vehicle_id not in self.__vehicle_locks:
+      self.__vehicle_locks[vehicle_id]= asyncio.Lock()
+    return self.__vehicle_locks[vehicle_id]
+
+
+  # Wake up specified vehicle (returns the number of wake-up requests it took)
+  async def __wake_up(self, vehicle_index):
+    strategy= self.__wake_strategy
+
+    if ((self.get_vehicle_online_state(vehicle_index) == VALUE_STATE_ONLINE_ONLINE)
+      and strategy.is_online_fresh(
+        self.__online_timestamps.get(self.get_vehicle_id(vehicle_index), 0))):
+        return 0
+
+    headers= self.get_headers()
+    request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
+      + '/' + str(self.get_vehicle_id(vehicle_index)) \
+      + '/' + COMMAND_WAKE_UP
+
+    deadline= time.time() + strategy.deadline
+    awake= False
+    online_state= VALUE_STATE_UNKNOWN
+    attempts= 0
+    while True:
+      attempts+= 1
+      status, body= await self.__send('POST', request, headers= headers)
+
+      if status == STATUS_CODE_OK:
+        online_state= body[STATUS_RESPONSE][KEY_VEHICLE_ONLINE_STATE]
+        self.__set_online_state(vehicle_index, online_state)
+        if online_state == VALUE_STATE_ONLINE_ONLINE:
+          awake= True
+          break
+
+      delay= min(strategy.get_delay(attempts), deadline - time.time())
+      if delay <= 0:
+        break
+      await asyncio.sleep(delay)
+
+    if not awake:
+      if self.__debug:
+        raise Exception('Could not wake up vehicle'
+          + ' named "{}" (response code {}, status is {}) after {} attempts'.format(
+            self.get_vehicle_name(vehicle_index), status, online_state, attempts),
+          self, request, headers)
+      else:
+        raise Exception('Could not wake up vehicle'
+          + ' named "{}" (response code {}, status is {})'.format(
+            self.get_vehicle_name(vehicle_index), status, online_state))
+    else:
+      return attempts
+
+
+  # Record the observed online state of the specified vehicle
+  def __set_online_state(self, vehicle_index, online_state):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_ONLINE_STATE]= online_state
+    if online_state == VALUE_STATE_ONLINE_ONLINE:
+      self.__online_timestamps[vehicle_id]= time.time()
+    else:
+      self.__online_timestamps.pop(vehicle_id, None)
+
+
+  # Expire indicated state cache
+  async def __expire_cache(self, vehicle_index, state_type):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    if state_type in self.__cache.get(vehicle_id, {}):
+      self.__cache[vehicle_id][state_type][KEY_CACHE_EXPIRATION]= 0
+
+    if self.__cache_store:
+      await self.__call_store(self.__cache_store.invalidate, vehicle_id, state_type)
+
+
+  # Expire all cached state of the specified vehicle (in memory and in the persistent store)
+  async def invalidate_cache(self, vehicle_index, state_type= None):
+    if state_type is None:
+      vehicle_id= self.get_vehicle_id(vehicle_index)
+      for cached_type in self.__cache.get(vehicle_id, {}).keys():
+        self.__cache[vehicle_id][cached_type][KEY_CACHE_EXPIRATION]= 0
+
+      if self.__cache_store:
+        await self.__call_store(self.__cache_store.invalidate, vehicle_id)
+    else:
+      await self.__expire_cache(vehicle_index, state_type)
+
+
+  # Formulate and return stored token parameters
+  def get_token(self):
+    return self.__token
+
+
+  # Return the HTTP session used for all requests (pass it to other instances to share the pool)
+  def get_session(self):
+    return self.__session
+
+
+  # Release pooled connections and the persistent cache (only those that are ours to close)
+  async def close(self):
+    if self.__session_owned and self.__session is not None:
+      await self.__session.close()
+
+    if self.__cache_store_owned:
+      await self.__call_store(self.__cache_store.close)
+
+
+  # Force refresh of our access token
+  async def force_token_refresh(self):
+    return await self.__refresh_token()
+
+
+  # Do we have a refreshed token (make sure to save it!)
+  def is_token_refreshed(self):
+    return self.__token_refreshed
+
+
+  # Formulate and return stored Owner API URL
+  def get_url(self):
+    return self.__token[KEY_TOKEN_URL]
+
+
+  # Formulate and return stored Owner API request headers
+  def get_headers(self):
+    return {
+      'Authorization' : self.__token[KEY_TOKEN_TYPE] + ' ' + self.__token[KEY_TOKEN],
+      'User-Agent' : 'asyncteslarequest.py'
+      }
+
+
+  # Return count of stored vehicles
+  def get_vehicle_count(self):
+    return self.__vehicles[KEY_VEHICLE_COUNT]
+
+
+  # Return the name of the specified vehicle
+  def get_vehicle_name(self, vehicle_index):
+    return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_NAME]
+
+
+  # Return the ID of the specified vehicle
+  def get_vehicle_id(self, vehicle_index):
+    return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_ID]
+
+
+  # Return the online state of the specified vehicle
+  def get_vehicle_online_state(self, vehicle_index):
+    return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_ONLINE_STATE]
+
+
+  # Return the in-service state of the specified vehicle
+  def is_vehicle_in_service(self, vehicle_index):
+    return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_INSERVICE_STATE]
+
+
+  # Return full vehicle state dump for the specified vehicle
+  async def get_vehicle_state(self, vehicle_index):
+    return await self.__get_state(vehicle_index, REQUEST_DATA_STATE_VEHICLE)
+
+
+  # Return drive state for the specified vehicle
+  async def get_drive_state(self, vehicle_index):
+    return await self.__get_state(vehicle_index, REQUEST_DATA_STATE_DRIVE)
+
+
+  # Return charge state for the specified vehicle
+  async def get_charge_state(self, vehicle_index):
+    return await self.__get_state(vehicle_index, REQUEST_DATA_STATE_CHARGE)
+
+
+  # Return charging limit for the specified vehicle
+  async def get_charging_limit(self, vehicle_index):
+    return (await self.get_charge_state(vehicle_index))[KEY_STATE_CHARGE_LIMIT]
+
+
+  # Return a list of open doors and trunks for the specified vehicle
+  async def get_vehicle_open_doors_and_trunks(self, vehicle_index):
+    doors= {
+      KEY_STATE_VEHICLE_DOOR_DRIVER_FRONT : 'Driver Side Front Door',
+      KEY_STATE_VEHICLE_DOOR_DRIVER_REAR : 'Driver Side Rear Door',
+      KEY_STATE_VEHICLE_DOOR_PASSENGER_FRONT : 'Passenger Side Front Door',
+      KEY_STATE_VEHICLE_DOOR_PASSENGER_REAR : 'Passenger Side Rear Door',
+      KEY_STATE_VEHICLE_DOOR_TRUNK_FRONT : 'Front Trunk',
+      KEY_STATE_VEHICLE_DOOR_TRUNK_REAR : 'Rear Trunk',
+    }
+
+    state= await self.get_vehicle_state(vehicle_index)
+    return [doors[door] for door in doors.keys() if state[door] != 0]
+
+
+  # Return the location of the specified vehicle
+  async def get_vehicle_location(self, vehicle_index):
+    state= await self.get_drive_state(vehicle_index)
+    return (state['latitude'], state['longitude'])
+
+
+  # Return a boolean indicating the locked state for the specified vehicle
+  async def is_vehicle_locked(self, vehicle_index):
+    return (await self.get_vehicle_state(vehicle_index))[KEY_STATE_VEHICLE_LOCKED]
+
+
+  # Return a boolean indicating proximity to a programmed HomeLink location ("unknown" string for absent indicator)
+  async def is_vehicle_near_homelink(self, vehicle_index):
+    return (await self.get_vehicle_state(vehicle_index)).get(
+      KEY_STATE_VEHICLE_HOMELINK, VALUE_STATE_UNKNOWN)
+
+
+  # Return a boolean indicating Sentry Mode activation state ("unknown" string for absent indicator)
+  async def is_vehicle_sentry_mode_active(self, vehicle_index):
+    return (await self.get_vehicle_state(vehicle_index)).get(
+      KEY_STATE_VEHICLE_SENTRY, VALUE_STATE_UNKNOWN)
+
+
+  # Return a boolean indicating the parked state for the specified vehicle
+  async def is_vehicle_parked(self, vehicle_index):
+    state= await self.get_drive_state(vehicle_index)
+    return (state.get(KEY_STATE_DRIVE_SHIFT) == VALUE_STATE_PARKED)
+
+
+  # Return a boolean indicating charging readiness for the specified vehicle
+  async def is_vehicle_ready_to_charge(self, vehicle_index):
+    state= await self.get_charge_state(vehicle_index)
+    return (
+      ((state[KEY_STATE_CHARGE_STATE] in VALUE_STATE_CHARGE_CHARGING_READY)
+        and (state[KEY_STATE_CHARGE_PENDING] == True))
+      or (state[KEY_STATE_CHARGE_STATE] in VALUE_STATE_CHARGE_CHARGING_NOW))
+
+
+  # Return a boolean indicating whether the specified vehicle is charging
+  async def is_vehicle_charging(self, vehicle_index):
+    return ((await self.get_charge_state(vehicle_index))[KEY_STATE_CHARGE_STATE]
+      in VALUE_STATE_CHARGE_CHARGING_NOW)
+
+
+  # Return current battery level % for the specified vehicle
+  async def get_battery_level(self, vehicle_index):
+    return (await self.get_charge_state(vehicle_index))[VALUE_STATE_CHARGE_BATTERY_LEVEL]
+
+
+  # Issue a command to the specified vehicle
+  async def issue_command(self, vehicle_index, command, payload):
+    headers= self.get_headers()
+    request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
+      + '/' + str(self.get_vehicle_id(vehicle_index)) \
+      + '/command/' + command
+
+    status, body= await self.__send('POST', request, headers= headers, json= payload)
+
+    if status == STATUS_CODE_OK:
+      return body[STATUS_RESPONSE][STATUS_RESPONSE_RESULT]
+    else:
+      if self.__debug:
+        raise Exception('Failed to issue command "{}" to vehicle named "{}" (status code {})'.format(command, self.get_vehicle_name(vehicle_index), status), self, request, body)
+      else:
+        raise Exception('Failed to issue command "{}" to vehicle named "{}" (status code {})'.format(command, self.get_vehicle_name(vehicle_index), status))
+
+
+  # Issue a command to the specified vehicle to set its charging limit
+  async def set_charging_limit(self, vehicle_index, limit):
+    await self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_CHARGE)
+    return await self.issue_command(vehicle_index, 'set_charge_limit', {'percent' : limit})
+
+
+  # Issue a command to the specified vehicle to set maximum range charging limit
+  async def set_charging_limit_max(self, vehicle_index):
+    await self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_CHARGE)
+    return await self.issue_command(vehicle_index, 'charge_max_range', {})
+
+
+  # Issue a command to the specified vehicle to set standard charging limit
+  async def set_charging_limit_standard(self, vehicle_index):
+    await self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_CHARGE)
+    return await self.issue_command(vehicle_index, 'charge_standard', {})
+
+
+  # Issue a command to the specified vehicle to activate Sentry Mode
+  async def set_sentry_mode_on(self, vehicle_index):
+    await self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_VEHICLE)
+    return await self.issue_command(vehicle_index, 'set_sentry_mode', {'on' : True})
+
+
+  # Issue a command to the specified vehicle to deactivate Sentry Mode
+  async def set_sentry_mode_off(self, vehicle_index):
+    await self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_VEHICLE)
+    return await self.issue_command(vehicle_index, 'set_sentry_mode', {'on' : False})
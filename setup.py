@@ -7,7 +7,8 @@ setup(name='teslarequest',
       version='0.2.2',
       description='Tesla Owner API access for vehicle queries and control',
       url='https://github.com/nigelboid/tesla-minder',
-      py_modules=['teslarequest'],
+      py_modules=['teslarequest', 'asyncteslarequest', 'teslageofence'],
+      extras_require={'async': ['aiohttp'], 'geofence': ['numpy'], 'json': ['orjson']},
       author='Igor S. Livshits',
       license='MIT',
       )
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+
+#
+# Import all necessary libraries
+#
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import urllib.request
+
+import teslafakeapi
+import teslarequest
+from teslarequest import TeslaRequest
+
+
+#
+# Define some global constants
+#
+
+VERSION= '0.0.1'
+
+SCENARIO_LIBRARY= 'library'
+SCENARIO_CHECK_STATE= 'check-state'
+SCENARIO_CODEC= 'codec'
+SCENARIOS= [SCENARIO_LIBRARY, SCENARIO_CHECK_STATE, SCENARIO_CODEC]
+
+CHECK_STATE_SCRIPT= 'tesla-check-state.py'
+
+DEFAULT_RUNS= 3
+DEFAULT_TOLERANCE= 0.2            # fraction of slack allowed against a baseline
+DEFAULT_CODEC_ITERATIONS= 200     # passes over the fleet's vehicle_data payloads per codec
+
+
+#
+# Define our functions
+#
+
+# Collect all expected and detected arguments from the command line
+#
+def GetArguments():
+  argumentParser= argparse.ArgumentParser(
+    description= 'Benchmark TeslaRequest and tesla-check-state.py against a local stand-in Owner API')
+
+  argumentParser.add_argument('-s', '--scenario', dest='scenarios', action='append',
+    choices=SCENARIOS, help='Scenario to run (repeat for several; all by default)')
+  argumentParser.add_argument('-r', '--runs', dest='runs', type=int, default=DEFAULT_RUNS,
+    action='store', help='Runs per scenario')
+  argumentParser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+    action='store', help='Vehicles checked concurrently in the check-state scenario')
+
+  argumentParser.add_argument('-n', '--fleet-size', dest='fleet_size', type=int,
+    default=teslafakeapi.DEFAULT_FLEET_SIZE, action='store', help='Number of simulated vehicles')
+  argumentParser.add_argument('-l', '--latency', dest='latency', type=float,
+    default=teslafakeapi.DEFAULT_LATENCY, action='store', help='Seconds of latency per request')
+  argumentParser.add_argument('-a', '--asleep', dest='asleep_fraction', type=float,
+    default=teslafakeapi.DEFAULT_ASLEEP_FRACTION, action='store',
+    help='Share of the fleet asleep at the start of each run')
+  argumentParser.add_argument('-w', '--wake-time', dest='wake_time', type=float,
+    default=teslafakeapi.DEFAULT_WAKE_TIME, action='store',
+    help='Seconds a sleeping car takes to wake up')
+  argumentParser.add_argument('-e', '--error-rate', dest='error_rate', type=float,
+    default=teslafakeapi.DEFAULT_ERROR_RATE, action='store',
+    help='Share of requests failing with 503')
+  argumentParser.add_argument('--no-bulk', dest='bulk_state', action='store_false', default=True,
+    help='Do not offer the combined vehicle_data endpoint')
+  argumentParser.add_argument('--seed', dest='seed', type=int, default=0, action='store',
+    help='Random seed for a reproducible fleet')
+
+  argumentParser.add_argument('--codec-iterations', dest='codec_iterations', type=int,
+    default=DEFAULT_CODEC_ITERATIONS, action='store',
+    help='Passes over the vehicle_data payloads in the codec scenario')
+
+  argumentParser.add_argument('-o', '--output', dest='output', action='store',
+    help='Write results as JSON to the specified file')
+  argumentParser.add_argument('-b', '--baseline', dest='baseline', action='store',
+    help='Compare against results previously written with --output (non-zero exit on regression)')
+  argumentParser.add_argument('--tolerance', dest='tolerance', type=float,
+    default=DEFAULT_TOLERANCE, action='store',
+    help='Allowed fractional slowdown against the baseline')
+
+  argumentParser.add_argument('-v', '--version', action='version',
+    version='%(prog)s '+VERSION)
+
+  return argumentParser.parse_args()
+
+
+# Run the stand-in Owner API in its own process (keeps its memory out of our measurements)
+#
+def ServeFakeAPI(settings, url_queue):
+  api= teslafakeapi.FakeOwnerAPI(**settings)
+  url_queue.put(api.get_url())
+  api.serve_forever()
+
+
+# Start the stand-in Owner API and return its process and base URL
+#
+def StartFakeAPI(options):
+  settings= {
+    'fleet_size' : options.fleet_size, 'latency' : options.latency,
+    'asleep_fraction' : options.asleep_fraction, 'wake_time' : options.wake_time,
+    'error_rate' : options.error_rate, 'bulk_state' : options.bulk_state, 'seed' : options.seed,
+  }
+  url_queue= multiprocessing.Queue()
+  process= multiprocessing.Process(target= ServeFakeAPI, args= (settings, url_queue), daemon= True)
+  process.start()
+
+  return process, url_queue.get(timeout= 30)
+
+
+# Issue a control request to the stand-in Owner API
+#
+def CallFakeAPI(url, path):
+  with urllib.request.urlopen(url + path) as response:
+    return json.loads(response.read())
+
+
+# Return a token accepted by the stand-in Owner API
+#
+def MakeToken(url):
+  return {
+    'access_token' : 'fake-access-token', 'token_type' : 'bearer',
+    'expires_in' : teslafakeapi.DEFAULT_TOKEN_LIFETIME, 'created_at' : int(time.time()),
+    'refresh_token' : 'fake-refresh-token', 'baseurl' : url,
+    'id' : teslafakeapi.CLIENT_ID, 'secret' : teslafakeapi.CLIENT_SECRET,
+  }
+
+
+# Read every state group of every vehicle through the library
+#
+def RunLibrary(options, url, token_file):
+  request= TeslaRequest(types.SimpleNamespace(token= MakeToken(url), quiet= True))
+  try:
+    for counter in range(0, request.get_vehicle_count()):
+      request.get_vehicle_state(counter)
+      request.get_charge_state(counter)
+      request.get_drive_state(counter)
+  finally:
+    request.close()
+
+
+# Run the full tesla-check-state.py flow (failing the run on any error the script would only print)
+#
+def RunCheckState(options, url, token_file):
+  script= os.path.join(os.path.dirname(os.path.abspath(__file__)), CHECK_STATE_SCRIPT)
+  spec= importlib.util.spec_from_file_location('tesla_check_state', script)
+  check_state= importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(check_state)
+
+  # a vehicle the script could not check fails the run rather than being reported and skipped
+  def RaiseVehicleError(options, request, counter, name, error):
+    raise error
+  check_state.ReportVehicleError= RaiseVehicleError
+
+  home= teslafakeapi.HOME_LOCATION
+  arguments= [CHECK_STATE_SCRIPT, '-t', token_file, '--jobs', str(options.jobs),
+    '-y', str(home[0]), '-x', str(home[1])]
+
+  saved_arguments= sys.argv
+  sys.argv= arguments
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      check_options= check_state.GetToken(check_state.NormalizeArguments(check_state.GetArguments()))
+      check_state.CheckAccount(check_options)
+  finally:
+    sys.argv= saved_arguments
+
+
+# Run a scenario repeatedly against a freshly reset fleet and summarize the measurements
+#
+def RunScenario(options, url, scenario):
+  runner= {SCENARIO_LIBRARY : RunLibrary, SCENARIO_CHECK_STATE : RunCheckState}[scenario]
+  samples= []
+
+  for run in range(0, options.runs):
+    CallFakeAPI(url, teslafakeapi.REQUEST_RESET)
+
+    with tempfile.NamedTemporaryFile('w', suffix= '.json', delete= False) as token_file:
+      json.dump(MakeToken(url), token_file)
+
+    try:
+      tracemalloc.start()
+      start= time.perf_counter()
+      runner(options, url, token_file.name)
+      wall= time.perf_counter() - start
+      peak= tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    finally:
+      os.unlink(token_file.name)
+
+    stats= CallFakeAPI(url, teslafakeapi.REQUEST_STATS)
+    samples.append({'wall' : wall, 'peak' : peak, 'requests' : stats['requests'],
+      'endpoints' : stats['endpoints'], 'wake' : stats['wake_seconds'], 'errors' : stats['errors']})
+
+  endpoints= {}
+  for sample in samples:
+    for endpoint, count in sample['endpoints'].items():
+      endpoints[endpoint]= endpoints.get(endpoint, 0) + count / len(samples)
+
+  return {
+    'runs' : len(samples),
+    'requests' : sum(sample['requests'] for sample in samples) / len(samples),
+    'endpoints' : endpoints,
+    'errors' : sum(sample['errors'] for sample in samples) / len(samples),
+    'wall_mean' : sum(sample['wall'] for sample in samples) / len(samples),
+    'wall_min' : min(sample['wall'] for sample in samples),
+    'wall_max' : max(sample['wall'] for sample in samples),
+    'wake_mean' : sum(sample['wake'] for sample in samples) / len(samples),
+    'peak_memory' : max(sample['peak'] for sample in samples),
+  }
+
+
+# Time decoding and encoding representative vehicle_data responses with every installed JSON codec
+#
+def RunCodec(options):
+  rng= random.Random(options.seed)
+  payloads= []
+  for counter in range(0, options.fleet_size):
+    vehicle_id= teslafakeapi.FIRST_VEHICLE_ID + counter
+    data= teslafakeapi.make_vehicle_listing(vehicle_id, 'online')
+    data.update(teslafakeapi.make_vehicle_states(vehicle_id, rng))
+    payloads.append(json.dumps({'response' : data}).encode('utf-8'))
+
+  codecs= [codec for codec in teslarequest.JSON_CODECS
+    if (codec != teslarequest.JSON_CODEC_ORJSON) or (teslarequest.orjson is not None)]
+  saved_codec= teslarequest.get_json_codec()
+  results= {}
+  try:
+    for codec in codecs:
+      teslarequest.set_json_codec(codec)
+
+      # best of several runs (the least disturbed by everything else on the machine)
+      decode= encode= None
+      for run in range(0, options.runs):
+        start= time.perf_counter()
+        for iteration in range(0, options.codec_iterations):
+          decoded= [teslarequest.decode_json(payload) for payload in payloads]
+        elapsed= time.perf_counter() - start
+        decode= elapsed if decode is None else min(decode, elapsed)
+
+        start= time.perf_counter()
+        for iteration in range(0, options.codec_iterations):
+          for value in decoded:
+            teslarequest.encode_json(value)
+        elapsed= time.perf_counter() - start
+        encode= elapsed if encode is None else min(encode, elapsed)
+
+      count= options.codec_iterations * len(payloads)
+      results[codec]= {'decode_us' : decode / count * 1e6, 'encode_us' : encode / count * 1e6}
+  finally:
+    teslarequest.set_json_codec(saved_codec)
+
+  return {
+    'payloads' : len(payloads),
+    'payload_bytes' : sum(len(payload) for payload in payloads) / len(payloads),
+    'codecs' : results,
+  }
+
+
+# Print a codec summary
+#
+def ReportCodec(result):
+  print('')
+  print('{:>18}: {}'.format('scenario', SCENARIO_CODEC))
+  print('{:>18}: {} of {:.0f} bytes'.format('payloads', result['payloads'], result['payload_bytes']))
+  for codec, timing in sorted(result['codecs'].items()):
+    print('{:>18}: decode {:.1f}us, encode {:.1f}us'.format(
+      codec, timing['decode_us'], timing['encode_us']))
+
+
+# Print a scenario summary
+#
+def ReportScenario(scenario, result):
+  print('')
+  print('{:>18}: {}'.format('scenario', scenario))
+  print('{:>18}: {}'.format('runs', result['runs']))
+  print('{:>18}: {:.1f}'.format('requests/run', result['requests']))
+  for endpoint in sorted(result['endpoints'].keys()):
+    print('{:>18}  {:>28}: {:.1f}'.format('', endpoint, result['endpoints'][endpoint]))
+  print('{:>18}: {:.1f}'.format('errors/run', result['errors']))
+  print('{:>18}: {:.3f}s (min {:.3f}s, max {:.3f}s)'.format(
+    'wall time', result['wall_mean'], result['wall_min'], result['wall_max']))
+  print('{:>18}: {:.3f}s'.format('wake time', result['wake_mean']))
+  print('{:>18}: {:.1f} KiB'.format('peak memory', result['peak_memory'] / 1024))
+
+
+# Compare results against a baseline and return a list of regressions
+#
+def CompareBaseline(results, baseline, tolerance):
+  regressions= []
+
+  for scenario, result in results.items():
+    if scenario not in baseline:
+      continue
+
+    reference= baseline[scenario]
+    if scenario == SCENARIO_CODEC:
+      for codec, timing in result['codecs'].items():
+        if codec not in reference['codecs']:
+          continue
+        for measure in ['decode_us', 'encode_us']:
+          if timing[measure] > reference['codecs'][codec][measure] * (1 + tolerance):
+            regressions.append('{}: {} {} {:.1f}us (baseline {:.1f}us)'.format(scenario, codec,
+              measure.split('_')[0], timing[measure], reference['codecs'][codec][measure]))
+      continue
+
+    if result['requests'] > reference['requests']:
+      regressions.append('{}: {:.1f} requests/run (baseline {:.1f})'.format(
+        scenario, result['requests'], reference['requests']))
+    if result['wall_mean'] > reference['wall_mean'] * (1 + tolerance):
+      regressions.append('{}: {:.3f}s wall time (baseline {:.3f}s)'.format(
+        scenario, result['wall_mean'], reference['wall_mean']))
+    if result['peak_memory'] > reference['peak_memory'] * (1 + tolerance):
+      regressions.append('{}: {:.1f} KiB peak memory (baseline {:.1f} KiB)'.format(
+        scenario, result['peak_memory'] / 1024, reference['peak_memory'] / 1024))
+
+  return regressions
+
+
+# Main entry point
+#
+def main():
+  options= GetArguments()
+  scenarios= options.scenarios or SCENARIOS
+
+  results= {}
+  if SCENARIO_CODEC in scenarios:
+    results[SCENARIO_CODEC]= RunCodec(options)
+    ReportCodec(results[SCENARIO_CODEC])
+
+  request_scenarios= [scenario for scenario in scenarios if scenario != SCENARIO_CODEC]
+  if request_scenarios:
+    process, url= StartFakeAPI(options)
+    try:
+      for scenario in request_scenarios:
+        results[scenario]= RunScenario(options, url, scenario)
+        ReportScenario(scenario, results[scenario])
+    finally:
+      process.terminate()
+      process.join()
+
+  if options.output:
+    with open(options.output, 'w') as output_file:
+      json.dump(results, output_file, sort_keys=True, indent=4, separators=(',', ': '))
+
+  if options.baseline:
+    with open(options.baseline, 'r') as baseline_file:
+      regressions= CompareBaseline(results, json.load(baseline_file), options.tolerance)
+
+    print('')
+    if regressions:
+      for regression in regressions:
+        print('Regression! ' + regression)
+      sys.exit(1)
+    else:
+      print('No regressions against {}'.format(options.baseline))
+
+
+#
+# Execute if we were run as a program
+#
+
+if __name__ == '__main__':
+  main()
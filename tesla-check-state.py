@@ -6,10 +6,19 @@
 #
 
 import argparse
+import heapq
+import io
+import itertools
 import json
 import datetime
-import geopy.distance
-from teslarequest import TeslaRequest
+import signal
+import sys
+import threading
+import time
+import concurrent.futures
+from teslageofence import Geofence, Zone, parse_zone, ZONE_HOME, METERS_PER_MILE
+from teslarequest import TeslaRequest, TokenStore, FleetManager, COMMAND_SET_CHARGE_LIMIT, COMMAND_SET_SENTRY_MODE, \
+  COMMAND_VERIFY_DELAY, SCHEDULER_RATE, BREAKER_FAILURES, BREAKER_COOLDOWN
 
 
 #
@@ -31,6 +40,32 @@ MAXIMUM_NEAR_DISTANCE= 30         # meters
 
 MINIMUM_TOKEN_DAYS_REMAINING= 5   #days
 
+DEFAULT_JOBS= 1                   # vehicles checked concurrently
+
+MAXIMUM_STALENESS= 3600           # seconds
+
+CHECK_SECURE= 'secure'            # doors, trunks and locks
+CHECK_CHARGING= 'charging'        # charging limit and charge level (at home)
+CHECK_SENTRY= 'sentry'            # Sentry Mode
+TASK_VEHICLES= 'vehicles'         # re-list owned vehicles (daemon mode)
+TASK_TOKEN= 'token'               # check token expiration (daemon mode)
+DEFAULT_INTERVALS= {              # seconds between daemon runs of each check or task
+  CHECK_SECURE : 300,
+  CHECK_CHARGING : 900,
+  CHECK_SENTRY : 300,
+  TASK_VEHICLES : 3600,
+  TASK_TOKEN : 3600,
+}
+
+STATE_VEHICLE= 'vehicle_state'
+STATE_CHARGE= 'charge_state'
+STATE_DRIVE= 'drive_state'
+CHECK_STATES= {                   # state types each check depends on (re-evaluated only on change)
+  CHECK_SECURE : (STATE_VEHICLE,),
+  CHECK_CHARGING : (STATE_VEHICLE, STATE_CHARGE, STATE_DRIVE),
+  CHECK_SENTRY : (STATE_VEHICLE, STATE_DRIVE),
+}
+
 
 #
 # Define our functions
@@ -39,11 +74,16 @@ MINIMUM_TOKEN_DAYS_REMAINING= 5   #days
 # Collect all expected and detected arguments from the command line
 #
 def GetArguments():
-  argumentParser= argparse.ArgumentParser()
+  # arguments may also be read from a file ("@minder.conf"), which the daemon re-reads on SIGHUP
+  argumentParser= argparse.ArgumentParser(fromfile_prefix_chars='@')
 
   argumentParser.add_argument('-t', '--token', '--token-file',
-    nargs=1, dest='token_file', required=True, action='store',
+    nargs=1, dest='token_file', required=False, action='store',
     help='Tesla Owner API authorization token file')
+  argumentParser.add_argument('-f', '--fleet',
+    dest='fleet', required=False, action='store', metavar='DIRECTORY|MANIFEST',
+    help='Check every account in a directory of token files, or a manifest listing one'
+      + ' [ACCOUNT=]TOKEN_FILE per line, in one pass (--jobs limits concurrency across the fleet)')
 
   argumentParser.add_argument('--days', '--token-days', '--token-minimum-days',
     dest='min_expiration_days', type=int, required=False, action='store',
@@ -66,11 +106,78 @@ def GetArguments():
   argumentParser.add_argument('-x', '--longitude', '--home-longitude',
     nargs=1, dest='home_longitude', type=float, required=False, action='store',
     help='Home longitude coordinate')
+  argumentParser.add_argument('-z', '--zone',
+    dest='zones', required=False, action='append', metavar='NAME=LATITUDE,LONGITUDE[,RADIUS]',
+    help='A named zone (radius in meters, default {}); a zone named "{}" sets the home location'.format(
+      MAXIMUM_NEAR_DISTANCE, ZONE_HOME))
 
   argumentParser.add_argument('-i', '--ignore', '--ignore-car',
     dest='ignore', required=False, action='append',
     help='A list of car names to skip')
 
+  argumentParser.add_argument('-j', '--jobs',
+    dest='jobs', type=int, required=False, action='store',
+    default=DEFAULT_JOBS,
+    help='Number of vehicles to check concurrently')
+
+  argumentParser.add_argument('--rate-limit',
+    dest='rate_limit', type=float, required=False, action='store',
+    default=SCHEDULER_RATE,
+    help='Sustained Owner API requests per second for the account (throttling slows us further)')
+
+  argumentParser.add_argument('--daemon',
+    dest='daemon', required=False, action='store_true', default=False,
+    help='Keep running and repeat each check on its own schedule (SIGHUP reloads settings)')
+
+  argumentParser.add_argument('--interval',
+    dest='intervals', required=False, action='append', metavar='CHECK=SECONDS',
+    help='Daemon interval for a check or task ({})'.format(', '.join(sorted(DEFAULT_INTERVALS))))
+
+  argumentParser.add_argument('--passive',
+    dest='passive', required=False, action='store_true', default=False,
+    help='Never wake a sleeping car while its cached state is within the staleness budget')
+
+  argumentParser.add_argument('--max-staleness',
+    dest='max_staleness', type=int, required=False, action='store',
+    default=MAXIMUM_STALENESS,
+    help='Seconds of cached state age tolerated for sleeping cars in passive mode')
+
+  argumentParser.add_argument('--verify-commands',
+    dest='command_verify_delay', type=int, required=False, action='store', nargs='?',
+    const=COMMAND_VERIFY_DELAY, default=None, metavar='SECONDS',
+    help='Re-read state a command changed once it is next needed after this long'
+      + ' (default {} seconds; otherwise trust the command result until the cache expires)'.format(
+        COMMAND_VERIFY_DELAY))
+
+  argumentParser.add_argument('--idempotent',
+    dest='idempotent', required=False, action='store_true', default=False,
+    help='Skip remedial commands that fresh cached state shows are already in effect'
+      + ' (saves a wake-up when another run or the owner got there first)')
+
+  argumentParser.add_argument('--breaker-failures',
+    dest='breaker_failures', type=int, required=False, action='store',
+    default=BREAKER_FAILURES,
+    help='Consecutive failed wake-ups (or endpoint failures) before a car (or endpoint) is skipped'
+      + ' for a cooldown; counted across runs with --cache (0 never skips)')
+
+  argumentParser.add_argument('--breaker-cooldown',
+    dest='breaker_cooldown', type=int, required=False, action='store',
+    default=BREAKER_COOLDOWN,
+    help='Seconds a failing car or endpoint is skipped before a single retry'
+      + ' (doubled after each failed retry)')
+
+  argumentParser.add_argument('--cache', '--cache-file',
+    dest='cache_file', required=False, action='store',
+    help='Persistent vehicle state cache file (shared across runs)')
+
+  argumentParser.add_argument('--history', '--history-dir',
+    dest='history_dir', required=False, action='store',
+    help='Directory recording a compact history of battery, charging, lock, Sentry Mode and location')
+
+  argumentParser.add_argument('--metrics', '--metrics-file',
+    dest='metrics_file', required=False, action='store',
+    help='Write request metrics at exit (Prometheus textfile for *.prom, JSON otherwise)')
+
   argumentParser.add_argument('-d', '--debug', dest='debug', required=False,
     action='store_true', default=False, help='Turn on verbose diagnostics')
   argumentParser.add_argument('-q', '--quiet', dest='quiet', required=False,
@@ -89,29 +196,72 @@ def NormalizeArguments(options):
   options.min_battery_level= int(options.min_battery_level.pop())
   options.charging_limit= int(options.charging_limit.pop())
 
-  # convert lists of single strings into strings
-  options.token_file = str(options.token_file.pop())
+  # convert lists of single strings into strings (a fleet brings its own token files)
+  if (options.token_file == None) == (options.fleet == None):
+    raise ValueError('Specify either a token file or a fleet')
+  if options.fleet and options.daemon:
+    raise ValueError('A fleet is checked in a single pass (run a daemon per account instead)')
+  if options.token_file != None:
+    options.token_file = str(options.token_file.pop())
   
+  # names of cars to skip (a set for constant-time lookups)
   if (options.ignore == None):
-      options.ignore= []
+      options.ignore= set()
+  else:
+      options.ignore= set(options.ignore)
+
+  # daemon intervals for each check and task
+  intervals= dict(DEFAULT_INTERVALS)
+  for interval in (options.intervals or []):
+    check, separator, seconds= interval.partition('=')
+    if (check not in DEFAULT_INTERVALS) or not separator or (float(seconds) <= 0):
+      raise ValueError('Invalid interval "{}" (expected CHECK=SECONDS with CHECK one of {})'.format(
+        interval, ', '.join(sorted(DEFAULT_INTERVALS))))
+    intervals[check]= float(seconds)
+  options.intervals= intervals
+
+  # debug output reports every field of every state, so keep the raw state around
+  options.keep_raw_state= options.debug
+
+  # keep enough pooled connections for every concurrent vehicle check
+  options.jobs= max(1, options.jobs)
+  options.pool_maxsize= max(options.jobs, 10)
+  options.max_concurrency= options.pool_maxsize
+  if options.rate_limit <= 0:
+    raise ValueError('Invalid rate limit {} (expected a positive number of requests per second)'.format(
+      options.rate_limit))
   
-  if (options.home_latitude == None or options.home_longitude == None):
-    options.home= 'unknown'
+  # named zones (home from its coordinates, if supplied); no home zone means relying on HomeLink
+  zones= [parse_zone(zone, MAXIMUM_NEAR_DISTANCE) for zone in (options.zones or [])]
+  if (options.home_latitude != None and options.home_longitude != None):
+    zones.append(Zone(ZONE_HOME, options.home_latitude.pop(), options.home_longitude.pop(),
+      MAXIMUM_NEAR_DISTANCE))
+
+  if zones:
+    options.geofence= Geofence(zones)
   else:
-    options.home= (options.home_latitude.pop(), options.home_longitude.pop())
+    options.geofence= None
     
   return options
 
 
-# Read our token from the specified file
+# Read our token from the specified file (once per process, shared with TeslaRequest)
 #
 def GetToken(options):
-  with open(options.token_file, 'r') as token_file:
-    options.token= json.loads(token_file.read())
+  if options.token_file != None:
+    options.token= TokenStore.open(options.token_file).get()
 
   return options
 
 
+# Check the token and refresh it if it is due to expire
+#
+def CheckToken(options, request):
+  token_days_remaining= ReportToken(options, request)
+  if token_days_remaining <= options.min_expiration_days:
+    RefreshToken(options, request, token_days_remaining)
+
+
 # Report token state
 #
 def ReportToken(options, request):
@@ -148,10 +298,8 @@ def RefreshToken(options, request, days):
     else:
       print('Refreshing expired token!')
   
+  # the token store saves the refreshed token (or picks up one refreshed by another process)
   request.force_token_refresh()
-  
-  with open(options.token_file, 'w') as token_file:
-    json.dump(request.get_token(), token_file, sort_keys=True, indent=4, separators=(',', ': '))
 
   return ReportToken(options, request)
 
@@ -179,9 +327,35 @@ def ReportSecure(request, vehicle_id, name, debug):
       print('{} is unlocked!'.format(name))
 
 
+# Report how fresh the state behind our answers is
+#
+def ReportFreshness(request, vehicle_id, name, debug, quiet):
+  freshness= request.get_state_freshness(vehicle_id)
+
+  if debug:
+    for state_type in sorted(freshness.keys()):
+      age= freshness[state_type]['age']
+      if freshness[state_type]['served_stale']:
+        status= 'stale (asleep)'
+      elif freshness[state_type]['stale']:
+        status= 'expired'
+      else:
+        status= 'fresh'
+      print('{:>18}: {} ({} seconds old)'.format(state_type, status,
+        'unknown' if age is None else int(age)))
+  elif not quiet:
+    # only state served stale for a sleeping car (expired state, after a command say, was fetched)
+    stale= [state_type for state_type in freshness.keys() if freshness[state_type]['served_stale']]
+    if stale:
+      age= max(freshness[state_type]['age'] or 0 for state_type in stale)
+      print('{} is asleep; answers based on state up to {} minute{} old'.format(
+        name, int(age // 60), PluralS(age // 60)))
+
+
 # Check vehicle charging limit and reset it, if necessary and appropriate
+# (returns False if a reset was sent and failed)
 #
-def CheckChargingLimit(request, vehicle_id, name, charging_limit, debug):
+def CheckChargingLimit(request, vehicle_id, name, charging_limit, debug, pending= None):
   if request.get_charging_limit(vehicle_id) != charging_limit:
     if debug:
       print('{:>18}: set to {}% instead of {}%'.format(
@@ -196,20 +370,18 @@ def CheckChargingLimit(request, vehicle_id, name, charging_limit, debug):
       else:
         print('{} kept as is since the car is charging'.format(name))
     else:
-      if request.set_charging_limit(vehicle_id, charging_limit):
-        if debug:
-          print('{:>18}: reset to {}%'.format('charging limit', charging_limit))
-        else:
-          print('{} charging limit reset to {}%'.format(name, charging_limit))
-      else:
-        if debug:
-          print('{:>18}: failed reset!'.format('charging limit'))
-        else:
-          print('{} failed charging limit reset!'.format(name))
+      return IssueCommand(request, vehicle_id, pending, debug,
+        COMMAND_SET_CHARGE_LIMIT, request.set_charging_limit, (charging_limit,),
+        ('{:>18}: reset to {}%'.format('charging limit', charging_limit),
+          '{} charging limit reset to {}%'.format(name, charging_limit)),
+        ('{:>18}: failed reset!'.format('charging limit'),
+          '{} failed charging limit reset!'.format(name)))
   else:
     if debug:
       print('{:>18}: already set to {}'.format('charging limit', charging_limit))
 
+  return True
+
 
 # Check vehicle charge level and report it if below threshold
 #
@@ -230,8 +402,9 @@ def CheckChargeLevel(request, vehicle_id, name, min_battery_level, debug):
 
 
 # Check vehicle Sentry Mode setting and activate or deactivate it as appropriate
+# (returns False if a change was sent and failed)
 #
-def CheckSentryMode(request, vehicle_id, name, home, debug):
+def CheckSentryMode(request, vehicle_id, name, home, debug, pending= None):
   if home:
     if request.is_vehicle_sentry_mode_active(vehicle_id):
       if debug:
@@ -239,11 +412,11 @@ def CheckSentryMode(request, vehicle_id, name, home, debug):
       else:
         print('{} is home, but Sentry Mode is active!'.format(name))
         
-      if request.set_sentry_mode_off(vehicle_id):
-        if debug:
-          print('{:>18}: turned off'.format('sentry mode'))
-        else:
-          print('{} Sentry Mode turned off'.format(name))
+      return IssueCommand(request, vehicle_id, pending, debug,
+        COMMAND_SET_SENTRY_MODE, request.set_sentry_mode_off, (),
+        ('{:>18}: turned off'.format('sentry mode'), '{} Sentry Mode turned off'.format(name)),
+        ('{:>18}: failed to turn off!'.format('sentry mode'),
+          '{} failed to turn Sentry Mode off!'.format(name)))
   else:
     if request.is_vehicle_parked(vehicle_id):
       if not request.is_vehicle_sentry_mode_active(vehicle_id):
@@ -252,28 +425,68 @@ def CheckSentryMode(request, vehicle_id, name, home, debug):
         else:
           print('{} is parked away from home, but Sentry Mode is not active!'.format(name))
           
-        if request.set_sentry_mode_on(vehicle_id):
-          if debug:
-            print('{:>18}: activated'.format('sentry mode'))
-          else:
-            print('{} Sentry Mode activated'.format(name))
+        return IssueCommand(request, vehicle_id, pending, debug,
+          COMMAND_SET_SENTRY_MODE, request.set_sentry_mode_on, (),
+          ('{:>18}: activated'.format('sentry mode'), '{} Sentry Mode activated'.format(name)),
+          ('{:>18}: failed to activate!'.format('sentry mode'),
+            '{} failed to activate Sentry Mode!'.format(name)))
+
+  return True
     
 
+# Issue a command and report its outcome, or queue it (with its report) when a pending batch is given
+# (returns whether the command succeeded, or True once queued)
+#
+def IssueCommand(request, vehicle_id, pending, debug, command, setter, arguments, succeeded, failed):
+  if pending is None:
+    result= setter(vehicle_id, *arguments)
+    ReportCommand(result, debug, succeeded, failed)
+    return bool(result)
+  else:
+    setter(vehicle_id, *arguments, queued= True)
+    pending[command]= (succeeded, failed)
+    return True
+
+
+# Send a vehicle's queued commands behind a single wake-up and report each outcome
+#
+def FlushCommands(request, vehicle_id, pending, debug):
+  for outcome in request.flush_commands(vehicle_id):
+    succeeded, failed= pending.get(outcome['command'], (None, None))
+    if debug and (outcome['error'] is not None):
+      print('{:>18}: {}'.format(outcome['command'], outcome['error'].args[0]))
+    if outcome.get('skipped'):
+      if debug:
+        print('{:>18}: skipped, already satisfied'.format(outcome['command']))
+      continue
+    ReportCommand(outcome['result'], debug, succeeded, failed)
+
+
+# Print the (debug or regular) message matching a command result
+#
+def ReportCommand(result, debug, succeeded, failed):
+  message= succeeded if result else failed
+  if message:
+    print(message[0] if debug else message[1])
+
+
 # Is the cat at (near) home?
 #
-def IsHome(request, vehicle_id, home, debug):
-  if (isinstance(home, str)):
+def IsHome(request, vehicle_id, geofence, debug):
+  home= geofence.get_zone(ZONE_HOME) if geofence else None
+  if home is None:
     if debug:
-      print('{:>18}: {}'.format('home', home))
+      print('{:>18}: {}'.format('home', 'unknown'))
       
     return IsNearHomeLink(request, vehicle_id, debug)
     
   else:
     if debug:
-      print('{:>18}: home location supplied {}'.format('home', home))
+      print('{:>18}: home location supplied {}'.format('home', (home.latitude, home.longitude)))
     
-    distance= geopy.distance.distance(home, request.get_vehicle_location(vehicle_id)).m
-    if (distance < MAXIMUM_NEAR_DISTANCE):
+    location= request.get_vehicle_location(vehicle_id)
+    distance= home.get_distance(location)
+    if (distance <= home.radius):
       if debug:
         print('{:>18}: home'.format('location'))
         print('{:>18}: {} meters'.format('distance', round(distance, 2)))
@@ -281,9 +494,8 @@ def IsHome(request, vehicle_id, home, debug):
       return True
     else:
       if debug:
-        print('{:>18}: not at home'.format('location'))
-        print('{:>18}: {} miles'.format('distance',
-          round(geopy.distance.distance(home, request.get_vehicle_location(vehicle_id)).miles, 3)))
+        print('{:>18}: {}'.format('location', geofence.classify(location) or 'not at home'))
+        print('{:>18}: {} miles'.format('distance', round(distance / METERS_PER_MILE, 3)))
         
       return False
     
@@ -316,89 +528,486 @@ def PluralS(number):
     return 's'
 
 
-# Main entry point
 #
-def main():
+# Collect print() output of worker threads into per-vehicle buffers
+#
+class VehicleOutput:
+
+  # Constructor
+  def __init__(self, stream):
+    self.stream= stream
+    self.__local= threading.local()
+
+
+  # Write to the calling thread's buffer (or straight through if it is not capturing)
+  def write(self, text):
+    buffer= getattr(self.__local, 'buffer', None)
+    if buffer is None:
+      return self.stream.write(text)
+    else:
+      return buffer.write(text)
+
+
+  # Flush the underlying stream
+  def flush(self):
+    self.stream.flush()
+
+
+  # Start capturing output of the calling thread
+  def capture(self):
+    self.__local.buffer= io.StringIO()
+
+
+  # Stop capturing output of the calling thread and return what was captured
+  def release(self):
+    text= self.__local.buffer.getvalue()
+    self.__local.buffer= None
+    return text
+
+
+# Check a single vehicle and report on it
+#
+def CheckVehicle(options, request, counter):
+  name= str(counter)
   try:
-    # instantiate our Tesla API and initialize from command line arguments
-    options= NormalizeArguments(GetArguments())
-    options= GetToken(options)
-    request= TeslaRequest(options)
+    name= request.get_vehicle_name(counter)
+    if (name in options.ignore):
+      if options.debug:
+        print('')
+        print('')
+        print('{:>14}: {}'.format(name, "Skipping..."))
+      return
     
-    # check the token first
-    token_days_remaining= ReportToken(options, request)
-    if token_days_remaining <= options.min_expiration_days:
-      RefreshToken(options, request, token_days_remaining)
+    vehicle_id= request.get_vehicle_id(counter)
+    if options.debug:
+      print('')
+      print('')
+      print('{:>14}: {}'.format(name, vehicle_id))
+
+    state= request.get_vehicle_online_state(counter)
+    if request.is_vehicle_in_service(counter):
+      if options.debug:
+          print('{:>18}: {}'.format('state', "in service"))
+      return
+    else:
+      if options.debug:
+        print('{:>18}: {}'.format('state', state))
+          
+    ReportSecure(request, counter, name, options.debug)
+    
+    # queue any remedial commands so they share a single wake-up
+    pending= {}
+    if IsHome(request, counter, options.geofence, options.debug):
+      CheckChargingLimit(request, counter, name, options.charging_limit, options.debug, pending)
+      CheckChargeLevel(request, counter, name, options.min_battery_level, options.debug)
+      CheckSentryMode(request, counter, name, True, options.debug, pending)
+    else:
+      CheckSentryMode(request, counter, name, False, options.debug, pending)
+    FlushCommands(request, counter, pending, options.debug)
+
+    ReportFreshness(request, counter, name, options.debug, options.quiet)
+
+    if options.debug:
+      ReportChanges(request, counter)
+      
+      
+  except Exception as error:
+    ReportVehicleError(options, request, counter, name, error)
+
+
+# Report what changed in vehicle state since the previous snapshot (everything, the first time)
+#
+def ReportChanges(request, vehicle_id):
+  changes= request.get_changes(vehicle_id)
+
+  for state_type in sorted(changes.keys()):
+    print('')
+    print('{:>18}: {} change{}'.format(state_type, len(changes[state_type]),
+      PluralS(len(changes[state_type]))))
+    for key in sorted(changes[state_type].keys()):
+      old, new= changes[state_type][key]
+      print('{:>18}  {}: {} -> {}'.format('', key, json.dumps(old), json.dumps(new)))
+
+
+# Obtain the state a check depends on and return its revisions
+#
+def GetStateRevisions(request, vehicle_id, check):
+  getters= {STATE_VEHICLE : request.get_vehicle_state, STATE_CHARGE : request.get_charge_state,
+    STATE_DRIVE : request.get_drive_state}
+
+  revisions= []
+  for state_type in CHECK_STATES[check]:
+    getters[state_type](vehicle_id)
+    revisions.append(request.get_state_revision(vehicle_id, state_type))
+
+  return tuple(revisions)
+
+
+# Report problems accessing a vehicle
+#
+def ReportVehicleError(options, request, counter, name, error):
+  if options.debug:
+    print(type(error))
+    print(error.args[0])
+    for argument in range(1, len(error.args)):
+      print('\t' + str(error.args[argument]))
+  elif not options.quiet:
+    print('Could not access vehicle named "{}" (status is {})'.format(name,
+      request.get_vehicle_online_state(counter)))
+    print(error.args[0])
+    for argument in range(1, len(error.args)):
+      print('\t' + str(error.args[argument]))
+
+
+# Run a task on a worker thread and return its captured output
+#
+def CaptureTask(output, task):
+  output.capture()
+  try:
+    task()
+  finally:
+    report= output.release()
+
+  return report
+
+
+# Run tasks, several at a time, printing each report in task order
+#
+def RunConcurrently(options, tasks):
+  output= VehicleOutput(sys.stdout)
+  sys.stdout= output
+  try:
+    with concurrent.futures.ThreadPoolExecutor(max_workers= options.jobs) as executor:
+      reports= [executor.submit(CaptureTask, output, task) for task in tasks]
+
+      for report in reports:
+        output.stream.write(report.result())
+        output.stream.flush()
+  finally:
+    sys.stdout= output.stream
+
+
+# Check all vehicles, several at a time, printing each report in vehicle order
+#
+def CheckVehiclesConcurrently(options, request, vehicle_count):
+  RunConcurrently(options, [
+    (lambda counter= counter: CheckVehicle(options, request, counter))
+    for counter in range(0, vehicle_count)])
+
+
+# Check every vehicle of a single account (once, or on a schedule in daemon mode)
+#
+def CheckAccount(options):
+  # instantiate our Tesla API
+  request= TeslaRequest(options)
+    
+  # check the token first
+  CheckToken(options, request)
   
 
-    # figure out what we have
-    vehicle_count= request.get_vehicle_count()
+  # figure out what we have
+  vehicle_count= request.get_vehicle_count()
+  if options.debug:
+    print('')
+    print('{:>14}: {}'.format('Count', vehicle_count))
+
+  if options.daemon:
+    RunDaemon(options, request)
+  elif options.jobs > 1:
+    CheckVehiclesConcurrently(options, request, vehicle_count)
+  else:
+    for counter in range(0, vehicle_count):
+      CheckVehicle(options, request, counter)
+
+
+# Check every account of a fleet in one pass, several vehicles at a time across all accounts,
+# printing one report in account and vehicle order
+#
+def CheckFleet(options):
+  fleet= FleetManager(options.fleet, options, options.jobs)
+  output= VehicleOutput(sys.stdout)
+  sys.stdout= output
+  try:
+    tokens= fleet.map_accounts(lambda account, request:
+      CaptureTask(output, lambda: CheckToken(options, request)))
+    checks= fleet.map_vehicles(lambda account, request, counter:
+      CaptureTask(output, lambda: CheckVehicle(options, request, counter)))
+  finally:
+    sys.stdout= output.stream
+    fleet.close()
+
+  ReportFleet(options, fleet, tokens, checks)
+
+
+# Print the merged report of a fleet pass
+#
+def ReportFleet(options, fleet, tokens, checks):
+  for account, token in zip(fleet.get_accounts(), tokens):
+    account_checks= [check for check in checks if check['account'] == account]
+    vehicle_count= len([check for check in account_checks if check['vehicle'] != None])
+
     if options.debug:
       print('')
+      print('{:>14}: {}'.format('Account', account))
       print('{:>14}: {}'.format('Count', vehicle_count))
 
-    for counter in range(0, vehicle_count):
-      try:
-        name= request.get_vehicle_name(counter)
-        if (name in options.ignore):
-          if options.debug:
-            print('')
-            print('')
-            print('{:>14}: {}'.format(name, "Skipping..."))
-          continue
-        
-        vehicle_id= request.get_vehicle_id(counter)
-        if options.debug:
-          print('')
-          print('')
-          print('{:>14}: {}'.format(name, vehicle_id))
-  
-        state= request.get_vehicle_online_state(counter)
-        if request.is_vehicle_in_service(counter):
-          if options.debug:
-              print('{:>18}: {}'.format('state', "in service"))
-          continue
-        else:
-          if options.debug:
-            print('{:>18}: {}'.format('state', state))
-              
-        ReportSecure(request, counter, name, options.debug)
-        
-        if IsHome(request, counter, options.home, options.debug):
-          CheckChargingLimit(request, counter, name, options.charging_limit, options.debug)
-          CheckChargeLevel(request, counter, name, options.min_battery_level, options.debug)
-          CheckSentryMode(request, counter, name, True, options.debug)
-        else:
-          CheckSentryMode(request, counter, name, False, options.debug)
-  
-  
+    # an account whose token could not be loaded has nothing more to report
+    if fleet.get_request(account) == None:
+      ReportFleetError('Could not load the token of account "{}"'.format(account), token['error'])
+      continue
+
+    if token['error'] != None:
+      ReportFleetError('Could not check the token of account "{}"'.format(account), token['error'])
+    else:
+      sys.stdout.write(token['result'])
+
+    for check in account_checks:
+      if check['vehicle'] == None:
+        ReportFleetError('Could not list the vehicles of account "{}"'.format(account), check['error'])
+      elif check['error'] != None:
+        ReportFleetError('Could not check vehicle #{} of account "{}"'.format(check['vehicle'],
+          account), check['error'])
+      else:
+        sys.stdout.write(check['result'])
+  sys.stdout.flush()
+
+
+# Report a fleet task that failed
+#
+def ReportFleetError(message, error):
+  print(message)
+  for argument in error.args:
+    print('\t' + str(argument))
+
+
+# Run a single scheduled check of the vehicle with the specified ID
+# (skipped when none of the state it depends on changed since it last ran)
+#
+def RunCheck(options, request, vehicle_id, check, revisions= None):
+  vehicle= request.get_vehicle_by_id(vehicle_id)
+  if (vehicle is None) or (vehicle.name in options.ignore):
+    return
+
+  counter= vehicle.index
+  name= vehicle.name
+  try:
+    if request.is_vehicle_in_service(counter):
+      return
+
+    if revisions is not None:
+      current= GetStateRevisions(request, counter, check)
+      if revisions.get((vehicle_id, check)) == current:
         if options.debug:
           print('')
-          print(json.dumps(request.get_vehicle_state(counter), sort_keys=True, indent=4, separators=(',', ': ')))
-          print('')
-          print(json.dumps(request.get_charge_state(counter), sort_keys=True, indent=4, separators=(',', ': ')))
-          print('')
-          print(json.dumps(request.get_drive_state(counter), sort_keys=True, indent=4, separators=(',', ': ')))
-          print('')
-          
-          
-      except Exception as error:
-        # problems accessing a vehicle
-        if options.debug:
-          print(type(error))
-          print(error.args[0])
-          for counter in range(1, len(error.args)):
-            print('\t' + str(error.args[counter]))
-        elif not options.quiet:
-          print('Could not access vehicle named "{}" (status is {})'.format(name,
-            request.get_vehicle_online_state(counter)))
-          print(error.args[0])
-          for counter in range(1, len(error.args)):
-            print('\t' + str(error.args[counter]))
-          
-        # skip to the next vehicle
+          print('{:>14}: {} unchanged ({})'.format(name, check, datetime.datetime.now()))
+        return
+
+    if options.debug:
+      print('')
+      print('{:>14}: {} ({})'.format(name, check, datetime.datetime.now()))
+
+    # a failed remedial command leaves the car out of policy, so the check must run again
+    settled= True
+    if check == CHECK_SECURE:
+      ReportSecure(request, counter, name, options.debug)
+    elif check == CHECK_CHARGING:
+      if IsHome(request, counter, options.geofence, options.debug):
+        settled= CheckChargingLimit(request, counter, name, options.charging_limit, options.debug)
+        CheckChargeLevel(request, counter, name, options.min_battery_level, options.debug)
+    elif check == CHECK_SENTRY:
+      settled= CheckSentryMode(request, counter, name,
+        IsHome(request, counter, options.geofence, options.debug), options.debug)
+
+    ReportFreshness(request, counter, name, options.debug, options.quiet)
+
+    if options.debug:
+      ReportChanges(request, counter)
+
+    if revisions is not None:
+      if settled:
+        revisions[(vehicle_id, check)]= current
+      else:
+        revisions.pop((vehicle_id, check), None)
+
+  except Exception as error:
+    ReportVehicleError(options, request, counter, name, error)
+
+
+# Re-list owned vehicles (daemon mode)
+#
+def RefreshVehicles(options, request):
+  try:
+    request.refresh_vehicles()
+    if options.debug:
+      print('')
+      print('{:>14}: {}'.format('Count', request.get_vehicle_count()))
+  except Exception as error:
+    if not options.quiet:
+      print('Could not refresh the list of vehicles')
+      print(error.args[0])
+
+
+# Refresh the token in the background well before it expires
+#
+def MaintainToken(scheduler, request, stop):
+  # settings are re-read every time round, so a reload takes effect from the next wait on
+  while not stop.wait(scheduler.options.intervals[TASK_TOKEN]):
+    options= scheduler.options
+    try:
+      token_days_remaining= ReportToken(options, request)
+      if token_days_remaining <= options.min_expiration_days:
+        RefreshToken(options, request, token_days_remaining)
+    except Exception as error:
+      print('Could not refresh token')
+      print(error.args[0])
+
+
+#
+# Run each check of each vehicle on its own schedule, keeping one TeslaRequest warm
+#
+class CheckScheduler:
+
+  # Constructor
+  def __init__(self, options, request):
+    self.options= options
+    self.__request= request
+    self.__queue= []
+    self.__sequence= itertools.count()
+    self.__revisions= {}
+    self.__signal= threading.Event()
+    self.__reload= False
+    self.__stop= False
+
+
+  # Schedule a check (or task) at the specified time
+  def __push(self, due, vehicle_id, check):
+    heapq.heappush(self.__queue, (due, next(self.__sequence), vehicle_id, check))
+
+
+  # Schedule every check of every vehicle right away (and re-listing vehicles later)
+  def __schedule_all(self):
+    now= time.time()
+    self.__queue= []
+    self.__revisions.clear()
+    for vehicle in self.__request.get_vehicles():
+      for check in [CHECK_SECURE, CHECK_CHARGING, CHECK_SENTRY]:
+        self.__push(now, vehicle.id, check)
+    self.__push(now + self.options.intervals[TASK_VEHICLES], None, TASK_VEHICLES)
+
+
+  # Ask the scheduler to re-read its settings (signal handler)
+  def request_reload(self, signal_number= None, frame= None):
+    self.__reload= True
+    self.__signal.set()
+
+
+  # Ask the scheduler to stop (signal handler)
+  def request_stop(self, signal_number= None, frame= None):
+    self.__stop= True
+    self.__signal.set()
+
+
+  # Re-read settings from the command line (and any @file in it)
+  def __reload_options(self):
+    try:
+      options= NormalizeArguments(GetArguments())
+    except (Exception, SystemExit) as error:
+      print('Could not reload settings, keeping the current ones ({})'.format(error))
+      return
+
+    # keep settings the running TeslaRequest was built with
+    for setting in ['token_file', 'token', 'jobs', 'pool_maxsize', 'max_concurrency',
+      'rate_limit', 'breaker_failures', 'breaker_cooldown', 'cache_file', 'history_dir',
+      'metrics_file', 'command_verify_delay', 'idempotent',
+      'keep_raw_state']:
+      if hasattr(self.options, setting):
+        setattr(options, setting, getattr(self.options, setting))
+    self.options= options
+
+    if not options.quiet:
+      print('Settings reloaded')
+
+
+  # Run due checks until asked to stop
+  def run(self):
+    self.__schedule_all()
+
+    while not self.__stop:
+      if self.__reload:
+        self.__reload= False
+        self.__reload_options()
+        self.__schedule_all()
+
+      now= time.time()
+      due= []
+      while self.__queue and (self.__queue[0][0] <= now):
+        due.append(heapq.heappop(self.__queue)[2:])
+
+      if not due:
+        self.__signal.wait(self.__queue[0][0] - now)
+        self.__signal.clear()
         continue
-        
+
+      tasks= []
+      for vehicle_id, check in due:
+        if check == TASK_VEHICLES:
+          tasks.append(lambda: RefreshVehicles(self.options, self.__request))
+        else:
+          tasks.append(lambda vehicle_id= vehicle_id, check= check:
+            RunCheck(self.options, self.__request, vehicle_id, check, self.__revisions))
+
+      if self.options.jobs > 1:
+        RunConcurrently(self.options, tasks)
+      else:
+        for task in tasks:
+          task()
+
+      # reschedule relative to completion so a slow check never piles up
+      now= time.time()
+      for vehicle_id, check in due:
+        if (check == TASK_VEHICLES) or self.__request.get_vehicle_by_id(vehicle_id):
+          self.__push(now + self.options.intervals[check], vehicle_id, check)
+
+      # pick up vehicles added to the account since we last looked
+      if any(check == TASK_VEHICLES for vehicle_id, check in due):
+        scheduled= set(entry[2] for entry in self.__queue)
+        for vehicle in self.__request.get_vehicles():
+          if vehicle.id not in scheduled:
+            for check in [CHECK_SECURE, CHECK_CHARGING, CHECK_SENTRY]:
+              self.__push(now, vehicle.id, check)
+
+
+# Keep checking vehicles until terminated
+#
+def RunDaemon(options, request):
+  scheduler= CheckScheduler(options, request)
+  signal.signal(signal.SIGHUP, scheduler.request_reload)
+  signal.signal(signal.SIGTERM, scheduler.request_stop)
+  signal.signal(signal.SIGINT, scheduler.request_stop)
+
+  stop= threading.Event()
+  token_keeper= threading.Thread(target= MaintainToken, args= (scheduler, request, stop),
+    daemon= True)
+  token_keeper.start()
+
+  try:
+    scheduler.run()
+  finally:
+    stop.set()
+
+
+# Main entry point
+#
+def main():
+  try:
+    # initialize from command line arguments
+    options= NormalizeArguments(GetArguments())
+    options= GetToken(options)
+
+    if options.fleet:
+      CheckFleet(options)
+    else:
+      CheckAccount(options)
 
   except Exception as error:
     print(type(error))
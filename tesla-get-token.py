@@ -6,9 +6,8 @@
 #
 
 import argparse
-import json
 import sys
-from teslarequest import TeslaRequest
+from teslarequest import TeslaRequest, TokenStore, OWNERAPI_CACHE_TTL, decode_json, encode_json
 
 #
 # Define some global constants
@@ -32,6 +31,13 @@ def GetArguments():
   argumentParser.add_argument('-o', '--output', '--output-file',
     dest='output', required=False, action='store',
     help='File to store Tesla Owner API authorization token')
+  argumentParser.add_argument('--owner-api-file', dest='owner_api_file', required=False,
+    action='store', help='Use Owner API client parameters from this file (never download them)')
+  argumentParser.add_argument('--owner-api-cache', dest='owner_api_cache_file', required=False,
+    action='store', help='File caching downloaded Owner API client parameters')
+  argumentParser.add_argument('--owner-api-cache-ttl', dest='owner_api_cache_ttl', required=False,
+    type=int, default=OWNERAPI_CACHE_TTL, action='store',
+    help='Seconds to reuse cached Owner API client parameters before downloading them again')
 
   argumentParser.add_argument('-d', '--debug', dest='debug', required=False,
     action='store_true', default=False, help='Turn on verbose diagnostics')
@@ -58,6 +64,9 @@ def NormalizeArguments(options, e_mail, password):
   if password:
     options.password= password
 
+  # we only need the token -- never list vehicles
+  options.lazy= True
+
   return options
 
 
@@ -69,7 +78,7 @@ def main():
     secret= ''
     for line in sys.stdin:
       secret+= line
-    secret= json.loads(secret)
+    secret= decode_json(secret)
   except:
     print('Failed to provide properly formatted (JSON) login information as input.')
     print('Terminating...')
@@ -86,10 +95,9 @@ def main():
 
       # write it out to our designated output file (or STDOUT if none)
       if options.output:
-        with open(options.output, 'w') as output_file:
-          json.dump(request.get_token(), output_file, sort_keys=True, indent=4, separators=(',', ': '))
+        TokenStore.open(options.output).save(request.get_token())
       else:
-        print(json.dumps(request.get_token(), sort_keys=True, indent=4, separators=(',', ': ')))
+        print(encode_json(request.get_token(), pretty= True))
 
     except Exception as error:
       print(type(error))
@@ -6,10 +6,9 @@
 #
 
 import argparse
-import json
 import sys
 import datetime
-from teslarequest import TeslaRequest
+from teslarequest import TeslaRequest, TokenStore, encode_json
 
 #
 # Define some global constants
@@ -59,8 +58,7 @@ def GetArguments():
 # Read our token from the specified file
 #
 def GetToken(options):
-  input_file= open(options.token_file)
-  token= json.loads(input_file.read())
+  token= TokenStore.open(options.token_file).get()
   token_creation= datetime.datetime.fromtimestamp(token[KEY_TOKEN_CREATION])
   token_expiration= datetime.datetime.fromtimestamp(token[KEY_TOKEN_CREATION]
                     + token[KEY_TOKEN_EXPIRATION])
@@ -97,6 +95,7 @@ def main():
     # instantiate our Tesla API and initialize from command line arguments
     options= GetArguments()
     days_remaining= GetToken(options)
+    options.lazy= True    # we only need the token -- never list vehicles
     request= TeslaRequest(options)
 
     # figure out what we have
@@ -104,15 +103,12 @@ def main():
       print('')
       print('{:>18}: {}'.format('URL', request.get_url()))
       
+    # the token store writes the refreshed token back atomically, under a lock shared with other tools
     request.force_token_refresh()
-    
-    # write it out to our designated output file (or STDOUT if none)
-    with open(options.token_file, 'w') as token_file:
-      json.dump(request.get_token(), token_file, sort_keys=True, indent=4, separators=(',', ': '))
       
     if options.debug:
       print('')
-      print(json.dumps(request.get_token(), sort_keys=True, indent=4, separators=(',', ': ')))
+      print(encode_json(request.get_token(), pretty= True))
 
   except Exception as error:
     print(type(error))
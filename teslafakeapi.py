@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+
+
+#
+# Import all necessary libraries
+#
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+#
+# Define some global constants
+#
+
+VERSION= '0.0.1'
+
+DEFAULT_HOST= '127.0.0.1'
+DEFAULT_PORT= 0                   # pick any free port
+DEFAULT_FLEET_SIZE= 3
+DEFAULT_LATENCY= 0.05             # seconds per request
+DEFAULT_LATENCY_JITTER= 0.2       # fraction of latency randomized either way
+DEFAULT_ASLEEP_FRACTION= 0.5      # share of the fleet asleep at start
+DEFAULT_WAKE_TIME= 2.0            # seconds from the first wake-up request to being online
+DEFAULT_FALL_ASLEEP_TIME= 0       # seconds of inactivity before an online car dozes off (0 for never)
+DEFAULT_ERROR_RATE= 0.0           # share of requests answered with a server error
+DEFAULT_THROTTLE_RATE= 0.0        # share of requests answered with 429 Too Many Requests
+DEFAULT_RETRY_AFTER= 1            # seconds advertised in Retry-After when throttling
+DEFAULT_TOKEN_LIFETIME= 3888000   # seconds (45 days)
+FIRST_VEHICLE_ID= 10000000000     # simulated vehicles are numbered from here
+
+CLIENT_ID= 'fake-client-id'
+CLIENT_SECRET= 'fake-client-secret'
+
+REQUEST_CLIENT_TOKENS= '/owner_api_parameters'
+REQUEST_STATS= '/_stats'
+REQUEST_RESET= '/_reset'
+
+ENDPOINT_TOKEN= 'token'
+ENDPOINT_VEHICLES= 'vehicles'
+ENDPOINT_WAKE_UP= 'wake_up'
+ENDPOINT_VEHICLE_DATA= 'vehicle_data'
+ENDPOINT_DATA_REQUEST= 'data_request/'
+ENDPOINT_COMMAND= 'command/'
+ENDPOINT_CLIENT_TOKENS= 'client_tokens'
+ENDPOINT_OTHER= 'other'
+
+STATE_TYPES= ['vehicle_state', 'climate_state', 'charge_state', 'drive_state', 'gui_settings']
+
+PATTERN_VEHICLE= re.compile(r'^/api/1/vehicles/(\d+)/(.+)$')
+
+HOME_LOCATION= (41.8781, -87.6298)
+
+
+#
+# Build representative Owner API payloads
+#
+
+# Return the full state of a freshly generated vehicle
+#
+def make_vehicle_states(vehicle_id, rng= random):
+  now= int(time.time() * 1000)
+  latitude= HOME_LOCATION[0] + rng.uniform(-0.05, 0.05)
+  longitude= HOME_LOCATION[1] + rng.uniform(-0.05, 0.05)
+
+  return {
+    'vehicle_state' : {
+      'api_version' : 10, 'autopark_state_v2' : 'standby', 'calendar_supported' : True,
+      'car_version' : '2020.48.26', 'center_display_state' : 0,
+      'df' : 0, 'dr' : 0, 'pf' : 0, 'pr' : 0, 'ft' : 0, 'rt' : rng.choice([0, 0, 0, 1]),
+      'fd_window' : 0, 'fp_window' : 0, 'rd_window' : 0, 'rp_window' : 0,
+      'homelink_nearby' : rng.choice([True, False]), 'is_user_present' : False,
+      'locked' : rng.choice([True, True, False]), 'notifications_supported' : True,
+      'odometer' : round(rng.uniform(1000, 90000), 6), 'parsed_calendar_supported' : True,
+      'remote_start' : False, 'remote_start_enabled' : True, 'remote_start_supported' : True,
+      'sentry_mode' : rng.choice([True, False]), 'sentry_mode_available' : True,
+      'software_update' : {'download_perc' : 0, 'expected_duration_sec' : 2700,
+        'install_perc' : 1, 'status' : '', 'version' : ''},
+      'speed_limit_mode' : {'active' : False, 'current_limit_mph' : 85.0,
+        'max_limit_mph' : 90, 'min_limit_mph' : 50, 'pin_code_set' : False},
+      'timestamp' : now, 'valet_mode' : False, 'vehicle_name' : 'Car {}'.format(vehicle_id),
+    },
+    'climate_state' : {
+      'battery_heater' : False, 'battery_heater_no_power' : None, 'climate_keeper_mode' : 'off',
+      'defrost_mode' : 0, 'driver_temp_setting' : 21.0, 'fan_status' : 0,
+      'inside_temp' : round(rng.uniform(5, 30), 1), 'is_auto_conditioning_on' : False,
+      'is_climate_on' : False, 'is_front_defroster_on' : False, 'is_preconditioning' : False,
+      'is_rear_defroster_on' : False, 'left_temp_direction' : 0, 'max_avail_temp' : 28.0,
+      'min_avail_temp' : 15.0, 'outside_temp' : round(rng.uniform(-10, 35), 1),
+      'passenger_temp_setting' : 21.0, 'remote_heater_control_enabled' : False,
+      'right_temp_direction' : 0, 'seat_heater_left' : 0, 'seat_heater_right' : 0,
+      'side_mirror_heaters' : False, 'timestamp' : now, 'wiper_blade_heater' : False,
+    },
+    'charge_state' : {
+      'battery_heater_on' : False, 'battery_level' : rng.randint(20, 95),
+      'battery_range' : round(rng.uniform(60, 300), 2), 'charge_current_request' : 48,
+      'charge_current_request_max' : 48, 'charge_enable_request' : True,
+      'charge_energy_added' : round(rng.uniform(0, 40), 2), 'charge_limit_soc' : rng.choice([80, 80, 90]),
+      'charge_limit_soc_max' : 100, 'charge_limit_soc_min' : 50, 'charge_limit_soc_std' : 90,
+      'charge_miles_added_ideal' : 66.0, 'charge_miles_added_rated' : 66.0,
+      'charge_port_cold_weather_mode' : False, 'charge_port_door_open' : False,
+      'charge_port_latch' : 'Engaged', 'charge_rate' : 0.0, 'charge_to_max_range' : False,
+      'charger_actual_current' : 0, 'charger_phases' : None, 'charger_pilot_current' : 48,
+      'charger_power' : 0, 'charger_voltage' : 2,
+      'charging_state' : rng.choice(['Disconnected', 'Stopped', 'Connected', 'Charging']),
+      'conn_charge_cable' : 'SAE', 'est_battery_range' : round(rng.uniform(60, 300), 2),
+      'fast_charger_brand' : '<invalid>', 'fast_charger_present' : False,
+      'fast_charger_type' : '<invalid>', 'ideal_battery_range' : round(rng.uniform(60, 300), 2),
+      'managed_charging_active' : False, 'managed_charging_start_time' : None,
+      'managed_charging_user_canceled' : False, 'max_range_charge_counter' : 0,
+      'minutes_to_full_charge' : 0, 'not_enough_power_to_heat' : None,
+      'scheduled_charging_pending' : rng.choice([True, False]),
+      'scheduled_charging_start_time' : None, 'time_to_full_charge' : 0.0,
+      'timestamp' : now, 'trip_charging' : False, 'usable_battery_level' : 80,
+      'user_charge_enable_request' : None,
+    },
+    'drive_state' : {
+      'gps_as_of' : now // 1000, 'heading' : rng.randint(0, 359),
+      'latitude' : latitude, 'longitude' : longitude,
+      'native_latitude' : latitude, 'native_location_supported' : 1,
+      'native_longitude' : longitude, 'native_type' : 'wgs',
+      'power' : 0, 'shift_state' : rng.choice([None, 'P', 'P', 'D']), 'speed' : None,
+      'timestamp' : now,
+    },
+    'gui_settings' : {
+      'gui_24_hour_time' : False, 'gui_charge_rate_units' : 'mi/hr',
+      'gui_distance_units' : 'mi/hr', 'gui_range_display' : 'Rated',
+      'gui_temperature_units' : 'F', 'show_range_units' : True, 'timestamp' : now,
+    },
+  }
+
+
+# Return the listing entry of a freshly generated vehicle
+#
+def make_vehicle_listing(vehicle_id, online_state):
+  return {
+    'id' : vehicle_id, 'vehicle_id' : vehicle_id % 1000000, 'vin' : '5YJ3E1EA{:09d}'.format(vehicle_id % 1000000000),
+    'display_name' : 'Car {}'.format(vehicle_id), 'option_codes' : 'AD15,MDL3,PBSB,RENA,BT37,ID3W,RF3G',
+    'color' : None, 'tokens' : ['abcdef1234567890', '1234567890abcdef'], 'state' : online_state,
+    'in_service' : False, 'id_s' : str(vehicle_id), 'calendar_enabled' : True, 'api_version' : 10,
+    'backseat_token' : None, 'backseat_token_updated_at' : None,
+  }
+
+
+#
+# Define a single simulated vehicle
+#
+class FakeVehicle:
+
+  # Constructor
+  def __init__(self, vehicle_id, asleep, rng):
+    self.vehicle_id= vehicle_id
+    self.listing= make_vehicle_listing(vehicle_id, 'asleep' if asleep else 'online')
+    self.states= make_vehicle_states(vehicle_id, rng)
+    self.wake_started= None
+    self.wake_seconds= 0.0
+    self.last_activity= time.time()
+
+
+  # Return the online state, advancing any wake-up in progress or dozing off when idle
+  def get_online_state(self, wake_time, fall_asleep_time):
+    now= time.time()
+
+    if self.listing['state'] == 'online':
+      if fall_asleep_time and (now - self.last_activity > fall_asleep_time):
+        self.listing['state']= 'asleep'
+    elif self.wake_started is not None and (now - self.wake_started >= wake_time):
+      self.listing['state']= 'online'
+      self.wake_seconds+= now - self.wake_started
+      self.wake_started= None
+      self.last_activity= now
+
+    return self.listing['state']
+
+
+#
+# Define our stand-in Owner API server
+#
+class FakeOwnerAPI:
+
+  # Constructor
+  def __init__(self, host= DEFAULT_HOST, port= DEFAULT_PORT, fleet_size= DEFAULT_FLEET_SIZE,
+    latency= DEFAULT_LATENCY, latency_jitter= DEFAULT_LATENCY_JITTER,
+    asleep_fraction= DEFAULT_ASLEEP_FRACTION, wake_time= DEFAULT_WAKE_TIME,
+    fall_asleep_time= DEFAULT_FALL_ASLEEP_TIME, error_rate= DEFAULT_ERROR_RATE,
+    bulk_state= True, seed= None, throttle_rate= DEFAULT_THROTTLE_RATE,
+    retry_after= DEFAULT_RETRY_AFTER):
+      self.latency= latency
+      self.latency_jitter= latency_jitter
+      self.wake_time= wake_time
+      self.fall_asleep_time= fall_asleep_time
+      self.error_rate= error_rate
+      self.throttle_rate= throttle_rate
+      self.retry_after= retry_after
+      self.bulk_state= bulk_state
+
+      self.__seed= seed
+      self.__lock= threading.Lock()
+      self.__fleet_size= fleet_size
+      self.__asleep_fraction= asleep_fraction
+      self.reset()
+
+      self.__server= ThreadingHTTPServer((host, port), self.__make_handler())
+      self.__server.daemon_threads= True
+      self.__thread= None
+
+
+  # Regenerate the fleet (identically for a fixed seed) and clear all counters
+  def reset(self):
+    with self.__lock:
+      self.__rng= random.Random(self.__seed)
+      asleep_count= int(round(self.__fleet_size * self.__asleep_fraction))
+      self.vehicles= {}
+      for counter in range(0, self.__fleet_size):
+        vehicle_id= FIRST_VEHICLE_ID + counter
+        self.vehicles[vehicle_id]= FakeVehicle(vehicle_id, counter < asleep_count, self.__rng)
+
+      self.counters= {}
+      self.errors= 0
+      self.throttled= 0
+      self.tokens_issued= 0
+
+
+  # Return the base URL of the running server
+  def get_url(self):
+    host, port= self.__server.server_address[:2]
+    return 'http://{}:{}'.format(host, port)
+
+
+  # Return a token accepted by this server (with Owner API parameters pointing at it)
+  def make_token(self):
+    return {
+      'access_token' : 'fake-access-token', 'token_type' : 'bearer',
+      'expires_in' : DEFAULT_TOKEN_LIFETIME, 'created_at' : int(time.time()),
+      'refresh_token' : 'fake-refresh-token',
+      'baseurl' : self.get_url(), 'id' : CLIENT_ID, 'secret' : CLIENT_SECRET,
+    }
+
+
+  # Return request counters and accumulated wake-up time
+  def get_stats(self):
+    with self.__lock:
+      return {
+        'requests' : sum(self.counters.values()),
+        'endpoints' : dict(self.counters),
+        'errors' : self.errors,
+        'throttled' : self.throttled,
+        'wake_seconds' : sum(vehicle.wake_seconds for vehicle in self.vehicles.values()),
+      }
+
+
+  # Serve requests on a background thread
+  def start(self):
+    self.__thread= threading.Thread(target= self.__server.serve_forever, daemon= True)
+    self.__thread.start()
+    return self
+
+
+  # Serve requests on the calling thread until interrupted
+  def serve_forever(self):
+    self.__server.serve_forever()
+
+
+  # Shut the server down
+  def stop(self):
+    self.__server.shutdown()
+    self.__server.server_close()
+
+
+  # Handle a single request and return status code and response body
+  def handle(self, method, path, headers, payload):
+    path= path.split('?')[0]
+
+    if path == REQUEST_STATS:
+      return 200, self.get_stats()
+    if path == REQUEST_RESET:
+      self.reset()
+      return 200, {'response' : True}
+
+    endpoint= self.__classify(method, path)
+    with self.__lock:
+      self.counters[endpoint]= self.counters.get(endpoint, 0) + 1
+
+    if self.latency:
+      time.sleep(self.latency * self.__rng.uniform(1 - self.latency_jitter, 1 + self.latency_jitter))
+
+    if self.error_rate and (self.__rng.random() < self.error_rate):
+      with self.__lock:
+        self.errors+= 1
+      return 503, {'error' : 'upstream internal error'}
+
+    if self.throttle_rate and (self.__rng.random() < self.throttle_rate):
+      with self.__lock:
+        self.throttled+= 1
+      return 429, {'error' : 'too many requests'}
+
+    if endpoint == ENDPOINT_CLIENT_TOKENS:
+      return 200, {'v1' : {'baseurl' : self.get_url(), 'id' : CLIENT_ID, 'secret' : CLIENT_SECRET}}
+    if endpoint == ENDPOINT_TOKEN:
+      with self.__lock:
+        self.tokens_issued+= 1
+        access_token= 'fake-access-token-{}'.format(self.tokens_issued)
+      token= {key : value for key, value in self.make_token().items()
+        if key not in ['baseurl', 'id', 'secret']}
+      token['access_token']= access_token
+      return 200, token
+
+    if not headers.get('Authorization', '').lower().startswith('bearer '):
+      return 401, {'error' : 'authorization_required_for_txid'}
+
+    if endpoint == ENDPOINT_VEHICLES:
+      with self.__lock:
+        listing= []
+        for vehicle in self.vehicles.values():
+          vehicle.get_online_state(self.wake_time, self.fall_asleep_time)
+          listing.append(dict(vehicle.listing))
+      return 200, {'response' : listing, 'count' : len(listing)}
+
+    match= PATTERN_VEHICLE.match(path)
+    if not match or int(match.group(1)) not in self.vehicles:
+      return 404, {'error' : 'not_found'}
+
+    with self.__lock:
+      return self.__handle_vehicle(self.vehicles[int(match.group(1))], match.group(2), payload)
+
+
+  # Handle a request addressed to a single vehicle (called with our lock held)
+  def __handle_vehicle(self, vehicle, action, payload):
+    online_state= vehicle.get_online_state(self.wake_time, self.fall_asleep_time)
+
+    if action == ENDPOINT_WAKE_UP:
+      if (online_state != 'online') and (vehicle.wake_started is None):
+        vehicle.wake_started= time.time()
+      return 200, {'response' : dict(vehicle.listing)}
+
+    if online_state != 'online':
+      return 408, {'response' : None, 'error' : 'vehicle unavailable: {:state=>"asleep"}',
+        'error_description' : ''}
+
+    vehicle.last_activity= time.time()
+
+    if action == ENDPOINT_VEHICLE_DATA:
+      if not self.bulk_state:
+        return 404, {'error' : 'not_found'}
+      data= dict(vehicle.listing)
+      data.update(vehicle.states)
+      return 200, {'response' : data}
+
+    if action.startswith(ENDPOINT_DATA_REQUEST):
+      state_type= action[len(ENDPOINT_DATA_REQUEST):]
+      if state_type not in vehicle.states:
+        return 404, {'error' : 'not_found'}
+      return 200, {'response' : vehicle.states[state_type]}
+
+    if action == 'mobile_enabled':
+      return 200, {'response' : True}
+
+    if action.startswith(ENDPOINT_COMMAND):
+      return 200, {'response' : {'result' : self.__apply_command(
+        vehicle, action[len(ENDPOINT_COMMAND):], payload or {}), 'reason' : ''}}
+
+    return 404, {'error' : 'not_found'}
+
+
+  # Apply the effect of a command to a vehicle and return the result flag
+  def __apply_command(self, vehicle, command, payload):
+    charge= vehicle.states['charge_state']
+
+    if command == 'set_charge_limit':
+      charge['charge_limit_soc']= int(payload.get('percent', charge['charge_limit_soc']))
+    elif command == 'charge_max_range':
+      charge['charge_limit_soc']= charge['charge_limit_soc_max']
+    elif command == 'charge_standard':
+      charge['charge_limit_soc']= charge['charge_limit_soc_std']
+    elif command == 'set_sentry_mode':
+      vehicle.states['vehicle_state']['sentry_mode']= bool(payload.get('on'))
+    elif command == 'door_lock':
+      vehicle.states['vehicle_state']['locked']= True
+    elif command == 'door_unlock':
+      vehicle.states['vehicle_state']['locked']= False
+
+    return True
+
+
+  # Name the endpoint a request is addressed to (for counters)
+  def __classify(self, method, path):
+    if path == REQUEST_CLIENT_TOKENS:
+      return ENDPOINT_CLIENT_TOKENS
+    if path == '/oauth/token':
+      return ENDPOINT_TOKEN
+    if path == '/api/1/vehicles':
+      return ENDPOINT_VEHICLES
+
+    match= PATTERN_VEHICLE.match(path)
+    if match:
+      return match.group(2)
+
+    return ENDPOINT_OTHER
+
+
+  # Build a request handler class bound to this server
+  def __make_handler(self):
+    api= self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version= 'HTTP/1.1'
+
+      def do_GET(self):
+        self.__respond('GET')
+
+      def do_POST(self):
+        self.__respond('POST')
+
+      def log_message(self, format, *args):
+        pass
+
+      def __respond(self, method):
+        length= int(self.headers.get('Content-Length') or 0)
+        payload= None
+        if length:
+          try:
+            payload= json.loads(self.rfile.read(length))
+          except ValueError:
+            payload= None
+
+        status, body= api.handle(method, self.path, self.headers, payload)
+        content= json.dumps(body).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if status == 429:
+          self.send_header('Retry-After', str(api.retry_after))
+        self.end_headers()
+        self.wfile.write(content)
+
+    return Handler
+
+
+#
+# Define our functions
+#
+
+# Collect all expected and detected arguments from the command line
+#
+def GetArguments():
+  argumentParser= argparse.ArgumentParser(description= 'Local stand-in for the Tesla Owner API')
+
+  argumentParser.add_argument('--host', dest='host', default=DEFAULT_HOST, action='store',
+    help='Address to listen on')
+  argumentParser.add_argument('-p', '--port', dest='port', type=int, default=8080, action='store',
+    help='Port to listen on')
+  argumentParser.add_argument('-n', '--fleet-size', dest='fleet_size', type=int,
+    default=DEFAULT_FLEET_SIZE, action='store', help='Number of simulated vehicles')
+  argumentParser.add_argument('-l', '--latency', dest='latency', type=float,
+    default=DEFAULT_LATENCY, action='store', help='Seconds of latency added to each request')
+  argumentParser.add_argument('-a', '--asleep', dest='asleep_fraction', type=float,
+    default=DEFAULT_ASLEEP_FRACTION, action='store', help='Share of the fleet asleep at start')
+  argumentParser.add_argument('-w', '--wake-time', dest='wake_time', type=float,
+    default=DEFAULT_WAKE_TIME, action='store', help='Seconds a sleeping car takes to wake up')
+  argumentParser.add_argument('--fall-asleep', dest='fall_asleep_time', type=float,
+    default=DEFAULT_FALL_ASLEEP_TIME, action='store',
+    help='Seconds of inactivity before an online car dozes off (0 for never)')
+  argumentParser.add_argument('-e', '--error-rate', dest='error_rate', type=float,
+    default=DEFAULT_ERROR_RATE, action='store', help='Share of requests failing with 503')
+  argumentParser.add_argument('--throttle-rate', dest='throttle_rate', type=float,
+    default=DEFAULT_THROTTLE_RATE, action='store', help='Share of requests throttled with 429')
+  argumentParser.add_argument('--retry-after', dest='retry_after', type=int,
+    default=DEFAULT_RETRY_AFTER, action='store', help='Seconds advertised in Retry-After when throttling')
+  argumentParser.add_argument('--no-bulk', dest='bulk_state', action='store_false', default=True,
+    help='Do not offer the combined vehicle_data endpoint')
+  argumentParser.add_argument('--seed', dest='seed', type=int, action='store',
+    help='Random seed for a reproducible fleet')
+  argumentParser.add_argument('-t', '--token-file', dest='token_file', action='store',
+    help='Write a token accepted by this server to the specified file')
+
+  argumentParser.add_argument('-v', '--version', action='version',
+    version='%(prog)s '+VERSION)
+
+  return argumentParser.parse_args()
+
+
+# Main entry point
+#
+def main():
+  options= GetArguments()
+  api= FakeOwnerAPI(host= options.host, port= options.port, fleet_size= options.fleet_size,
+    latency= options.latency, asleep_fraction= options.asleep_fraction,
+    wake_time= options.wake_time, fall_asleep_time= options.fall_asleep_time,
+    error_rate= options.error_rate, bulk_state= options.bulk_state, seed= options.seed,
+    throttle_rate= options.throttle_rate, retry_after= options.retry_after)
+
+  if options.token_file:
+    with open(options.token_file, 'w') as token_file:
+      json.dump(api.make_token(), token_file, sort_keys=True, indent=4, separators=(',', ': '))
+
+  print('Serving a fleet of {} at {}'.format(options.fleet_size, api.get_url()))
+  try:
+    api.serve_forever()
+  except KeyboardInterrupt:
+    api.stop()
+
+
+#
+# Execute if we were run as a program
+#
+
+if __name__ == '__main__':
+  main()
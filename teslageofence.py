@@ -0,0 +1,209 @@
+#
+# Import all necessary libraries
+#
+
+import math
+
+
+#
+# Define some global constants
+#
+
+VERSION= '0.0.1'
+
+EARTH_RADIUS= 6371008.8           # meters (mean radius)
+METERS_PER_DEGREE= math.pi * EARTH_RADIUS / 180
+METERS_PER_MILE= 1609.344
+DEFAULT_RADIUS= 30                # meters
+
+ZONE_HOME= 'home'
+
+# NumPy is imported on first batch use (None until then, False if unavailable)
+numpy= None
+
+
+#
+# Define our functions
+#
+
+# Return the NumPy module, importing it on first use (None if it is not installed)
+#
+def get_numpy():
+  global numpy
+  if numpy is None:
+    try:
+      import numpy as module
+      numpy= module
+    except ImportError:
+      # batch classification falls back on a plain loop
+      numpy= False
+
+  return numpy or None
+
+
+# Return the great-circle distance in meters between two (latitude, longitude) points
+#
+def haversine(origin, destination):
+  latitude_1, longitude_1= math.radians(origin[0]), math.radians(origin[1])
+  latitude_2, longitude_2= math.radians(destination[0]), math.radians(destination[1])
+
+  a= (math.sin((latitude_2 - latitude_1) / 2) ** 2
+    + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2)
+
+  return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Parse a zone specification ("NAME=LATITUDE,LONGITUDE[,RADIUS]") into a Zone
+#
+def parse_zone(specification, radius= DEFAULT_RADIUS):
+  name, separator, coordinates= specification.partition('=')
+  values= coordinates.split(',')
+  if (not name) or (not separator) or (len(values) not in [2, 3]):
+    raise ValueError('Invalid zone "{}" (expected NAME=LATITUDE,LONGITUDE[,RADIUS])'.format(
+      specification))
+
+  if len(values) == 3:
+    radius= float(values[2])
+
+  return Zone(name, float(values[0]), float(values[1]), radius)
+
+
+#
+# Define a named circular zone with a precomputed bounding box
+#
+class Zone:
+  __slots__= ('name', 'latitude', 'longitude', 'radius',
+    'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude')
+
+  # Constructor
+  def __init__(self, name, latitude, longitude, radius= DEFAULT_RADIUS):
+    if radius <= 0:
+      raise ValueError('Zone "{}" needs a positive radius'.format(name))
+
+    self.name= name
+    self.latitude= latitude
+    self.longitude= longitude
+    self.radius= radius
+
+    # a box around the circle: anything outside it cannot be inside the zone
+    latitude_span= radius / METERS_PER_DEGREE
+    self.min_latitude= latitude - latitude_span
+    self.max_latitude= latitude + latitude_span
+
+    # longitude degrees shrink toward the poles (a box reaching a pole spans all longitudes)
+    scale= math.cos(math.radians(min(90.0, max(abs(self.min_latitude), abs(self.max_latitude)))))
+    if (scale <= 0) or (latitude_span / scale >= 180):
+      self.min_longitude, self.max_longitude= -180.0, 180.0
+    else:
+      longitude_span= latitude_span / scale
+      self.min_longitude= longitude - longitude_span
+      self.max_longitude= longitude + longitude_span
+
+
+  # Could the specified point be inside the zone (cheap bounding box test)?
+  def is_in_box(self, location):
+    if not (self.min_latitude <= location[0] <= self.max_latitude):
+      return False
+
+    longitude= location[1]
+    if self.min_longitude < -180:
+      return (longitude >= self.min_longitude + 360) or (longitude <= self.max_longitude)
+    if self.max_longitude > 180:
+      return (longitude >= self.min_longitude) or (longitude <= self.max_longitude - 360)
+    return self.min_longitude <= longitude <= self.max_longitude
+
+
+  # Return the distance in meters from the zone center to the specified point
+  def get_distance(self, location):
+    return haversine((self.latitude, self.longitude), location)
+
+
+  # Is the specified point inside the zone?
+  def contains(self, location):
+    return self.is_in_box(location) and (self.get_distance(location) <= self.radius)
+
+
+#
+# Define our geofence: a set of named zones classifying one location or a whole fleet's at once
+#
+class Geofence:
+
+  # Constructor
+  def __init__(self, zones= None):
+    self.__zones= {}
+    for zone in (zones or []):
+      self.add_zone(zone)
+
+
+  # Add (or replace) a zone
+  def add_zone(self, zone):
+    self.__zones[zone.name]= zone
+
+
+  # Return the named zone (None if there is no such zone)
+  def get_zone(self, name):
+    return self.__zones.get(name)
+
+
+  # Return all zones
+  def get_zones(self):
+    return list(self.__zones.values())
+
+
+  # Return the distance in meters from the center of the named zone to the specified point
+  def get_distance(self, name, location):
+    return self.__zones[name].get_distance(location)
+
+
+  # Return the name of the zone containing the specified point (the nearest center wins
+  # where zones overlap), or None
+  def classify(self, location):
+    if location is None:
+      return None
+
+    nearest= None
+    nearest_distance= None
+    for zone in self.__zones.values():
+      if zone.is_in_box(location):
+        distance= zone.get_distance(location)
+        if (distance <= zone.radius) and ((nearest is None) or (distance < nearest_distance)):
+          nearest, nearest_distance= zone.name, distance
+
+    return nearest
+
+
+  # Classify many points at once (None for unknown locations); vectorized when NumPy is available
+  def classify_batch(self, locations):
+    locations= list(locations)
+    numpy= get_numpy()
+    if (numpy is None) or (not self.__zones) or (not locations):
+      return [self.classify(location) for location in locations]
+
+    known= [index for index, location in enumerate(locations) if location is not None]
+    results= [None] * len(locations)
+    if not known:
+      return results
+
+    zones= list(self.__zones.values())
+    points= numpy.radians(numpy.array([locations[index] for index in known], dtype= float))
+    centers= numpy.radians(numpy.array([(zone.latitude, zone.longitude) for zone in zones],
+      dtype= float))
+    radii= numpy.array([zone.radius for zone in zones], dtype= float)
+
+    # points along rows, zones along columns
+    latitudes= points[:, 0:1]
+    longitudes= points[:, 1:2]
+    a= (numpy.sin((centers[:, 0] - latitudes) / 2) ** 2
+      + numpy.cos(latitudes) * numpy.cos(centers[:, 0])
+      * numpy.sin((centers[:, 1] - longitudes) / 2) ** 2)
+    distances= 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+    distances[distances > radii]= numpy.inf
+    nearest= numpy.argmin(distances, axis= 1)
+    inside= numpy.isfinite(distances[numpy.arange(len(known)), nearest])
+
+    for row, index in enumerate(known):
+      if inside[row]:
+        results[index]= zones[nearest[row]].name
+
+    return results
@@ -3,15 +3,44 @@
 #
 
 import requests
+import requests.adapters
+import array
+import atexit
+import bisect
+import concurrent.futures
+import contextlib
+import copy
+import email.utils
 import json
+import math
+import mmap
+import os
+import random
+import sqlite3
+import tempfile
+import threading
 import time
+import types
+
+try:
+  import fcntl
+except ImportError:
+  # no advisory file locks on this platform -- in-process single-flight only
+  fcntl= None
+
+try:
+  import orjson
+except ImportError:
+  # JSON goes through the standard library codec
+  orjson= None
+
+from urllib3.util.retry import Retry
 
 #
 # Define some global constants
 #
 
 VERSION= '0.2.2'
-MAX_ATTEMPTS= 20
 
 # API request building blocks
 API_VERSION= 'v1'
@@ -33,17 +62,83 @@ REQUEST_DATA_COMMANDS= {  REQUEST_DATA_STATE_MOBILE_ACCESS : '/',
                           REQUEST_DATA_STATE_DRIVE : '/data_request/',
                           REQUEST_DATA_STATE_GUI : '/data_request/',
 }
+REQUEST_DATA_ALL= '/vehicle_data'
+REQUEST_DATA_ALL_STATES= [REQUEST_DATA_STATE_VEHICLE, REQUEST_DATA_STATE_CLIMATE,
+                          REQUEST_DATA_STATE_CHARGE, REQUEST_DATA_STATE_DRIVE,
+                          REQUEST_DATA_STATE_GUI]
 
 
 COMMAND_WAKE_UP= 'wake_up'
+COMMAND_SET_CHARGE_LIMIT= 'set_charge_limit'
+COMMAND_CHARGE_MAX_RANGE= 'charge_max_range'
+COMMAND_CHARGE_STANDARD= 'charge_standard'
+COMMAND_SET_SENTRY_MODE= 'set_sentry_mode'
+COMMAND_DOOR_LOCK= 'door_lock'
+COMMAND_DOOR_UNLOCK= 'door_unlock'
+COMMAND_GROUPS= {               # queued commands in the same group supersede each other
+  COMMAND_SET_CHARGE_LIMIT : 'charge_limit',
+  COMMAND_CHARGE_MAX_RANGE : 'charge_limit',
+  COMMAND_CHARGE_STANDARD : 'charge_limit',
+  COMMAND_SET_SENTRY_MODE : 'sentry_mode',
+  COMMAND_DOOR_LOCK : 'locks',
+  COMMAND_DOOR_UNLOCK : 'locks',
+}
+COMMAND_STATE_EFFECTS= {        # state each command changes: key <- ('payload'|'state', key) or ('value', value)
+  COMMAND_SET_CHARGE_LIMIT : ('charge_state', {'charge_limit_soc' : ('payload', 'percent')}),
+  COMMAND_CHARGE_MAX_RANGE : ('charge_state', {'charge_limit_soc' : ('state', 'charge_limit_soc_max')}),
+  COMMAND_CHARGE_STANDARD : ('charge_state', {'charge_limit_soc' : ('state', 'charge_limit_soc_std')}),
+  COMMAND_SET_SENTRY_MODE : ('vehicle_state', {'sentry_mode' : ('payload', 'on')}),
+  COMMAND_DOOR_LOCK : ('vehicle_state', {'locked' : ('value', True)}),
+  COMMAND_DOOR_UNLOCK : ('vehicle_state', {'locked' : ('value', False)}),
+}
+COMMAND_VERIFY_DELAY= 60        # seconds (command-derived state is re-read after this long, if verifying)
 
 
 CACHE_EXPIRATION_LIMIT= 300     # seconds
-ATTEMPT_RETRY_DELAY= 5          # seconds
+OWNERAPI_CACHE_TTL= 604800      # seconds (reuse downloaded Owner API parameters for a week)
+CACHE_STORE_TIMEOUT= 30         # seconds (wait this long for another process to release the store)
+MAX_STALENESS= 3600             # seconds (passive mode serves sleeping cars' state up to this old)
+
+HISTORY_TIMESTAMP= 'timestamp'  # column of sample times (unsigned 32-bit seconds)
+HISTORY_TIMESTAMP_TYPE= 'I'
+HISTORY_BOOLEAN_UNKNOWN= -1     # stored for booleans missing from a sample (floats store NaN)
+HISTORY_LOCK= 'lock'            # suffix of the file serializing appends and repairs across processes
+HISTORY_FIELDS= {               # recorded fields per state type: 'f' 32-bit float, 'b' boolean byte
+  'charge_state' : [('battery_level', 'f'), ('charge_limit_soc', 'f')],
+  'vehicle_state' : [('locked', 'b'), ('sentry_mode', 'b'), ('odometer', 'f')],
+  'drive_state' : [('latitude', 'f'), ('longitude', 'f'), ('speed', 'f')],
+}
+
+WAKE_INITIAL_DELAY= 1           # seconds before the first retry
+WAKE_MAXIMUM_DELAY= 15          # seconds (ceiling for the backoff)
+WAKE_BACKOFF= 2                 # delay multiplier per attempt
+WAKE_JITTER= 0.25               # fraction of each delay randomized either way
+WAKE_DEADLINE= 100              # seconds (give up waking after this long)
+WAKE_ONLINE_FRESHNESS= 60       # seconds (trust a reported online state for this long)
+
+# Deprecated: wake-ups follow WakeStrategy (these only spell out its default WAKE_DEADLINE)
+MAX_ATTEMPTS= 20
+ATTEMPT_RETRY_DELAY= WAKE_DEADLINE // MAX_ATTEMPTS  # seconds
+
+BREAKER_FAILURES= 3             # consecutive failures that open a circuit (0 never opens one)
+BREAKER_COOLDOWN= 900           # seconds an open circuit fails fast before letting one probe through
+BREAKER_BACKOFF= 2              # cooldown multiplier for each failed probe...
+BREAKER_MAX_COOLDOWN= 21600     # ...up to this many seconds
+BREAKER_VEHICLE= 'vehicle/'     # circuit name prefixes (followed by a vehicle ID, or by the account
+BREAKER_ENDPOINT= 'endpoint/'   # and endpoint separated by a colon)
+BREAKER_STATE_CLOSED= 'closed'
+BREAKER_STATE_OPEN= 'open'
+BREAKER_STATE_HALF_OPEN= 'half-open'
 
 KEY_API_ID= 'id'
 KEY_API_SECRET= 'secret'
 KEY_API_BASEURL= 'baseurl'
+KEY_API_CACHE_TIMESTAMP= 'fetched_at'
+KEY_API_CACHE_PARAMETERS= 'parameters'
+
+JSON_CODEC_ORJSON= 'orjson'
+JSON_CODEC_STANDARD= 'json'
+JSON_CODECS= [JSON_CODEC_ORJSON, JSON_CODEC_STANDARD]
 
 KEY_TOKEN= 'access_token'
 KEY_TOKEN_CREATION= 'created_at'
@@ -58,12 +153,15 @@ KEY_VEHICLES= 'response'
 KEY_VEHICLE_COUNT= 'count'
 KEY_VEHICLE_NAME= 'display_name'
 KEY_VEHICLE_ID= 'id'
+KEY_VEHICLE_VIN= 'vin'
 KEY_VEHICLE_ONLINE_STATE= 'state'
 KEY_VEHICLE_INSERVICE_STATE= 'in_service'
 
 KEY_RESPONSE= 'response'
 KEY_RESULT= 'result'
 KEY_CACHE_EXPIRATION= 'cache_expiration'
+KEY_CACHE_TIMESTAMP= 'cache_timestamp'
+KEY_CACHE_COMMAND= 'cache_command'
 
 KEY_STATE_VEHICLE_DOOR_DRIVER_FRONT= 'df'
 KEY_STATE_VEHICLE_DOOR_DRIVER_REAR= 'dr'
@@ -74,6 +172,7 @@ KEY_STATE_VEHICLE_DOOR_TRUNK_REAR= 'rt'
 KEY_STATE_VEHICLE_LOCKED= 'locked'
 KEY_STATE_VEHICLE_HOMELINK= 'homelink_nearby'
 KEY_STATE_VEHICLE_SENTRY= 'sentry_mode'
+KEY_STATE_VEHICLE_ODOMETER= 'odometer'
 
 KEY_STATE_CHARGE_LEVEL= 'battery_level'
 KEY_STATE_CHARGE_STATE= 'charging_state'
@@ -81,6 +180,21 @@ KEY_STATE_CHARGE_PENDING= 'scheduled_charging_pending'
 KEY_STATE_CHARGE_LIMIT= 'charge_limit_soc'
 
 KEY_STATE_DRIVE_SHIFT= 'shift_state'
+KEY_STATE_DRIVE_LATITUDE= 'latitude'
+KEY_STATE_DRIVE_LONGITUDE= 'longitude'
+KEY_STATE_DRIVE_SPEED= 'speed'
+
+STATE_FIELDS= {                 # fields kept in cached state records (everything the helpers read)
+  'charge_state' : [KEY_STATE_CHARGE_LEVEL, KEY_STATE_CHARGE_STATE, KEY_STATE_CHARGE_PENDING,
+    KEY_STATE_CHARGE_LIMIT, 'charge_limit_soc_max', 'charge_limit_soc_std'],
+  'vehicle_state' : [KEY_STATE_VEHICLE_DOOR_DRIVER_FRONT, KEY_STATE_VEHICLE_DOOR_DRIVER_REAR,
+    KEY_STATE_VEHICLE_DOOR_PASSENGER_FRONT, KEY_STATE_VEHICLE_DOOR_PASSENGER_REAR,
+    KEY_STATE_VEHICLE_DOOR_TRUNK_FRONT, KEY_STATE_VEHICLE_DOOR_TRUNK_REAR,
+    KEY_STATE_VEHICLE_LOCKED, KEY_STATE_VEHICLE_HOMELINK, KEY_STATE_VEHICLE_SENTRY,
+    KEY_STATE_VEHICLE_ODOMETER],
+  'drive_state' : [KEY_STATE_DRIVE_SHIFT, KEY_STATE_DRIVE_LATITUDE, KEY_STATE_DRIVE_LONGITUDE,
+    KEY_STATE_DRIVE_SPEED],
+}
 
 
 VALUE_STATE_CHARGE_CHARGING_READY= ['Connected', 'Stopped']
@@ -94,14 +208,1200 @@ VALUE_STATE_UNKNOWN= 'unknown'
 
 
 
+POOL_CONNECTIONS= 4             # distinct hosts kept in the pool
+POOL_MAXSIZE= 10                # connections kept per host
+POOL_BLOCK= False               # wait for a free connection instead of opening an extra one
+POOL_MAX_RETRIES= 3             # retries for idempotent requests on connection errors
+POOL_RETRY_BACKOFF= 0.5         # seconds (exponential backoff factor)
+POOL_RETRY_STATUS_CODES= [502, 503, 504]
+
+SCHEDULER_RATE= 2.0             # requests per second per account (sustained)
+SCHEDULER_BURST= 10             # requests per account allowed back to back
+SCHEDULER_MAX_CONCURRENCY= 10   # requests per account in flight (while nothing is throttled)
+SCHEDULER_MIN_CONCURRENCY= 1
+SCHEDULER_DECREASE= 0.5         # concurrency multiplier on throttling or server errors
+SCHEDULER_RETRIES= 3            # resends of a throttled request before giving up
+SCHEDULER_RETRY_AFTER= 5        # seconds to pause an account throttled without Retry-After
+SCHEDULER_MAX_RETRY_AFTER= 300  # seconds (longest pause honored)
+PRIORITY_COMMAND= 0             # commands and tokens go ahead of...
+PRIORITY_POLL= 1                # ...state polling, listings and wake-ups
+
+FLEET_MAX_WORKERS= 10           # account and vehicle tasks in flight across a whole fleet
+FLEET_POOL_MAXSIZE= 20          # connections kept per host in the pool the fleet shares
+FLEET_ACCOUNT_ARGUMENTS= ['token', 'token_store', 'e_mail', 'password', 'scheduler', 'metrics_file']
+TOKEN_LOCK_SUFFIX= '.lock'      # side file a token store locks (never a token file itself)
+
+
+METRICS_LATENCY_BUCKETS= [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]   # seconds
+METRICS_PREFIX= 'teslarequest'
+METRICS_FORMAT_JSON= 'json'
+METRICS_FORMAT_PROMETHEUS= 'prometheus'
+
+ENDPOINT_OWNER_API= 'owner_api'
+ENDPOINT_TOKEN= 'token'
+ENDPOINT_VEHICLES= 'vehicles'
+ENDPOINT_VEHICLE_DATA= 'vehicle_data'
+ENDPOINT_COMMAND= 'command/'
+
+
 # API request result codes
 STATUS_CODE_OK= 200
+STATUS_CODE_NOT_FOUND= 404
 STATUS_CODE_REQUEST_TIMEOUT= 408
+STATUS_CODE_TOO_MANY_REQUESTS= 429
+STATUS_CODE_SERVER_ERROR= 500
+HEADER_RETRY_AFTER= 'Retry-After'
 STATUS_RESPONSE= 'response'
 STATUS_RESPONSE_RESULT= 'result'
 STATUS_RESPONSE_REASON= 'reason'
 
 
+# JSON codec in use (the fastest one installed unless set otherwise)
+_json_codec= JSON_CODEC_ORJSON if orjson is not None else JSON_CODEC_STANDARD
+
+# Owner API parameters already obtained by this process (keyed by cache file or source URL)
+_owner_api_cache= {}
+_owner_api_cache_lock= threading.Lock()
+
+
+#
+# Return (account, token file) pairs from a directory of token files (skipping hidden files and
+# token store locks) or a manifest listing them one per line as [ACCOUNT=]PATH (relative paths are
+# relative to the manifest)
+#
+def load_token_files(source):
+  if os.path.isdir(source):
+    entries= [os.path.join(source, name) for name in sorted(os.listdir(source))
+      if (not name.startswith('.')) and (not name.endswith(TOKEN_LOCK_SUFFIX))
+        and os.path.isfile(os.path.join(source, name))]
+  else:
+    with open(source, 'r') as manifest:
+      entries= [line.strip() for line in manifest]
+    entries= [entry for entry in entries if entry and not entry.startswith('#')]
+
+  token_files= []
+  accounts= set()
+  for entry in entries:
+    account, separator, path= entry.rpartition('=')
+    if not separator:
+      account= os.path.splitext(os.path.basename(path))[0]
+    if not os.path.isabs(path):
+      path= os.path.join(os.path.dirname(os.path.abspath(source)), path)
+    if account in accounts:
+      raise ValueError('Duplicate account "{}" in {}'.format(account, source))
+
+    accounts.add(account)
+    token_files.append((account, path))
+
+  return token_files
+
+
+# Build a pooled, keep-alive HTTP session (share one across TeslaRequest instances to share the pool)
+#
+def create_session(pool_connections= POOL_CONNECTIONS, pool_maxsize= POOL_MAXSIZE,
+  pool_block= POOL_BLOCK, max_retries= POOL_MAX_RETRIES, adapter= None):
+  session= requests.Session()
+
+  if adapter is None:
+    adapter= create_adapter(pool_connections, pool_maxsize, pool_block, max_retries)
+
+  mount_adapter(session, adapter)
+
+  return session
+
+
+# Build a connection pool adapter with a retry policy for idempotent requests
+#
+def create_adapter(pool_connections= POOL_CONNECTIONS, pool_maxsize= POOL_MAXSIZE,
+  pool_block= POOL_BLOCK, max_retries= POOL_MAX_RETRIES):
+  if isinstance(max_retries, int):
+    # throttling (429) is left to the request scheduler, which pauses the whole account
+    max_retries= Retry(total= max_retries, backoff_factor= POOL_RETRY_BACKOFF,
+      status_forcelist= POOL_RETRY_STATUS_CODES, raise_on_status= False,
+      respect_retry_after_header= False)
+
+  return requests.adapters.HTTPAdapter(pool_connections= pool_connections,
+    pool_maxsize= pool_maxsize, pool_block= pool_block, max_retries= max_retries)
+
+
+# Mount an adapter on a session for both secure and plain URLs
+#
+def mount_adapter(session, adapter):
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+
+
+# Select the JSON codec ("orjson" when installed, "json" otherwise)
+#
+def set_json_codec(codec):
+  global _json_codec
+  if codec not in JSON_CODECS:
+    raise ValueError('Unknown JSON codec "{}" (expected one of {})'.format(codec, ', '.join(JSON_CODECS)))
+  if (codec == JSON_CODEC_ORJSON) and (orjson is None):
+    raise ValueError('JSON codec "{}" is not installed'.format(codec))
+
+  _json_codec= codec
+
+
+# Return the name of the JSON codec in use
+#
+def get_json_codec():
+  return _json_codec
+
+
+# Decode JSON from text or raw bytes (such as a response body, without decoding it to text first)
+#
+def decode_json(data):
+  if _json_codec == JSON_CODEC_ORJSON:
+    return orjson.loads(data)
+  else:
+    return json.loads(data)
+
+
+# Encode a value as JSON text (pretty output for files and people is sorted, indented and stable
+# regardless of the codec)
+#
+def encode_json(value, pretty= False):
+  if pretty:
+    return json.dumps(value, sort_keys=True, indent=4, separators=(',', ': '))
+
+  if _json_codec == JSON_CODEC_ORJSON:
+    try:
+      return orjson.dumps(value).decode('utf-8')
+    except TypeError:
+      # values orjson rejects (such as integers beyond 64 bits) still encode with the standard library
+      pass
+
+  return json.dumps(value)
+
+
+# Replace a file atomically (write a temporary file in the same directory, then rename it into place)
+#
+def write_file_atomically(path, content):
+  directory= os.path.dirname(os.path.abspath(path))
+  handle, temporary= tempfile.mkstemp(dir= directory, prefix= '.' + os.path.basename(path) + '-')
+  try:
+    with os.fdopen(handle, 'w') as output_file:
+      output_file.write(content)
+      output_file.flush()
+      os.fsync(output_file.fileno())
+    if os.path.exists(path):
+      os.chmod(temporary, os.stat(path).st_mode & 0o777)
+    os.replace(temporary, path)
+  except Exception as error:
+    os.unlink(temporary)
+    raise error
+
+
+# Return the keys that differ between two state snapshots, mapped to their (old, new) values
+# (nested groups are flattened into dotted keys; cache bookkeeping is ignored)
+#
+def diff_states(old, new, prefix= ''):
+  old= old or {}
+  new= new or {}
+  changes= {}
+
+  for key in set(old.keys()) | set(new.keys()):
+    if key in (KEY_CACHE_TIMESTAMP, KEY_CACHE_EXPIRATION, KEY_CACHE_COMMAND):
+      continue
+
+    old_value= old.get(key)
+    new_value= new.get(key)
+    if isinstance(old_value, dict) and isinstance(new_value, dict):
+      changes.update(diff_states(old_value, new_value, prefix + key + '.'))
+    elif old_value != new_value:
+      changes[prefix + key]= (old_value, new_value)
+
+  return changes
+
+
+# Return the state values the specified command leaves behind, derived from its payload and the
+# current state (None if the command has no known effect or it cannot be derived)
+#
+def get_command_effect(command, payload, state):
+  if command not in COMMAND_STATE_EFFECTS:
+    return None
+
+  effect= {}
+  for key, (source, value) in COMMAND_STATE_EFFECTS[command][1].items():
+    if source == 'payload':
+      value= payload.get(value)
+    elif source == 'state':
+      value= state.get(value)
+    if value is None:
+      return None
+    effect[key]= value
+
+  return effect
+
+
+# Validate Owner API parameters and return them
+#
+def validate_owner_api_parameters(owner_api):
+  # URL validation code from SethRobertson https://github.com/gglockner/teslajson/pull/12/files
+  prefix='https://'
+  owner_url= owner_api[API_VERSION][KEY_API_BASEURL]
+  if (not owner_url.startswith(prefix) or '/' in owner_url[len(prefix):]
+    or not owner_url.endswith(('.teslamotors.com', '.tesla.com'))):
+      raise IOError('Unexpected token source URL <{}>'.format(owner_url))
+
+  return owner_api
+
+
+# Return the seconds a Retry-After header value (seconds or an HTTP date) asks us to wait, or None
+#
+def parse_retry_after(value):
+  if not value:
+    return None
+
+  try:
+    seconds= float(value)
+  except ValueError:
+    try:
+      seconds= email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+      return None
+
+  return min(max(0.0, seconds), SCHEDULER_MAX_RETRY_AFTER)
+
+
+#
+# Define the error raised when the Owner API keeps throttling us
+#
+class RateLimitError(Exception):
+
+  # Constructor
+  def __init__(self, message, endpoint= None, retry_after= None):
+    super().__init__(message)
+    self.endpoint= endpoint
+    self.retry_after= retry_after
+
+
+#
+# Define the error raised instead of contacting a vehicle or endpoint whose circuit is open
+#
+class CircuitOpenError(Exception):
+
+  # Constructor
+  def __init__(self, message, circuit= None, retry_at= None):
+    super().__init__(message)
+    self.circuit= circuit
+    self.retry_at= retry_at
+
+
+#
+# Define our circuit breakers: after enough consecutive failures a circuit opens and fails fast
+# for a cooldown, then lets a single probe through (half-open) that either closes it or reopens it
+# for longer; state persists in a StateCache when one is supplied, so later runs skip dead cars too
+#
+class CircuitBreakers:
+
+  # Constructor
+  def __init__(self, store= None, failures= BREAKER_FAILURES, cooldown= BREAKER_COOLDOWN,
+    backoff= BREAKER_BACKOFF, max_cooldown= BREAKER_MAX_COOLDOWN):
+      self.__store= store
+      self.__failures= failures
+      self.__cooldown= cooldown
+      self.__backoff= backoff
+      self.__max_cooldown= max_cooldown
+
+      # name -> [consecutive failures, time opened (0 while closed), cooldown]
+      self.__lock= threading.Lock()
+      self.__circuits= {}
+      self.__probes= set()
+      if store is not None:
+        for name, circuit in store.get_circuits().items():
+          self.__circuits[name]= list(circuit)
+
+
+  # Raise CircuitOpenError unless the named circuit lets a request through (claiming the probe
+  # of a half-open circuit; settle it with record_success, record_failure or release_probe)
+  def check(self, name, description= None):
+    with self.__lock:
+      failures, opened_at, cooldown= self.__circuits.get(name, (0, 0, 0))
+      if not opened_at:
+        return
+
+      retry_at= opened_at + cooldown
+      if (time.time() >= retry_at) and (name not in self.__probes):
+        self.__probes.add(name)
+        return
+
+    raise CircuitOpenError('{} failed {} time{} in a row (next attempt in {:.0f} seconds)'.format(
+      description or 'Circuit "{}"'.format(name), failures, '' if failures == 1 else 's',
+      max(0, retry_at - time.time())), name, retry_at)
+
+
+  # Close the named circuit
+  def record_success(self, name):
+    with self.__lock:
+      self.__probes.discard(name)
+      if self.__circuits.pop(name, None) is None:
+        return
+
+    self.__save(name, [0, 0, 0])
+
+
+  # Count a failure against the named circuit, opening it (or reopening it, for a failed probe)
+  def record_failure(self, name):
+    with self.__lock:
+      circuit= self.__circuits.setdefault(name, [0, 0, 0])
+      circuit[0]+= 1
+      if name in self.__probes:
+        self.__probes.discard(name)
+        circuit[1:]= [time.time(), min(self.__max_cooldown, circuit[2] * self.__backoff)]
+      elif (not circuit[1]) and self.__failures and (circuit[0] >= self.__failures):
+        circuit[1:]= [time.time(), self.__cooldown]
+      circuit= list(circuit)
+
+    self.__save(name, circuit)
+
+
+  # Give up a claimed probe without a verdict (the next caller probes instead)
+  def release_probe(self, name):
+    with self.__lock:
+      self.__probes.discard(name)
+
+
+  # Return the state of the named circuit (closed, open or half-open)
+  def get_state(self, name):
+    with self.__lock:
+      failures, opened_at, cooldown= self.__circuits.get(name, (0, 0, 0))
+      if not opened_at:
+        return BREAKER_STATE_CLOSED
+      if (name in self.__probes) or (time.time() >= opened_at + cooldown):
+        return BREAKER_STATE_HALF_OPEN
+      return BREAKER_STATE_OPEN
+
+
+  # Return every circuit with failures on record as {name: {state, failures, retry_at}}
+  def get_circuits(self):
+    with self.__lock:
+      names= list(self.__circuits.keys())
+
+    circuits= {}
+    for name in names:
+      with self.__lock:
+        failures, opened_at, cooldown= self.__circuits.get(name, (0, 0, 0))
+      if failures:
+        circuits[name]= {'state' : self.get_state(name), 'failures' : failures,
+          'retry_at' : (opened_at + cooldown) if opened_at else None}
+
+    return circuits
+
+
+  # Close the named circuit, or all of them
+  def reset(self, name= None):
+    with self.__lock:
+      names= list(self.__circuits.keys()) if name is None else [name]
+      for circuit in names:
+        self.__circuits.pop(circuit, None)
+        self.__probes.discard(circuit)
+
+    for circuit in names:
+      self.__save(circuit, [0, 0, 0])
+
+
+  # Persist the state of the named circuit
+  def __save(self, name, circuit):
+    if self.__store is not None:
+      self.__store.put_circuit(name, *circuit)
+
+
+#
+# Define our request scheduler: a per-account token bucket, adaptive concurrency (halved on throttling
+# or server errors, regained one request at a time) and a priority lane for commands
+#
+class RequestScheduler:
+  __schedulers= {}
+  __schedulers_lock= threading.Lock()
+
+  # Return the scheduler shared by everything in this process for the specified account
+  # (settings given for an account already open apply to its scheduler from now on)
+  @classmethod
+  def open(cls, account, **settings):
+    with cls.__schedulers_lock:
+      if account not in cls.__schedulers:
+        cls.__schedulers[account]= cls(**settings)
+      else:
+        cls.__schedulers[account].configure(**settings)
+      return cls.__schedulers[account]
+
+
+  # Constructor (prefer RequestScheduler.open() to share one scheduler per account)
+  def __init__(self, rate= SCHEDULER_RATE, burst= SCHEDULER_BURST,
+    max_concurrency= SCHEDULER_MAX_CONCURRENCY, min_concurrency= SCHEDULER_MIN_CONCURRENCY,
+    decrease= SCHEDULER_DECREASE, retry_after= SCHEDULER_RETRY_AFTER):
+      self.__rate= rate
+      self.__burst= burst
+      self.__max_concurrency= max_concurrency
+      self.__min_concurrency= min_concurrency
+      self.__decrease= decrease
+      self.__retry_after= retry_after
+
+      self.__condition= threading.Condition()
+      self.__tokens= float(burst)
+      self.__updated= time.monotonic()
+      self.__limit= float(max_concurrency)
+      self.__in_flight= 0
+      self.__waiting= [0, 0]
+      self.__paused_until= 0.0
+
+
+  # Change the specified limits (tokens on hand and concurrency are trimmed to fit the new ones)
+  def configure(self, rate= None, burst= None, max_concurrency= None, min_concurrency= None,
+    decrease= None, retry_after= None):
+      with self.__condition:
+        # tokens earned so far were earned at the old rate
+        self.__refill(time.monotonic())
+
+        if rate is not None:
+          self.__rate= rate
+        if burst is not None:
+          self.__burst= burst
+        if max_concurrency is not None:
+          self.__max_concurrency= max_concurrency
+        if min_concurrency is not None:
+          self.__min_concurrency= min_concurrency
+        if decrease is not None:
+          self.__decrease= decrease
+        if retry_after is not None:
+          self.__retry_after= retry_after
+
+        self.__tokens= min(self.__tokens, float(self.__burst))
+        self.__limit= min(float(self.__max_concurrency), max(float(self.__min_concurrency), self.__limit))
+        self.__condition.notify_all()
+
+
+  # Add tokens earned since the last update
+  def __refill(self, now):
+    self.__tokens= min(float(self.__burst), self.__tokens + (now - self.__updated) * self.__rate)
+    self.__updated= now
+
+
+  # Return how long a request of the specified priority must wait (0 to go now, None until notified)
+  def __get_wait(self, priority, now):
+    if self.__paused_until > now:
+      return self.__paused_until - now
+    if any(self.__waiting[0:priority]):
+      return None
+    if self.__in_flight >= int(self.__limit):
+      return None
+    if self.__tokens < 1:
+      return (1 - self.__tokens) / self.__rate
+    return 0
+
+
+  # Wait for a turn to send a request of the specified priority
+  def acquire(self, priority= PRIORITY_POLL):
+    with self.__condition:
+      self.__waiting[priority]+= 1
+      try:
+        while True:
+          now= time.monotonic()
+          self.__refill(now)
+          wait= self.__get_wait(priority, now)
+          if wait == 0:
+            break
+          self.__condition.wait(wait)
+      finally:
+        self.__waiting[priority]-= 1
+
+      self.__tokens-= 1
+      self.__in_flight+= 1
+      self.__condition.notify_all()
+
+
+  # Finish a request, adapting to its outcome (status is None for a connection failure)
+  def release(self, status, retry_after= None):
+    with self.__condition:
+      self.__in_flight-= 1
+
+      if (status is None) or (status == STATUS_CODE_TOO_MANY_REQUESTS) \
+        or (status >= STATUS_CODE_SERVER_ERROR):
+          self.__limit= max(float(self.__min_concurrency), self.__limit * self.__decrease)
+      else:
+        self.__limit= min(float(self.__max_concurrency), self.__limit + 1 / self.__limit)
+
+      if status == STATUS_CODE_TOO_MANY_REQUESTS:
+        pause= self.__retry_after if retry_after is None else retry_after
+        self.__paused_until= max(self.__paused_until, time.monotonic() + pause)
+
+      self.__condition.notify_all()
+
+
+  # Return the current limits (for diagnostics)
+  def get_state(self):
+    with self.__condition:
+      now= time.monotonic()
+      self.__refill(now)
+      return {
+        'concurrency' : int(self.__limit),
+        'in_flight' : self.__in_flight,
+        'tokens' : self.__tokens,
+        'paused' : max(0.0, self.__paused_until - now),
+      }
+
+
+#
+# Define our instrumentation: request counters, latency histograms, wake-up and cache statistics
+#
+class RequestMetrics:
+
+  # Constructor
+  def __init__(self, buckets= METRICS_LATENCY_BUCKETS):
+    self.__lock= threading.Lock()
+    self.__buckets= sorted(buckets)
+    self.reset()
+
+
+  # Clear all collected measurements
+  def reset(self):
+    with self.__lock:
+      self.__requests= {}
+      self.__wake= {}
+      self.__cache= {}
+      self.__commands= {}
+
+
+  # Record a request to the specified endpoint (status is None for a connection failure)
+  def record_request(self, endpoint, status, seconds):
+    with self.__lock:
+      if endpoint not in self.__requests:
+        self.__requests[endpoint]= {'count' : 0, 'errors' : 0, 'seconds' : 0.0,
+          'statuses' : {}, 'buckets' : [0] * len(self.__buckets)}
+      entry= self.__requests[endpoint]
+
+      entry['count']+= 1
+      entry['seconds']+= seconds
+      status= str(status) if status is not None else 'error'
+      entry['statuses'][status]= entry['statuses'].get(status, 0) + 1
+      if status != str(STATUS_CODE_OK):
+        entry['errors']+= 1
+
+      for bucket in range(0, len(self.__buckets)):
+        if seconds <= self.__buckets[bucket]:
+          entry['buckets'][bucket]+= 1
+
+
+  # Record a wake-up of the specified vehicle
+  def record_wake(self, vehicle_id, attempts, seconds, awake):
+    with self.__lock:
+      key= str(vehicle_id)
+      if key not in self.__wake:
+        self.__wake[key]= {'wake_ups' : 0, 'failures' : 0, 'attempts' : 0, 'seconds' : 0.0}
+      entry= self.__wake[key]
+
+      entry['wake_ups']+= 1
+      entry['attempts']+= attempts
+      entry['seconds']+= seconds
+      if not awake:
+        entry['failures']+= 1
+
+
+  # Record a cache event ("hit", "store_hit", "miss", "expiration") for the specified state type
+  def record_cache(self, state_type, event):
+    with self.__lock:
+      if state_type not in self.__cache:
+        self.__cache[state_type]= {}
+      self.__cache[state_type][event]= self.__cache[state_type].get(event, 0) + 1
+
+
+  # Record the outcome of a command ("sent", "failed", or "skipped" when already satisfied)
+  def record_command(self, command, outcome):
+    with self.__lock:
+      if command not in self.__commands:
+        self.__commands[command]= {}
+      self.__commands[command][outcome]= self.__commands[command].get(outcome, 0) + 1
+
+
+  # Return a snapshot of all collected measurements
+  def get_metrics(self):
+    with self.__lock:
+      return decode_json(encode_json({
+        'buckets' : self.__buckets,
+        'requests' : self.__requests,
+        'wake' : self.__wake,
+        'cache' : self.__cache,
+        'commands' : self.__commands,
+      }))
+
+
+  # Render all collected measurements in the Prometheus text exposition format
+  def to_prometheus(self):
+    metrics= self.get_metrics()
+    lines= []
+
+    lines.append('# TYPE {}_requests_total counter'.format(METRICS_PREFIX))
+    for endpoint, entry in sorted(metrics['requests'].items()):
+      for status, count in sorted(entry['statuses'].items()):
+        lines.append('{}_requests_total{{endpoint="{}",status="{}"}} {}'.format(
+          METRICS_PREFIX, endpoint, status, count))
+
+    lines.append('# TYPE {}_request_seconds histogram'.format(METRICS_PREFIX))
+    for endpoint, entry in sorted(metrics['requests'].items()):
+      for bucket, count in zip(metrics['buckets'], entry['buckets']):
+        lines.append('{}_request_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(
+          METRICS_PREFIX, endpoint, bucket, count))
+      lines.append('{}_request_seconds_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+        METRICS_PREFIX, endpoint, entry['count']))
+      lines.append('{}_request_seconds_sum{{endpoint="{}"}} {}'.format(
+        METRICS_PREFIX, endpoint, entry['seconds']))
+      lines.append('{}_request_seconds_count{{endpoint="{}"}} {}'.format(
+        METRICS_PREFIX, endpoint, entry['count']))
+
+    for name in ['wake_ups', 'failures', 'attempts', 'seconds']:
+      lines.append('# TYPE {}_wake_{}_total counter'.format(METRICS_PREFIX, name))
+      for vehicle_id, entry in sorted(metrics['wake'].items()):
+        lines.append('{}_wake_{}_total{{vehicle_id="{}"}} {}'.format(
+          METRICS_PREFIX, name, vehicle_id, entry[name]))
+
+    lines.append('# TYPE {}_cache_events_total counter'.format(METRICS_PREFIX))
+    for state_type, events in sorted(metrics['cache'].items()):
+      for event, count in sorted(events.items()):
+        lines.append('{}_cache_events_total{{state_type="{}",event="{}"}} {}'.format(
+          METRICS_PREFIX, state_type, event, count))
+
+    lines.append('# TYPE {}_commands_total counter'.format(METRICS_PREFIX))
+    for command, outcomes in sorted(metrics['commands'].items()):
+      for outcome, count in sorted(outcomes.items()):
+        lines.append('{}_commands_total{{command="{}",outcome="{}"}} {}'.format(
+          METRICS_PREFIX, command, outcome, count))
+
+    return '\n'.join(lines) + '\n'
+
+
+  # Write all collected measurements to the specified file atomically (Prometheus for *.prom, JSON otherwise)
+  def dump(self, path, metrics_format= None):
+    if metrics_format is None:
+      if path.endswith('.prom'):
+        metrics_format= METRICS_FORMAT_PROMETHEUS
+      else:
+        metrics_format= METRICS_FORMAT_JSON
+
+    if metrics_format == METRICS_FORMAT_PROMETHEUS:
+      content= self.to_prometheus()
+    else:
+      content= encode_json(self.get_metrics(), pretty= True)
+
+    write_file_atomically(path, content)
+
+
+#
+# Define our token store: one load per process, single-flight refresh under an advisory lock, atomic writes
+#
+class TokenStore:
+  __stores= {}
+  __stores_lock= threading.Lock()
+
+  # Return the store shared by everything in this process for the specified token file
+  @classmethod
+  def open(cls, path):
+    key= os.path.realpath(path)
+    with cls.__stores_lock:
+      if key not in cls.__stores:
+        cls.__stores[key]= cls(path)
+      return cls.__stores[key]
+
+
+  # Constructor (prefer TokenStore.open() to share one store per file)
+  def __init__(self, path):
+    self.__path= path
+    self.__lock= threading.RLock()
+    self.__token= None
+
+
+  # Return the stored token (read from disk once and memoized)
+  def get(self):
+    if self.__token is None:
+      with self.__lock:
+        if self.__token is None:
+          self.__token= self.__read()
+
+    return self.__token
+
+
+  # Store a token atomically
+  def save(self, token):
+    with self.__lock:
+      with self.__file_lock():
+        self.__write(token)
+        self.__token= token
+
+
+  # Refresh the token once for all concurrent callers (returns the current token and whether we refreshed it)
+  def refresh(self, refresh_function, stale_token= None):
+    with self.__lock:
+      with self.__file_lock():
+        # somebody else may have refreshed while we waited for the lock -- use theirs
+        current= self.__read()
+        if (stale_token is not None) and (current.get(KEY_TOKEN) != stale_token.get(KEY_TOKEN)):
+          self.__token= current
+          return current, False
+
+        token= refresh_function(current)
+        self.__write(token)
+        self.__token= token
+        return token, True
+
+
+  # Read the token file
+  def __read(self):
+    with open(self.__path, 'rb') as token_file:
+      return decode_json(token_file.read())
+
+
+  # Write the token file atomically
+  def __write(self, token):
+    write_file_atomically(self.__path, encode_json(token, pretty= True))
+
+
+  # Hold an advisory lock shared with other processes using the same token file
+  def __file_lock(self):
+    return _FileLock(self.__path + TOKEN_LOCK_SUFFIX)
+
+
+#
+# Define an advisory (flock) lock on a side file -- a no-op where flock is unavailable
+#
+class _FileLock:
+
+  # Constructor
+  def __init__(self, path):
+    self.__path= path
+    self.__file= None
+
+
+  def __enter__(self):
+    if fcntl is not None:
+      self.__file= open(self.__path, 'a')
+      fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX)
+    return self
+
+
+  def __exit__(self, exc_type, exc, traceback):
+    if self.__file is not None:
+      fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+      self.__file.close()
+      self.__file= None
+
+
+#
+# Define a compact record of an owned vehicle
+#
+class Vehicle:
+  __slots__= ('index', 'id', 'vin', 'name', 'online_state', 'in_service', 'raw')
+
+  # Constructor (the raw listing is kept only on request)
+  def __init__(self, index, listing, keep_raw= False):
+    self.index= index
+    self.raw= dict(listing) if keep_raw else None
+    self.id= listing[KEY_VEHICLE_ID]
+    self.vin= listing.get(KEY_VEHICLE_VIN)
+    self.name= listing.get(KEY_VEHICLE_NAME)
+    self.online_state= listing.get(KEY_VEHICLE_ONLINE_STATE, VALUE_STATE_UNKNOWN)
+    self.in_service= listing.get(KEY_VEHICLE_INSERVICE_STATE, False)
+
+
+  def __repr__(self):
+    return 'Vehicle(index={}, id={}, vin={}, name={}, online_state={})'.format(
+      self.index, self.id, self.vin, repr(self.name), self.online_state)
+
+
+#
+# Define a compact state record: a fixed projection of fields held in slots (plus cache bookkeeping),
+# read like the raw dict it replaces; the raw dict itself is kept only on request
+#
+class StateRecord:
+  __slots__= (KEY_CACHE_TIMESTAMP, KEY_CACHE_EXPIRATION, KEY_CACHE_COMMAND, 'raw')
+  BOOKKEEPING= (KEY_CACHE_TIMESTAMP, KEY_CACHE_EXPIRATION, KEY_CACHE_COMMAND)
+  FIELDS= ()
+  KEYS= frozenset(BOOKKEEPING)
+
+  # Constructor (parse a raw state dict once, keeping only projected fields)
+  def __init__(self, state= None, keep_raw= False):
+    self.raw= dict(state) if (keep_raw and state is not None) else None
+
+    if state:
+      for key in self.FIELDS + self.BOOKKEEPING:
+        if key in state:
+          setattr(self, key, state[key])
+
+
+  # Return the value of a field (or the default if it is absent or not kept)
+  def get(self, key, default= None):
+    if key in self.KEYS:
+      return getattr(self, key, default)
+    elif self.raw is not None:
+      return self.raw.get(key, default)
+    else:
+      return default
+
+
+  def __getitem__(self, key):
+    if key in self:
+      return self.get(key)
+    raise KeyError(key)
+
+
+  def __setitem__(self, key, value):
+    if key in self.KEYS:
+      setattr(self, key, value)
+    elif self.raw is not None:
+      self.raw[key]= value
+    else:
+      raise KeyError('Field "{}" is not kept in {} records'.format(key, type(self).__name__))
+
+
+  def __contains__(self, key):
+    if key in self.KEYS:
+      return hasattr(self, key)
+    return (self.raw is not None) and (key in self.raw)
+
+
+  # Return the names of fields present
+  def keys(self):
+    keys= [key for key in self.FIELDS + self.BOOKKEEPING if hasattr(self, key)]
+    if self.raw is not None:
+      keys.extend(key for key in self.raw.keys() if key not in self.KEYS)
+    return keys
+
+
+  def __iter__(self):
+    return iter(self.keys())
+
+
+  def __len__(self):
+    return len(self.keys())
+
+
+  # Return (field, value) pairs of fields present
+  def items(self):
+    return [(key, self.get(key)) for key in self.keys()]
+
+
+  # Set several fields at once
+  def update(self, values):
+    for key, value in values.items():
+      self[key]= value
+
+
+  # Return an independent copy
+  def copy(self):
+    record= type(self)()
+    for key in self.FIELDS + self.BOOKKEEPING:
+      if hasattr(self, key):
+        setattr(record, key, getattr(self, key))
+    record.raw= dict(self.raw) if self.raw is not None else None
+    return record
+
+
+  # Return a plain dict (the raw state, if kept, overlaid with the current field values)
+  def to_dict(self):
+    result= dict(self.raw) if self.raw is not None else {}
+    for key in self.FIELDS + self.BOOKKEEPING:
+      if hasattr(self, key):
+        result[key]= getattr(self, key)
+    return result
+
+
+  def __repr__(self):
+    return '{}({})'.format(type(self).__name__, self.to_dict())
+
+
+# Define a state record class keeping the specified fields (on top of those of its base)
+#
+def make_state_record(name, fields, base= StateRecord):
+  fields= tuple(field for field in dict.fromkeys(fields) if field not in base.KEYS)
+  for field in fields:
+    if (not field.isidentifier()) or hasattr(StateRecord, field):
+      raise ValueError('Cannot keep field "{}" in a state record'.format(field))
+
+  return type(name, (base,), {'__slots__' : fields, 'FIELDS' : base.FIELDS + fields,
+    'KEYS' : base.KEYS | frozenset(fields)})
+
+
+ChargeState= make_state_record('ChargeState', STATE_FIELDS['charge_state'])
+VehicleState= make_state_record('VehicleState', STATE_FIELDS['vehicle_state'])
+DriveState= make_state_record('DriveState', STATE_FIELDS['drive_state'])
+STATE_RECORDS= {'charge_state' : ChargeState, 'vehicle_state' : VehicleState,
+  'drive_state' : DriveState}
+
+
+#
+# Define our wake-up strategy: exponential backoff with jitter under a wall-clock deadline
+#
+class WakeStrategy:
+
+  # Constructor
+  def __init__(self, initial_delay= WAKE_INITIAL_DELAY, maximum_delay= WAKE_MAXIMUM_DELAY,
+    backoff= WAKE_BACKOFF, jitter= WAKE_JITTER, deadline= WAKE_DEADLINE,
+    online_freshness= WAKE_ONLINE_FRESHNESS):
+      self.initial_delay= initial_delay
+      self.maximum_delay= maximum_delay
+      self.backoff= backoff
+      self.jitter= jitter
+      self.deadline= deadline
+      self.online_freshness= online_freshness
+
+
+  # Return the delay to wait after the specified (1-based) failed attempt
+  def get_delay(self, attempt):
+    delay= min(self.maximum_delay, self.initial_delay * (self.backoff ** (attempt - 1)))
+    return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+  # Is an online state observed at the specified time still trustworthy?
+  def is_online_fresh(self, timestamp):
+    return (time.time() - timestamp) < self.online_freshness
+
+
+#
+# Define our persistent state cache (SQLite) shared by every process pointed at the same file
+#
+class StateCache:
+
+  # Constructor
+  def __init__(self, path, timeout= CACHE_STORE_TIMEOUT):
+    self.__path= path
+    self.__lock= threading.Lock()
+
+    # autocommit mode: every statement is its own short transaction
+    self.__connection= sqlite3.connect(path, timeout= timeout,
+      isolation_level= None, check_same_thread= False)
+
+    with self.__lock:
+      self.__connection.execute('PRAGMA journal_mode=WAL')
+      self.__connection.execute('CREATE TABLE IF NOT EXISTS states ('
+        + ' vehicle_id INTEGER NOT NULL,'
+        + ' state_type TEXT NOT NULL,'
+        + ' expiration REAL NOT NULL,'
+        + ' state TEXT NOT NULL,'
+        + ' PRIMARY KEY (vehicle_id, state_type))')
+      self.__connection.execute('CREATE TABLE IF NOT EXISTS circuits ('
+        + ' name TEXT PRIMARY KEY,'
+        + ' failures INTEGER NOT NULL,'
+        + ' opened_at REAL NOT NULL,'
+        + ' cooldown REAL NOT NULL)')
+
+
+  # Return the stored state (expired or not) for the specified vehicle ID, or None
+  def get(self, vehicle_id, state_type):
+    with self.__lock:
+      row= self.__connection.execute(
+        'SELECT expiration, state FROM states WHERE vehicle_id = ? AND state_type = ?',
+        (vehicle_id, state_type)).fetchone()
+
+    if row is None:
+      return None
+
+    state= decode_json(row[1])
+    state[KEY_CACHE_EXPIRATION]= row[0]
+    return state
+
+
+  # Store state for the specified vehicle ID (expiration is taken from the state itself)
+  def put(self, vehicle_id, state_type, state):
+    with self.__lock:
+      self.__connection.execute(
+        'INSERT OR REPLACE INTO states (vehicle_id, state_type, expiration, state)'
+        + ' VALUES (?, ?, ?, ?)',
+        (vehicle_id, state_type, state[KEY_CACHE_EXPIRATION], encode_json(state)))
+
+
+  # Expire stored state for the specified vehicle ID (all state types if none specified)
+  def invalidate(self, vehicle_id, state_type= None):
+    with self.__lock:
+      if state_type is None:
+        self.__connection.execute(
+          'UPDATE states SET expiration = 0 WHERE vehicle_id = ?', (vehicle_id,))
+      else:
+        self.__connection.execute(
+          'UPDATE states SET expiration = 0 WHERE vehicle_id = ? AND state_type = ?',
+          (vehicle_id, state_type))
+
+
+  # Return all stored circuit breaker states as {name: (failures, opened_at, cooldown)}
+  def get_circuits(self):
+    with self.__lock:
+      rows= self.__connection.execute(
+        'SELECT name, failures, opened_at, cooldown FROM circuits').fetchall()
+
+    return {row[0] : tuple(row[1:]) for row in rows}
+
+
+  # Store the state of the named circuit breaker (a closed circuit is forgotten)
+  def put_circuit(self, name, failures, opened_at, cooldown):
+    with self.__lock:
+      if failures:
+        self.__connection.execute(
+          'INSERT OR REPLACE INTO circuits (name, failures, opened_at, cooldown) VALUES (?, ?, ?, ?)',
+          (name, failures, opened_at, cooldown))
+      else:
+        self.__connection.execute('DELETE FROM circuits WHERE name = ?', (name,))
+
+
+  # Release the underlying database connection
+  def close(self):
+    with self.__lock:
+      self.__connection.close()
+
+
+#
+# Define our state history: one append-only, fixed-width column file per recorded field,
+# grouped per vehicle and state type, and read back through memory maps
+#
+class HistoryRecorder:
+
+  # Constructor
+  def __init__(self, directory, fields= HISTORY_FIELDS):
+    self.__directory= directory
+    self.__fields= dict((state_type, list(columns)) for state_type, columns in fields.items())
+    self.__field_types= {}
+    for state_type, columns in self.__fields.items():
+      for field, typecode in columns:
+        self.__field_types[field]= (state_type, typecode)
+
+    self.__lock= threading.Lock()
+
+    os.makedirs(directory, exist_ok= True)
+
+
+  # Return the file holding the specified column
+  def __get_path(self, vehicle_id, state_type, column):
+    return os.path.join(self.__directory, str(vehicle_id), state_type + '.' + column)
+
+
+  # Return every column of the specified group with its type code (sample times first)
+  def __get_columns(self, state_type):
+    return [(HISTORY_TIMESTAMP, HISTORY_TIMESTAMP_TYPE)] + self.__fields[state_type]
+
+
+  # Encode recorded fields of a state sample as a single fixed-width row
+  def __encode(self, state_type, state):
+    row= b''
+    for field, typecode in self.__fields[state_type]:
+      value= state.get(field)
+      if typecode == 'b':
+        value= HISTORY_BOOLEAN_UNKNOWN if value is None else int(bool(value))
+      else:
+        try:
+          value= float(value)
+        except (TypeError, ValueError):
+          value= math.nan
+      row+= array.array(typecode, [value]).tobytes()
+
+    return row
+
+
+  # Trim columns left uneven by an interrupted append and return the last stored row
+  # (callers hold the history lock file of the group)
+  def __repair(self, vehicle_id, state_type):
+    columns= self.__get_columns(state_type)
+    if not os.path.isdir(os.path.dirname(self.__get_path(vehicle_id, state_type, HISTORY_TIMESTAMP))):
+      return None
+
+    sizes= []
+    for column, typecode in columns:
+      path= self.__get_path(vehicle_id, state_type, column)
+      size= os.path.getsize(path) if os.path.exists(path) else 0
+      sizes.append(size // array.array(typecode).itemsize)
+    count= min(sizes)
+
+    row= b''
+    for column, typecode in columns:
+      path= self.__get_path(vehicle_id, state_type, column)
+      itemsize= array.array(typecode).itemsize
+      with open(path, 'ab+') as column_file:
+        column_file.truncate(count * itemsize)
+        if count and (column != HISTORY_TIMESTAMP):
+          column_file.seek((count - 1) * itemsize)
+          row+= column_file.read(itemsize)
+
+    return row if count else None
+
+
+  # Append recorded fields of a state sample (skipped when nothing recorded changed)
+  def record(self, vehicle_id, state_type, state):
+    if state_type not in self.__fields:
+      return False
+
+    row= self.__encode(state_type, state)
+    timestamp= int(state.get(KEY_CACHE_TIMESTAMP, time.time()))
+
+    with self.__lock:
+      os.makedirs(os.path.join(self.__directory, str(vehicle_id)), exist_ok= True)
+      with _FileLock(self.__get_path(vehicle_id, state_type, HISTORY_LOCK)):
+        # other processes may append too: compare with the row stored now, not one remembered
+        if self.__repair(vehicle_id, state_type) == row:
+          return False
+
+        # sample times go last so an interrupted append leaves only trimmable values behind
+        offset= 0
+        for column, typecode in self.__get_columns(state_type)[1:] + self.__get_columns(state_type)[:1]:
+          if column == HISTORY_TIMESTAMP:
+            data= array.array(typecode, [timestamp]).tobytes()
+          else:
+            itemsize= array.array(typecode).itemsize
+            data= row[offset:offset + itemsize]
+            offset+= itemsize
+          with open(self.__get_path(vehicle_id, state_type, column), 'ab') as column_file:
+            column_file.write(data)
+
+        return True
+
+
+  # Map a column file read-only and yield it as a typed view
+  @contextlib.contextmanager
+  def __map_column(self, path, typecode):
+    if not os.path.exists(path) or (os.path.getsize(path) == 0):
+      yield memoryview(array.array(typecode))
+      return
+
+    with open(path, 'rb') as column_file:
+      mapped= mmap.mmap(column_file.fileno(), 0, access= mmap.ACCESS_READ)
+      view= memoryview(mapped).cast(typecode)
+      try:
+        yield view
+      finally:
+        view.release()
+        mapped.close()
+
+
+  # Return sample times and values of a recorded field of the specified vehicle ID
+  # within [start, end] (values hold until the next sample; booleans read -1 when unknown)
+  def query(self, vehicle_id, field, start= None, end= None):
+    if field not in self.__field_types:
+      raise ValueError('Field "{}" is not recorded'.format(field))
+
+    state_type, typecode= self.__field_types[field]
+    timestamps= array.array(HISTORY_TIMESTAMP_TYPE)
+    values= array.array(typecode)
+
+    with self.__lock:
+      if not os.path.isdir(os.path.join(self.__directory, str(vehicle_id))):
+        return timestamps, values
+
+      with _FileLock(self.__get_path(vehicle_id, state_type, HISTORY_LOCK)):
+        self.__repair(vehicle_id, state_type)
+
+        with self.__map_column(self.__get_path(vehicle_id, state_type, HISTORY_TIMESTAMP),
+          HISTORY_TIMESTAMP_TYPE) as times:
+            low= 0 if start is None else bisect.bisect_left(times, start)
+            high= len(times) if end is None else bisect.bisect_right(times, end)
+            timestamps.frombytes(times[low:high].tobytes())
+
+        with self.__map_column(self.__get_path(vehicle_id, state_type, field), typecode) as column:
+          values.frombytes(column[low:max(low, high)].tobytes())
+
+    return timestamps, values
+
+
+  # Return the names of recorded fields
+  def get_fields(self):
+    return sorted(self.__field_types.keys())
+
+
 #
 # Define our Tesla API class
 #
@@ -121,16 +1421,97 @@ class TeslaRequest:
       self.__quiet= False
 
 
-    # Instantiate internal cache
+    # Guard shared state so one instance can serve several worker threads
+    # (token and listing requests run under their own locks, one at a time, never under this one)
+    self.__lock= threading.RLock()
+    self.__token_lock= threading.RLock()
+    self.__listing_lock= threading.Lock()
+    self.__vehicle_locks= {}
+    self.__command_queues= {}
+
+    # Instantiate internal cache and its optional persistent backing
     self.__cache= {}
+    self.__changes= {}
+    self.__command_bases= {}  # (vehicle ID, state type) -> last fetched state, while assuming more
+    self.__served_stale= {}   # vehicle ID -> state types last served stale for a sleeping car
+
+    # Cached state lives in compact records (extra fields on request; raw dicts only on request)
+    self.__keep_raw_state= getattr(arguments, 'keep_raw_state', False)
+    self.__state_records= dict(STATE_RECORDS)
+    for state_type, fields in (getattr(arguments, 'state_fields', None) or {}).items():
+      base= self.__state_records.get(state_type, StateRecord)
+      name= ''.join(part.title() for part in state_type.split('_'))
+      self.__state_records[state_type]= make_state_record(name, fields, base)
+
+    # Optional append-only history of selected state fields
+    if getattr(arguments, 'history', None) is not None:
+      self.__history= arguments.history
+    elif getattr(arguments, 'history_dir', None):
+      self.__history= HistoryRecorder(arguments.history_dir)
+    else:
+      self.__history= None
+    self.__cache_store_owned= False
+    if getattr(arguments, 'cache_store', None) is not None:
+      self.__cache_store= arguments.cache_store
+    elif getattr(arguments, 'cache_file', None):
+      self.__cache_store= StateCache(arguments.cache_file)
+      self.__cache_store_owned= True
+    else:
+      self.__cache_store= None
 
-    # Validate required values
+    # Validate required values (a token file is read through its shared token store)
     self.__token_refreshed= False
-    if hasattr(arguments, 'token'):
+    if getattr(arguments, 'token_store', None) is not None:
+      self.__token_store= arguments.token_store
+    elif isinstance(getattr(arguments, 'token_file', None), str):
+      self.__token_store= TokenStore.open(arguments.token_file)
+    else:
+      self.__token_store= None
+
+    if self.__token_store is not None and not getattr(arguments, 'e_mail', None):
+      self.__token= self.__token_store.get()
+    elif hasattr(arguments, 'token'):
       self.__token= arguments.token
     else:
       self.__token= None
 
+    # The account everything below is shared or keyed by (None for a bare token)
+    if isinstance(getattr(arguments, 'token_file', None), str):
+      self.__account= os.path.realpath(arguments.token_file)
+    elif getattr(arguments, 'e_mail', None):
+      self.__account= arguments.e_mail
+    else:
+      self.__account= None
+
+    # Fail fast on vehicles and endpoints that keep failing (remembered in the persistent cache)
+    if getattr(arguments, 'breakers', None) is not None:
+      self.__breakers= arguments.breakers
+    else:
+      self.__breakers= CircuitBreakers(self.__cache_store,
+        failures= getattr(arguments, 'breaker_failures', BREAKER_FAILURES),
+        cooldown= getattr(arguments, 'breaker_cooldown', BREAKER_COOLDOWN))
+
+    # Pace requests through the scheduler shared by everything using the same account
+    self.__rate_limit_retries= getattr(arguments, 'rate_limit_retries', SCHEDULER_RETRIES)
+    if getattr(arguments, 'scheduler', None) is not None:
+      self.__scheduler= arguments.scheduler
+    else:
+      # only limits actually given, so a plain instance leaves a shared scheduler as configured
+      settings= {}
+      for option, setting in (('rate_limit', 'rate'), ('rate_burst', 'burst'),
+        ('max_concurrency', 'max_concurrency')):
+          if getattr(arguments, option, None) is not None:
+            settings[setting]= getattr(arguments, option)
+      if self.__account is not None:
+        self.__scheduler= RequestScheduler.open(self.__account, **settings)
+      else:
+        self.__scheduler= RequestScheduler(**settings)
+
+    # Owner API parameters for new logins: pinned file, or a cached download
+    self.__owner_api_file= getattr(arguments, 'owner_api_file', None)
+    self.__owner_api_cache_file= getattr(arguments, 'owner_api_cache_file', None)
+    self.__owner_api_cache_ttl= getattr(arguments, 'owner_api_cache_ttl', OWNERAPI_CACHE_TTL)
+
     if hasattr(arguments, 'e_mail'):
       self.__e_mail= arguments.e_mail
     else:
@@ -144,27 +1525,177 @@ class TeslaRequest:
       self.__cache_expiration_limit= arguments.cache_expiration_limit
     else:
       self.__cache_expiration_limit= CACHE_EXPIRATION_LIMIT
-      
-    self.__cache_token()
-    self.__cache_vehicles()
 
+    # Optionally re-read command-derived state this many seconds after a command (lazily, on next use)
+    self.__command_verify_delay= getattr(arguments, 'command_verify_delay', None)
 
-  # Obtain Owner API parameters from our special place
+    # Skip commands whose effect fresh cached state already shows (unless overridden per call)
+    self.__idempotent= getattr(arguments, 'idempotent', False)
+
+    # Wake-up policy and the times we last saw each vehicle online
+    if getattr(arguments, 'wake_strategy', None) is not None:
+      self.__wake_strategy= arguments.wake_strategy
+    else:
+      self.__wake_strategy= WakeStrategy(
+        deadline= getattr(arguments, 'wake_deadline', WAKE_DEADLINE))
+    self.__online_timestamps= {}
+
+    # Passive mode: never wake a sleeping car while its cached state is within the staleness budget
+    self.__passive= getattr(arguments, 'passive', False)
+    self.__max_staleness= getattr(arguments, 'max_staleness', MAX_STALENESS)
+
+    # Fetch all state groups in one round-trip unless told otherwise
+    self.__bulk_state= getattr(arguments, 'bulk_state', True)
+
+    # Use a caller-supplied session (shared pool) or build our own
+    if getattr(arguments, 'session', None) is not None:
+      self.__session= arguments.session
+      self.__session_owned= False
+    else:
+      self.__session= create_session(
+        pool_connections= getattr(arguments, 'pool_connections', POOL_CONNECTIONS),
+        pool_maxsize= getattr(arguments, 'pool_maxsize', POOL_MAXSIZE),
+        pool_block= getattr(arguments, 'pool_block', POOL_BLOCK),
+        max_retries= getattr(arguments, 'max_retries', POOL_MAX_RETRIES),
+        adapter= getattr(arguments, 'adapter', None))
+      self.__session_owned= True
+
+    # Collect instrumentation (optionally shared and dumped to a file at exit)
+    if getattr(arguments, 'metrics', None) is not None:
+      self.__metrics= arguments.metrics
+    else:
+      self.__metrics= RequestMetrics()
+    if getattr(arguments, 'metrics_file', None):
+      atexit.register(self.__metrics.dump, arguments.metrics_file,
+        getattr(arguments, 'metrics_format', None))
+
+    # Validate the token and list vehicles now, or on first use when lazy
+    self.__token_checked= False
+    self.__vehicles= None
+    self.__vehicles_timestamp= 0
+    self.__vehicles_by_id= {}
+    self.__vehicles_by_vin= {}
+    self.__vehicles_by_name= {}
+    if not getattr(arguments, 'lazy', False):
+      self.warm()
+
+
+  # Issue a request on our pooled session and record it against the specified endpoint
+  def __send(self, method, endpoint, request, **kwargs):
+    if endpoint.startswith(ENDPOINT_COMMAND) or (endpoint == ENDPOINT_TOKEN):
+      priority= PRIORITY_COMMAND
+    else:
+      priority= PRIORITY_POLL
+
+    # endpoint circuits are per account, so one account's failures never block another's
+    if self.__account is not None:
+      circuit= BREAKER_ENDPOINT + self.__account + ':' + endpoint
+    else:
+      circuit= BREAKER_ENDPOINT + endpoint
+    self.__breakers.check(circuit, 'Owner API endpoint "{}"'.format(endpoint))
+
+    for attempt in range(0, self.__rate_limit_retries + 1):
+      self.__scheduler.acquire(priority)
+      start= time.time()
+      try:
+        response= self.__session.request(method, request, **kwargs)
+      except Exception as error:
+        self.__metrics.record_request(endpoint, None, time.time() - start)
+        self.__scheduler.release(None)
+        self.__breakers.record_failure(circuit)
+        raise error
+
+      self.__metrics.record_request(endpoint, response.status_code, time.time() - start)
+      retry_after= parse_retry_after(response.headers.get(HEADER_RETRY_AFTER))
+      self.__scheduler.release(response.status_code, retry_after)
+
+      if response.status_code != STATUS_CODE_TOO_MANY_REQUESTS:
+        if response.status_code >= STATUS_CODE_SERVER_ERROR:
+          self.__breakers.record_failure(circuit)
+        else:
+          self.__breakers.record_success(circuit)
+        return response
+
+      if self.__debug:
+        print('Throttled on {} (retry after {} seconds)'.format(endpoint, retry_after))
+
+    # throttling says nothing about an outage either way
+    self.__breakers.release_probe(circuit)
+    raise RateLimitError('Owner API is throttling requests to {} (retry after {} seconds)'.format(
+      endpoint, SCHEDULER_RETRY_AFTER if retry_after is None else retry_after), endpoint, retry_after)
+
+
+  # Obtain Owner API parameters: pinned file, fresh cached copy, download, or last known-good copy (in that order)
   def __get_owner_api_parameters(self):
+    if self.__owner_api_file:
+      with open(self.__owner_api_file, 'rb') as owner_api_file:
+        return validate_owner_api_parameters(decode_json(owner_api_file.read()))
+
+    cached= self.__read_owner_api_cache()
+    if cached and (time.time() - cached[KEY_API_CACHE_TIMESTAMP] < self.__owner_api_cache_ttl):
+      return cached[KEY_API_CACHE_PARAMETERS]
+
+    try:
+      owner_api= self.__download_owner_api_parameters()
+    except Exception as error:
+      if cached:
+        if self.__debug:
+          print('Failed to obtain Owner API parameters, using the copy from {}'.format(
+            time.ctime(cached[KEY_API_CACHE_TIMESTAMP])))
+        return cached[KEY_API_CACHE_PARAMETERS]
+      raise error
+
+    self.__write_owner_api_cache(owner_api)
+    return owner_api
+
+
+  # Return validated Owner API parameters cached in this process or on disk (None if there are none)
+  def __read_owner_api_cache(self):
+    key= self.__owner_api_cache_file or OWNERAPI_CLIENT_TOKENS_URL
+
+    with _owner_api_cache_lock:
+      if key in _owner_api_cache:
+        return _owner_api_cache[key]
+
+    if not (self.__owner_api_cache_file and os.path.exists(self.__owner_api_cache_file)):
+      return None
+
+    try:
+      with open(self.__owner_api_cache_file, 'rb') as cache_file:
+        cached= decode_json(cache_file.read())
+      validate_owner_api_parameters(cached[KEY_API_CACHE_PARAMETERS])
+      float(cached[KEY_API_CACHE_TIMESTAMP])
+    except Exception as error:
+      if self.__debug:
+        print('Ignoring unusable Owner API parameter cache {} ({})'.format(
+          self.__owner_api_cache_file, error))
+      return None
+
+    with _owner_api_cache_lock:
+      _owner_api_cache[key]= cached
+    return cached
+
+
+  # Remember freshly downloaded Owner API parameters in this process and on disk
+  def __write_owner_api_cache(self, owner_api):
+    key= self.__owner_api_cache_file or OWNERAPI_CLIENT_TOKENS_URL
+    cached= {KEY_API_CACHE_TIMESTAMP : time.time(), KEY_API_CACHE_PARAMETERS : owner_api}
+
+    with _owner_api_cache_lock:
+      _owner_api_cache[key]= cached
+
+    if self.__owner_api_cache_file:
+      write_file_atomically(self.__owner_api_cache_file, encode_json(cached, pretty= True))
+
+
+  # Download Owner API parameters from our special place
+  def __download_owner_api_parameters(self):
+    owner_api_response= None
     try:
-      owner_api_response= requests.get(OWNERAPI_CLIENT_TOKENS_URL)
+      owner_api_response= self.__send('GET', ENDPOINT_OWNER_API, OWNERAPI_CLIENT_TOKENS_URL)
 
       if owner_api_response.status_code == STATUS_CODE_OK:
-        owner_api= owner_api_response.json()
-        
-        # URL validation code from SethRobertson https://github.com/gglockner/teslajson/pull/12/files
-        prefix='https://'
-        owner_url= owner_api[API_VERSION][KEY_API_BASEURL]
-        if (not owner_url.startswith(prefix) or '/' in owner_url[len(prefix):]
-          or not owner_url.endswith(('.teslamotors.com', '.tesla.com'))):
-            raise IOError('Unexpected token source URL <{}>'.format(owner_url))
-        
-        return owner_api
+        return validate_owner_api_parameters(decode_json(owner_api_response.content))
       else:
         if self.__debug:
           raise Exception('Could not obtain Owner API parameters (status code {})'.format(
@@ -193,38 +1724,48 @@ class TeslaRequest:
         raise Exception('Could not obtain a token (no credentials to obtain a new one)!', self)
 
 
-  # Refresh access token
+  # Refresh access token (through the token store when we have one, so concurrent refreshes coalesce)
   def __refresh_token(self):
+    if self.__token_store is not None:
+      self.__token, refreshed= self.__token_store.refresh(self.__request_token_refresh, self.__token)
+    else:
+      self.__token= self.__request_token_refresh(self.__token)
+
+    self.__token_refreshed= True
+    return self.__token_refreshed
+
+
+  # Exchange the refresh token of the specified token for a new token
+  def __request_token_refresh(self, token):
     try:
       owner_api= {}
       owner_api[API_VERSION]= {}
       
-      owner_api[API_VERSION][KEY_API_BASEURL]= self.__token[KEY_TOKEN_URL]
-      owner_api[API_VERSION][KEY_API_ID]= self.__token[KEY_TOKEN_ID]
-      owner_api[API_VERSION][KEY_API_SECRET]= self.__token[KEY_TOKEN_SECRET]
+      owner_api[API_VERSION][KEY_API_BASEURL]= token[KEY_TOKEN_URL]
+      owner_api[API_VERSION][KEY_API_ID]= token[KEY_TOKEN_ID]
+      owner_api[API_VERSION][KEY_API_SECRET]= token[KEY_TOKEN_SECRET]
       
-      request= self.__token[KEY_TOKEN_URL] + REQUEST_TOKEN
+      request= token[KEY_TOKEN_URL] + REQUEST_TOKEN
       payload= {
         'grant_type' : 'refresh_token',
-  			'client_id' : self.__token[KEY_TOKEN_ID],
-  			'client_secret' : self.__token[KEY_TOKEN_SECRET],
-  			'refresh_token' : self.__token[KEY_TOKEN_REFRESH]
+  			'client_id' : token[KEY_TOKEN_ID],
+  			'client_secret' : token[KEY_TOKEN_SECRET],
+  			'refresh_token' : token[KEY_TOKEN_REFRESH]
       }
     except Exception as error:
       if self.__debug:
         print('Failed to formulate refresh token request')
       raise error
 
-    response= requests.post(request, json= payload)
+    response= self.__send('POST', ENDPOINT_TOKEN, request, json= payload)
 
     if response.status_code == STATUS_CODE_OK:
-      self.__token= response.json()
-      self.__token[KEY_TOKEN_URL]= owner_api[API_VERSION][KEY_API_BASEURL]
-      self.__token[KEY_TOKEN_ID]= owner_api[API_VERSION][KEY_API_ID]
-      self.__token[KEY_TOKEN_SECRET]= owner_api[API_VERSION][KEY_API_SECRET]
-      self.__token_refreshed= True
+      token= decode_json(response.content)
+      token[KEY_TOKEN_URL]= owner_api[API_VERSION][KEY_API_BASEURL]
+      token[KEY_TOKEN_ID]= owner_api[API_VERSION][KEY_API_ID]
+      token[KEY_TOKEN_SECRET]= owner_api[API_VERSION][KEY_API_SECRET]
       
-      return self.__token_refreshed
+      return token
     else:
       if self.__debug:
         raise Exception('Failed to obtain token (status code {})'.format(
@@ -234,8 +1775,6 @@ class TeslaRequest:
           response.status_code))
 
 
-
-
   # Obtain new access token
   def __get_token(self):
     try:
@@ -254,14 +1793,17 @@ class TeslaRequest:
         print('Failed to formulate new token request')
       raise error
 
-    response= requests.post(request, json= payload)
+    response= self.__send('POST', ENDPOINT_TOKEN, request, json= payload)
 
     if response.status_code == STATUS_CODE_OK:
-      self.__token= response.json()
+      self.__token= decode_json(response.content)
       self.__token[KEY_TOKEN_URL]= owner_api[API_VERSION][KEY_API_BASEURL]
       self.__token[KEY_TOKEN_ID]= owner_api[API_VERSION][KEY_API_ID]
       self.__token[KEY_TOKEN_SECRET]= owner_api[API_VERSION][KEY_API_SECRET]
       self.__token_refreshed= True
+
+      if self.__token_store is not None:
+        self.__token_store.save(self.__token)
       
       return self.__token_refreshed
     else:
@@ -280,14 +1822,76 @@ class TeslaRequest:
       )
 
 
+  # Validate (and refresh or obtain) our token once, on first use
+  def __ensure_token(self):
+    if not self.__token_checked:
+      with self.__token_lock:
+        if not self.__token_checked:
+          self.__cache_token()
+          self.__token_checked= True
+
+
+  # Return owned vehicles, listing them once on first use
+  def __get_vehicles(self):
+    if self.__vehicles is None:
+      with self.__listing_lock:
+        if self.__vehicles is None:
+          self.__ensure_token()
+          self.__cache_vehicles()
+
+    return self.__vehicles
+
+
+  # Return the record of the specified vehicle
+  def __get_vehicle(self, vehicle_index):
+    return self.__get_vehicles()[vehicle_index]
+
+
+  # Return the record of the vehicle with the specified ID (which must still be listed)
+  def __get_listed_vehicle(self, vehicle_id):
+    self.__get_vehicles()
+    vehicle= self.__vehicles_by_id.get(vehicle_id)
+    if vehicle is None:
+      raise Exception('Vehicle with ID {} is no longer listed'.format(vehicle_id))
+
+    return vehicle
+
+
   # Obtain owned vehicles
   def __cache_vehicles(self):
     request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES
 
-    response= requests.get(request, headers= self.get_headers())
+    response= self.__send('GET', ENDPOINT_VEHICLES, request, headers= self.get_headers())
 
     if response.status_code == STATUS_CODE_OK:
-      self.__vehicles= response.json()
+      listing= decode_json(response.content)[KEY_VEHICLES]
+      listed= time.time()
+
+      # index by ID, VIN and name (cached state is keyed by ID, so a reordered list is harmless)
+      vehicles= []
+      vehicles_by_id= {}
+      vehicles_by_vin= {}
+      vehicles_by_name= {}
+      online_timestamps= {}
+      for vehicle_index in range(0, len(listing)):
+        vehicle= Vehicle(vehicle_index, listing[vehicle_index], self.__keep_raw_state)
+        vehicles.append(vehicle)
+        vehicles_by_id[vehicle.id]= vehicle
+        if vehicle.vin:
+          vehicles_by_vin[vehicle.vin]= vehicle
+        if vehicle.name is not None:
+          vehicles_by_name[vehicle.name]= vehicle
+        if vehicle.online_state == VALUE_STATE_ONLINE_ONLINE:
+          online_timestamps[vehicle.id]= listed
+
+      with self.__lock:
+        self.__vehicles_by_id= vehicles_by_id
+        self.__vehicles_by_vin= vehicles_by_vin
+        self.__vehicles_by_name= vehicles_by_name
+        self.__vehicles_timestamp= listed
+        self.__online_timestamps= online_timestamps
+        self.__vehicles= vehicles
+
       return True
     else:
       if self.__debug:
@@ -298,25 +1902,35 @@ class TeslaRequest:
           response.status_code))
 
 
-  # Obtain and cache indicated state of the specified vehicle
-  def __cache_state(self, vehicle_index, state_type):
-    attempts= self.__wake_up(vehicle_index)
+  # Obtain and cache indicated state of the vehicle with the specified ID
+  def __cache_state(self, vehicle_id, state_type):
+    attempts= self.__wake_up(vehicle_id)
       
-    if self.get_vehicle_online_state(vehicle_index) == VALUE_STATE_ONLINE_ONLINE:
+    if self.__get_listed_vehicle(vehicle_id).online_state == VALUE_STATE_ONLINE_ONLINE:
+      if self.__bulk_state and (state_type in REQUEST_DATA_ALL_STATES):
+        if (self.__cache_all_states(vehicle_id)
+          and state_type in self.__cache.get(vehicle_id, {})):
+            return
+
       headers= self.get_headers()
       request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
-        + '/' + str(self.get_vehicle_id(vehicle_index)) \
+        + '/' + str(vehicle_id) \
         + REQUEST_DATA_COMMANDS[state_type] + state_type
   
-      response= requests.get(request, headers= headers)
+      response= self.__send('GET', REQUEST_DATA_COMMANDS[state_type].lstrip('/') + state_type,
+        request, headers= headers)
+
+      if (response.status_code == STATUS_CODE_REQUEST_TIMEOUT) and (attempts == 0):
+        # the car dozed off since we last saw it online -- wake it up and try again
+        self.__set_online_state(vehicle_id, VALUE_STATE_ONLINE_ASLEEP)
+        return self.__cache_state(vehicle_id, state_type)
       
       if response.status_code == STATUS_CODE_OK:
-        state= response.json()[KEY_RESPONSE]
-        state[KEY_CACHE_EXPIRATION]= time.time() + self.__cache_expiration_limit
-  
-        if vehicle_index not in self.__cache:
-          self.__cache[vehicle_index]= {}
-        self.__cache[vehicle_index][state_type]= state
+        state= decode_json(response.content)[KEY_RESPONSE]
+        state[KEY_CACHE_TIMESTAMP]= time.time()
+        state[KEY_CACHE_EXPIRATION]= state[KEY_CACHE_TIMESTAMP] + self.__cache_expiration_limit
+        self.__set_online_state(vehicle_id, VALUE_STATE_ONLINE_ONLINE)
+        self.__store_state(vehicle_id, state_type, self.__make_state(state_type, state))
           
       else:
         if self.__debug:
@@ -327,23 +1941,167 @@ class TeslaRequest:
             
           raise Exception('Could not obtain state of vehicle'
             + ' named "{}" (status code {}) after {} attempt{}'.format(
-              self.get_vehicle_name(vehicle_index), response.status_code, attempts, plural_s),
+              self.__get_listed_vehicle(vehicle_id).name, response.status_code, attempts, plural_s),
             self, request, headers)
         else:
           raise Exception('Could not obtain state of vehicle'
             + ' named "{}" (status code {})'.format(
-              self.get_vehicle_name(vehicle_index), response.status_code))
+              self.__get_listed_vehicle(vehicle_id).name, response.status_code))
+
+
+  # Obtain and cache all state groups of the vehicle with the specified ID in a single request
+  # (returns False to fall back on the per-type requests)
+  def __cache_all_states(self, vehicle_id):
+    request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
+      + '/' + str(vehicle_id) \
+      + REQUEST_DATA_ALL
+
+    response= self.__send('GET', ENDPOINT_VEHICLE_DATA, request, headers= self.get_headers())
+
+    if response.status_code == STATUS_CODE_OK:
+      states= decode_json(response.content)[KEY_RESPONSE]
+      timestamp= time.time()
+      expiration= timestamp + self.__cache_expiration_limit
+      self.__set_online_state(vehicle_id, VALUE_STATE_ONLINE_ONLINE)
+
+      for state_type in REQUEST_DATA_ALL_STATES:
+        if state_type in states:
+          state= states[state_type]
+          state[KEY_CACHE_TIMESTAMP]= timestamp
+          state[KEY_CACHE_EXPIRATION]= expiration
+          self.__store_state(vehicle_id, state_type, self.__make_state(state_type, state))
+
+      return True
+    else:
+      if response.status_code == STATUS_CODE_NOT_FOUND:
+        # combined endpoint is not offered -- stop asking for it
+        self.__bulk_state= False
+
+      if self.__debug:
+        print('Could not obtain combined state of vehicle named "{}" (status code {}),'
+          ' falling back to individual requests'.format(
+            self.__get_listed_vehicle(vehicle_id).name, response.status_code))
+
+      return False
+
+
+  # Parse a raw state dict into the compact record kept for its state type (if there is one)
+  def __make_state(self, state_type, state):
+    record= self.__state_records.get(state_type)
+    if (record is None) or not isinstance(state, dict):
+      return state
+
+    return record(state, self.__keep_raw_state)
+
+
+  # Cache state for the vehicle with the specified ID (writing through to the persistent store)
+  # and record how it differs from the previous snapshot
+  def __store_state(self, vehicle_id, state_type, state):
+    previous= self.__cache.get(vehicle_id, {}).get(state_type)
+    if (previous is None) and self.__cache_store:
+      previous= self.__cache_store.get(vehicle_id, state_type)
+    derived= KEY_CACHE_COMMAND in state
+
+    if previous and (KEY_CACHE_COMMAND in previous) and not derived:
+      # a fetch following a command: confirm what we assumed the command did
+      effects= COMMAND_STATE_EFFECTS.get(previous[KEY_CACHE_COMMAND], (None, {}))[1]
+      confirmed= all(previous.get(key) == state.get(key) for key in effects.keys())
+      self.__metrics.record_cache(state_type, 'command_verified' if confirmed else 'command_mismatch')
+
+    with self.__lock:
+      self.__cache.setdefault(vehicle_id, {})[state_type]= state
+
+      # command-derived state is an assumption: changes, revisions and history wait for the next
+      # fetch, which is compared with the last fetched state rather than with the assumption
+      if derived:
+        self.__command_bases.setdefault((vehicle_id, state_type), previous)
+      else:
+        changes= diff_states(self.__command_bases.pop((vehicle_id, state_type), previous), state)
+        record= self.__changes.setdefault(vehicle_id, {}).setdefault(state_type,
+          {'revision' : 0, 'changes' : {}})
+        record['changes']= changes
+        if changes:
+          record['revision']+= 1
+
+    if self.__history and not derived:
+      self.__history.record(vehicle_id, state_type, state)
+
+    if self.__cache_store:
+      self.__cache_store.put(vehicle_id, state_type,
+        state.to_dict() if isinstance(state, StateRecord) else state)
+
+
+  # Load still valid state for the vehicle with the specified ID from the persistent store
+  def __load_state(self, vehicle_id, state_type):
+    if self.__cache_store:
+      state= self.__cache_store.get(vehicle_id, state_type)
+
+      if state and (state[KEY_CACHE_EXPIRATION] >= time.time()):
+        with self.__lock:
+          self.__cache.setdefault(vehicle_id, {})[state_type]= self.__make_state(state_type, state)
+        return True
+
+    return False
+
+
+  # Load expired state for the vehicle with the specified ID if it is still within the staleness budget
+  def __load_stale_state(self, vehicle_id, state_type):
+    state= self.__cache.get(vehicle_id, {}).get(state_type)
+
+    if (state is None) and self.__cache_store:
+      state= self.__cache_store.get(vehicle_id, state_type)
+      if state:
+        state= self.__make_state(state_type, state)
+
+    if state and (time.time() - state.get(KEY_CACHE_TIMESTAMP, 0) <= self.__max_staleness):
+      with self.__lock:
+        self.__cache.setdefault(vehicle_id, {})[state_type]= state
+      return True
+
+    return False
+
+
+  # Is the vehicle with the specified ID known not to be online (per a recent, cheap vehicle listing)?
+  # (a refreshed listing may be in another order, so the car is looked up by its ID)
+  def __is_vehicle_dormant(self, vehicle_id):
+    if not self.__wake_strategy.is_online_fresh(self.__vehicles_timestamp):
+      self.refresh_vehicles()
+
+    return self.__get_listed_vehicle(vehicle_id).online_state != VALUE_STATE_ONLINE_ONLINE
 
 
   # Return state for the specified vehicle
   def __get_state(self, vehicle_index, state_type):
     try:
-      if ((vehicle_index not in self.__cache)
-        or (state_type not in self.__cache[vehicle_index])
-        or (self.__cache[vehicle_index][state_type][KEY_CACHE_EXPIRATION] < time.time())):
-          self.__cache_state(vehicle_index, state_type)
+      # one fetch per vehicle at a time -- concurrent callers wait and then hit the cache
+      vehicle_id= self.get_vehicle_id(vehicle_index)
+      with self.__get_vehicle_lock(vehicle_id):
+        if ((vehicle_id not in self.__cache)
+          or (state_type not in self.__cache[vehicle_id])):
+            self.__metrics.record_cache(state_type, 'miss')
+        elif self.__cache[vehicle_id][state_type][KEY_CACHE_EXPIRATION] < time.time():
+          self.__metrics.record_cache(state_type, 'expiration')
+        else:
+          self.__metrics.record_cache(state_type, 'hit')
+          return self.__cache[vehicle_id][state_type]
+
+        served_stale= False
+        if self.__load_state(vehicle_id, state_type):
+          self.__metrics.record_cache(state_type, 'store_hit')
+        elif (self.__passive and self.__is_vehicle_dormant(vehicle_id)
+          and self.__load_stale_state(vehicle_id, state_type)):
+            self.__metrics.record_cache(state_type, 'stale_hit')
+            served_stale= True
+        else:
+          self.__cache_state(vehicle_id, state_type)
+
+        with self.__lock:
+          if served_stale:
+            self.__served_stale.setdefault(vehicle_id, set()).add(state_type)
+          else:
+            self.__served_stale.get(vehicle_id, set()).discard(state_type)
 
-      return self.__cache[vehicle_index][state_type]
+        return self.__cache[vehicle_id][state_type]
 
     except Exception as error:
       if self.__debug:
@@ -352,50 +2110,127 @@ class TeslaRequest:
       raise error
 
 
-  # Wake up specified vehicle
-  def __wake_up(self, vehicle_index):
+  # Return the lock serializing network access for the specified vehicle ID
+  def __get_vehicle_lock(self, vehicle_id):
+    with self.__lock:
+      if vehicle_id not in self.__vehicle_locks:
+        self.__vehicle_locks[vehicle_id]= threading.RLock()
+      return self.__vehicle_locks[vehicle_id]
+
+
+  # Wake up the vehicle with the specified ID (returns the number of wake-up requests it took)
+  def __wake_up(self, vehicle_id):
+    strategy= self.__wake_strategy
+    vehicle= self.__get_listed_vehicle(vehicle_id)
+
+    if ((vehicle.online_state == VALUE_STATE_ONLINE_ONLINE)
+      and strategy.is_online_fresh(self.__online_timestamps.get(vehicle_id, 0))):
+        return 0
+
+    # a car that keeps failing to wake up is left alone until its circuit cools down
+    # (unless the listing, however old, says it is online)
+    circuit= BREAKER_VEHICLE + str(vehicle_id)
+    if vehicle.online_state != VALUE_STATE_ONLINE_ONLINE:
+      self.__breakers.check(circuit, 'Waking up vehicle named "{}"'.format(vehicle.name))
+
     headers= self.get_headers()
     request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
-      + '/' + str(self.get_vehicle_id(vehicle_index)) \
+      + '/' + str(vehicle_id) \
       + '/' + COMMAND_WAKE_UP
-      
+
+    started= time.time()
+    deadline= started + strategy.deadline
     awake= False
+    online_state= VALUE_STATE_UNKNOWN
     attempts= 0
-    while attempts < MAX_ATTEMPTS:
-      attempts+= 1
-      response= requests.post(request, headers= headers)
-      time.sleep(ATTEMPT_RETRY_DELAY)
-    
-      if response.status_code == STATUS_CODE_OK:
-        if response.json()[STATUS_RESPONSE][KEY_VEHICLE_ONLINE_STATE] == VALUE_STATE_ONLINE_ONLINE:
-          awake= True
-          self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_ONLINE_STATE]= VALUE_STATE_ONLINE_ONLINE
+    try:
+      while True:
+        attempts+= 1
+        response= self.__send('POST', COMMAND_WAKE_UP, request, headers= headers)
+      
+        if response.status_code == STATUS_CODE_OK:
+          online_state= decode_json(response.content)[STATUS_RESPONSE][KEY_VEHICLE_ONLINE_STATE]
+          self.__set_online_state(vehicle_id, online_state)
+          if online_state == VALUE_STATE_ONLINE_ONLINE:
+            awake= True
+            break
+
+        delay= min(strategy.get_delay(attempts), deadline - time.time())
+        if delay <= 0:
           break
+        time.sleep(delay)
+    except Exception as error:
+      # an API failure says nothing about the car (its endpoint circuit counts it instead)
+      self.__breakers.release_probe(circuit)
+      raise error
+
+    if awake:
+      self.__breakers.record_success(circuit)
+    else:
+      self.__breakers.record_failure(circuit)
+
+    self.__metrics.record_wake(vehicle_id, attempts, time.time() - started, awake)
 
     if not awake:
       if self.__debug:
         raise Exception('Could not wake up vehicle'
-          + ' named "{}" (response code {}, status is {})'.format(
-            self.get_vehicle_name(vehicle_index), response.status_code,
-            response.json()[STATUS_RESPONSE][KEY_VEHICLE_ONLINE_STATE]),
+          + ' named "{}" (response code {}, status is {}) after {} attempts'.format(
+            vehicle.name, response.status_code, online_state, attempts),
           self, request, headers)
       else:
         raise Exception('Could not wake up vehicle'
           + ' named "{}" (response code {}, status is {})'.format(
-            self.get_vehicle_name(vehicle_index), response.status_code,
-            response.json()[STATUS_RESPONSE][KEY_VEHICLE_ONLINE_STATE]))
+            vehicle.name, response.status_code, online_state))
     else:
       return attempts
 
 
-  # Expire indicated state cache
-  def __expire_cache(self, vehicle_index, state_type):
-    self.__cache[vehicle_index][state_type][KEY_CACHE_EXPIRATION]= 0
+  # Record the observed online state of the vehicle with the specified ID
+  def __set_online_state(self, vehicle_id, online_state):
+    vehicle= self.__get_listed_vehicle(vehicle_id)
+    with self.__lock:
+      vehicle.online_state= online_state
+      if online_state == VALUE_STATE_ONLINE_ONLINE:
+        self.__online_timestamps[vehicle.id]= time.time()
+      else:
+        self.__online_timestamps.pop(vehicle.id, None)
+
+
+  # Expire indicated state cache of the vehicle with the specified ID
+  def __expire_cache(self, vehicle_id, state_type):
+    with self.__lock:
+      if state_type in self.__cache.get(vehicle_id, {}):
+        self.__cache[vehicle_id][state_type][KEY_CACHE_EXPIRATION]= 0
+
+    if self.__cache_store:
+      self.__cache_store.invalidate(vehicle_id, state_type)
+
+
+  # Expire all cached state of the specified vehicle (in memory and in the persistent store)
+  def invalidate_cache(self, vehicle_index, state_type= None):
+    if state_type is None:
+      vehicle_id= self.get_vehicle_id(vehicle_index)
+      with self.__lock:
+        for cached_type in self.__cache.get(vehicle_id, {}).keys():
+          self.__cache[vehicle_id][cached_type][KEY_CACHE_EXPIRATION]= 0
+
+      if self.__cache_store:
+        self.__cache_store.invalidate(vehicle_id)
+    else:
+      self.__expire_cache(self.get_vehicle_id(vehicle_index), state_type)
               
 
+  # Prefetch everything a lazy instance would otherwise load on first use
+  def warm(self):
+    self.__ensure_token()
+    self.__get_vehicles()
+    return self
+
+
   # Formulate and return stored token parameters
   def get_token(self):
     try:
+      self.__ensure_token()
       return self.__token
     except Exception as error:
       if self.__debug:
@@ -403,9 +2238,40 @@ class TeslaRequest:
       raise error
 
 
+  # Return every vehicle and endpoint circuit with failures on record
+  def get_circuits(self):
+    return self.__breakers.get_circuits()
+
+
+  # Return the HTTP session used for all requests (pass it to other instances to share the pool)
+  def get_session(self):
+    return self.__session
+
+
+  # Release pooled connections and the persistent cache (only those that are ours to close)
+  def close(self):
+    if self.__session_owned:
+      self.__session.close()
+
+    if self.__cache_store_owned:
+      self.__cache_store.close()
+
+
+  # Return a snapshot of request, wake-up and cache instrumentation
+  def get_metrics(self):
+    return self.__metrics.get_metrics()
+
+
+  # Write instrumentation to the specified file (Prometheus textfile for *.prom, JSON otherwise)
+  def dump_metrics(self, path, metrics_format= None):
+    self.__metrics.dump(path, metrics_format)
+
+
   # Force refresh of our access token
   def force_token_refresh(self):
-    self.__refresh_token()
+    with self.__token_lock:
+      self.__refresh_token()
+      self.__token_checked= True
 
 
   # Do we have a refreshed token (make sure to save it!)
@@ -416,6 +2282,7 @@ class TeslaRequest:
   # Formulate and return stored Owner API URL
   def get_url(self):
     try:
+      self.__ensure_token()
       return self.__token[KEY_TOKEN_URL]
     except Exception as error:
       if self.__debug:
@@ -426,6 +2293,7 @@ class TeslaRequest:
   # Formulate and return stored Owner API request headers
   def get_headers(self):
     try:
+      self.__ensure_token()
       return {
         'Authorization' : self.__token[KEY_TOKEN_TYPE] + ' ' + self.__token[KEY_TOKEN],
         'User-Agent' : 'teslarequest.py'
@@ -436,20 +2304,132 @@ class TeslaRequest:
       raise error
 
 
+  # Return the age in seconds of cached state for the specified vehicle (None if nothing is cached)
+  def get_state_age(self, vehicle_index, state_type):
+    state= self.__cache.get(self.get_vehicle_id(vehicle_index), {}).get(state_type)
+    if (state is None) or (KEY_CACHE_TIMESTAMP not in state):
+      return None
+
+    return time.time() - state[KEY_CACHE_TIMESTAMP]
+
+
+  # Is cached state for the specified vehicle past its expiration (a command result, say)?
+  def is_state_stale(self, vehicle_index, state_type):
+    state= self.__cache.get(self.get_vehicle_id(vehicle_index), {}).get(state_type)
+    return (state is None) or (state[KEY_CACHE_EXPIRATION] < time.time())
+
+
+  # Was cached state for the specified vehicle last served stale because the car was asleep
+  # (passive mode) rather than fetched?
+  def is_state_served_stale(self, vehicle_index, state_type):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    with self.__lock:
+      return state_type in self.__served_stale.get(vehicle_id, set())
+
+
+  # Return age, expiration and stale serving of each cached state type for the specified vehicle
+  def get_state_freshness(self, vehicle_index):
+    freshness= {}
+    for state_type in self.__cache.get(self.get_vehicle_id(vehicle_index), {}).keys():
+      freshness[state_type]= {
+        'age' : self.get_state_age(vehicle_index, state_type),
+        'stale' : self.is_state_stale(vehicle_index, state_type),
+        'served_stale' : self.is_state_served_stale(vehicle_index, state_type),
+      }
+
+    return freshness
+
+
+  # Return what changed in the latest refresh of the indicated state of the specified vehicle
+  # (as {key : (old, new)}, or {state_type : {key : (old, new)}} across all state types)
+  def get_changes(self, vehicle_index, state_type= None):
+    records= self.__changes.get(self.get_vehicle_id(vehicle_index), {})
+
+    with self.__lock:
+      if state_type is None:
+        return dict((cached_type, dict(record['changes'])) for cached_type, record in records.items())
+      elif state_type in records:
+        return dict(records[state_type]['changes'])
+      else:
+        return {}
+
+
+  # Return how many refreshes of the indicated state of the specified vehicle brought changes
+  def get_state_revision(self, vehicle_index, state_type):
+    record= self.__changes.get(self.get_vehicle_id(vehicle_index), {}).get(state_type)
+    if record is None:
+      return 0
+
+    return record['revision']
+
+
+  # Return sample times and values of a recorded state field of the specified vehicle
+  def get_history(self, vehicle_index, field, start= None, end= None):
+    if self.__history is None:
+      raise Exception('No state history is being recorded')
+
+    return self.__history.query(self.get_vehicle_id(vehicle_index), field, start, end)
+
+
   # Return count of stored vehicles
   def get_vehicle_count(self):
     try:
-      return self.__vehicles[KEY_VEHICLE_COUNT]
+      return len(self.__get_vehicles())
     except Exception as error:
       if self.__debug:
         print('No vehicles stored!')
       raise error
 
 
+  # Re-list owned vehicles (cached state survives, keyed by vehicle ID; callers arriving while
+  # a listing is under way take its result instead of asking again)
+  def refresh_vehicles(self):
+    requested= time.time()
+    with self.__listing_lock:
+      if self.__vehicles_timestamp >= requested:
+        return True
+
+      self.__ensure_token()
+      return self.__cache_vehicles()
+
+
+  # Return compact records of all owned vehicles in listing order
+  def get_vehicles(self):
+    return list(self.__get_vehicles())
+
+
+  # Return the compact record of the specified vehicle
+  def get_vehicle(self, vehicle_index):
+    try:
+      return self.__get_vehicle(vehicle_index)
+    except Exception as error:
+      if self.__debug:
+        print('Could not access vehicle #{}'.format(vehicle_index))
+      raise error
+
+
+  # Return the record of the vehicle with the specified ID (None if there is no such vehicle)
+  def get_vehicle_by_id(self, vehicle_id):
+    self.__get_vehicles()
+    return self.__vehicles_by_id.get(vehicle_id)
+
+
+  # Return the record of the vehicle with the specified VIN (None if there is no such vehicle)
+  def get_vehicle_by_vin(self, vin):
+    self.__get_vehicles()
+    return self.__vehicles_by_vin.get(vin)
+
+
+  # Return the record of the vehicle with the specified display name (None if there is no such vehicle)
+  def get_vehicle_by_name(self, name):
+    self.__get_vehicles()
+    return self.__vehicles_by_name.get(name)
+
+
   # Return the name of the specified vehicle
   def get_vehicle_name(self, vehicle_index):
     try:
-      return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_NAME]
+      return self.__get_vehicle(vehicle_index).name
     except Exception as error:
       if self.__debug:
         print('Could not access the name of vehicle #{}'.format(vehicle_index))
@@ -459,7 +2439,7 @@ class TeslaRequest:
   # Return the ID of the specified vehicle
   def get_vehicle_id(self, vehicle_index):
     try:
-      return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_ID]
+      return self.__get_vehicle(vehicle_index).id
     except Exception as error:
       if self.__debug:
         print('Could not access the ID of vehicle #{}'.format(vehicle_index))
@@ -469,7 +2449,7 @@ class TeslaRequest:
   # Return the online state of the specified vehicle
   def get_vehicle_online_state(self, vehicle_index):
     try:
-      return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_ONLINE_STATE]
+      return self.__get_vehicle(vehicle_index).online_state
     except Exception as error:
       if self.__debug:
         print('Could not access the online state of vehicle #{}'.format(vehicle_index))
@@ -479,7 +2459,7 @@ class TeslaRequest:
   # Return the in-service state of the specified vehicle
   def is_vehicle_in_service(self, vehicle_index):
     try:
-      return self.__vehicles[KEY_VEHICLES][vehicle_index][KEY_VEHICLE_INSERVICE_STATE]
+      return self.__get_vehicle(vehicle_index).in_service
     except Exception as error:
       if self.__debug:
         print('Could not access the in-service state of vehicle #{}'.format(vehicle_index))
@@ -553,7 +2533,7 @@ class TeslaRequest:
     try:
       state= self.get_drive_state(vehicle_index)
 
-      return (state['latitude'], state['longitude'])
+      return (state[KEY_STATE_DRIVE_LATITUDE], state[KEY_STATE_DRIVE_LONGITUDE])
 
     except Exception as error:
       if self.__debug:
@@ -664,54 +2644,394 @@ class TeslaRequest:
       raise error
 
 
-  # Issue a command to the specified vehicle
-  def issue_command(self, vehicle_index, command, payload):
+  # Send a command to the vehicle with the specified ID, waking it up first (and once more if it dozed off)
+  def __post_command(self, vehicle_id, command, payload):
+    attempts= self.__wake_up(vehicle_id)
+
     headers= self.get_headers()
     request= self.get_url() + OWNERAPI_VERSION + REQUEST_VEHICLES \
-      + '/' + str(self.get_vehicle_id(vehicle_index)) \
+      + '/' + str(vehicle_id) \
       + '/command/' + command
 
-    response= requests.post(request, headers= headers, json= payload)
+    try:
+      response= self.__send('POST', ENDPOINT_COMMAND + command, request, headers= headers, json= payload)
+    except Exception as error:
+      self.__metrics.record_command(command, 'failed')
+      self.__apply_command(vehicle_id, command, payload, False)
+      raise error
+
+    if (response.status_code == STATUS_CODE_REQUEST_TIMEOUT) and (attempts == 0):
+      # the car dozed off since we last saw it online -- wake it up and try again
+      self.__set_online_state(vehicle_id, VALUE_STATE_ONLINE_ASLEEP)
+      return self.__post_command(vehicle_id, command, payload)
 
     if response.status_code == STATUS_CODE_OK:
-      return response.json()[STATUS_RESPONSE][STATUS_RESPONSE_RESULT]
+      result= decode_json(response.content)[STATUS_RESPONSE][STATUS_RESPONSE_RESULT]
+      self.__metrics.record_command(command, 'sent' if result else 'failed')
+      self.__apply_command(vehicle_id, command, payload, result)
+      return result
     else:
+      self.__metrics.record_command(command, 'failed')
+      self.__apply_command(vehicle_id, command, payload, False)
       if self.__debug:
-        raise Exception('Failed to issue command "{}" to vehicle named "{}" (status code {})'.format(command, self.get_vehicle_name(vehicle_index), response.status_code), self, request, response.json())
+        raise Exception('Failed to issue command "{}" to vehicle named "{}" (status code {})'.format(command, self.__get_listed_vehicle(vehicle_id).name, response.status_code), self, request, decode_json(response.content))
       else:
-        raise Exception('Failed to issue command "{}" to vehicle named "{}" (status code {})'.format(command, self.get_vehicle_name(vehicle_index), response.status_code))
+        raise Exception('Failed to issue command "{}" to vehicle named "{}" (status code {})'.format(command, self.__get_listed_vehicle(vehicle_id).name, response.status_code))
+
+
+  # Update cached state with the known effect of a successful command (marked as command-derived),
+  # or expire it when the outcome or the effect is unknown
+  def __apply_command(self, vehicle_id, command, payload, result):
+    if command not in COMMAND_STATE_EFFECTS:
+      return
+
+    state_type= COMMAND_STATE_EFFECTS[command][0]
+    with self.__lock:
+      cached= self.__cache.get(vehicle_id, {}).get(state_type)
+      state= cached.copy() if (result and cached) else None
+
+    effect= get_command_effect(command, payload, state) if state else None
+    if effect is not None:
+      state.update(effect)
+    else:
+      state= None
 
+    if state is None:
+      self.__expire_cache(vehicle_id, state_type)
+      return
 
-  # Issue a command to the specified vehicle to set its charging limit
-  def set_charging_limit(self, vehicle_index, limit):
-    payload= {'percent' : limit}
-    self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_CHARGE)
-    return self.issue_command(vehicle_index, 'set_charge_limit', payload)
+    state[KEY_CACHE_COMMAND]= command
+    if self.__command_verify_delay is not None:
+      state[KEY_CACHE_EXPIRATION]= min(state[KEY_CACHE_EXPIRATION],
+        time.time() + self.__command_verify_delay)
+    self.__store_state(vehicle_id, state_type, state)
 
 
-  # Issue a command to the specified vehicle to set maximum range charging limit
-  def set_charging_limit_max(self, vehicle_index):
-    payload= {}
-    self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_CHARGE)
-    return self.issue_command(vehicle_index, 'charge_max_range', payload)
+  # Does fresh cached state show the vehicle with the specified ID already as the command would leave it?
+  def __is_command_satisfied(self, vehicle_id, command, payload):
+    if command not in COMMAND_STATE_EFFECTS:
+      return False
+
+    state_type= COMMAND_STATE_EFFECTS[command][0]
+    with self.__lock:
+      state= self.__cache.get(vehicle_id, {}).get(state_type)
+      if (state is None) or (state[KEY_CACHE_EXPIRATION] < time.time()):
+        return False
+
+      effect= get_command_effect(command, payload, state)
+      return (effect is not None) and all(state.get(key) == value for key, value in effect.items())
+
+
+  # Skip (and count) a command in idempotent mode when it would change nothing
+  def __skip_command(self, vehicle_id, command, payload, idempotent):
+    if idempotent is None:
+      idempotent= self.__idempotent
+
+    if idempotent and self.__is_command_satisfied(vehicle_id, command, payload):
+      self.__metrics.record_command(command, 'skipped')
+      if self.__debug:
+        print('Skipping command "{}" to vehicle named "{}": already satisfied'.format(
+          command, self.__get_listed_vehicle(vehicle_id).name))
+      return True
+
+    return False
+
+
+  # Issue a command to the specified vehicle (in idempotent mode, return True right away
+  # when fresh cached state shows it would change nothing)
+  def issue_command(self, vehicle_index, command, payload, idempotent= None):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    with self.__get_vehicle_lock(vehicle_id):
+      if self.__skip_command(vehicle_id, command, payload, idempotent):
+        return True
+      return self.__post_command(vehicle_id, command, payload)
+
+
+  # Queue a command for the specified vehicle, replacing a queued duplicate or one it supersedes
+  def queue_command(self, vehicle_index, command, payload= None, idempotent= None):
+    payload= payload or {}
+    group= COMMAND_GROUPS.get(command, (command, json.dumps(payload, sort_keys=True)))
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+
+    with self.__lock:
+      queue= self.__command_queues.setdefault(vehicle_id, [])
+      queue[:]= [entry for entry in queue if entry[0] != group]
+      queue.append((group, command, payload, idempotent))
+
+
+  # Return commands queued for the specified vehicle as (command, payload) in sending order
+  def get_queued_commands(self, vehicle_index):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    with self.__lock:
+      return [(command, payload) for group, command, payload, idempotent
+        in self.__command_queues.get(vehicle_id, [])]
+
+
+  # Send commands queued for the specified vehicle in order behind a single wake-up and
+  # return the outcome of each (a failed command does not stop the ones after it; commands
+  # skipped in idempotent mode succeed without waking the car)
+  def flush_commands(self, vehicle_index):
+    vehicle_id= self.get_vehicle_id(vehicle_index)
+    with self.__lock:
+      queue= self.__command_queues.pop(vehicle_id, [])
+
+    results= []
+    with self.__get_vehicle_lock(vehicle_id):
+      pending= []
+      for group, command, payload, idempotent in queue:
+        outcome= {'command' : command, 'payload' : payload, 'result' : True, 'error' : None,
+          'skipped' : self.__skip_command(vehicle_id, command, payload, idempotent)}
+        results.append(outcome)
+        if not outcome['skipped']:
+          pending.append(outcome)
+
+      try:
+        if pending:
+          self.__wake_up(vehicle_id)
+      except Exception as error:
+        for outcome in pending:
+          outcome.update({'result' : False, 'error' : error})
+        return results
+
+      for outcome in pending:
+        try:
+          outcome['result']= self.__post_command(vehicle_id, outcome['command'], outcome['payload'])
+        except Exception as error:
+          outcome.update({'result' : False, 'error' : error})
+
+    return results
+
+
+  # Issue (or queue) a command to the specified vehicle to set its charging limit
+  def set_charging_limit(self, vehicle_index, limit, queued= False, idempotent= None):
+    return self.__command(vehicle_index, COMMAND_SET_CHARGE_LIMIT, {'percent' : limit},
+      queued, idempotent)
+
+
+  # Issue (or queue) a command to the specified vehicle to set maximum range charging limit
+  def set_charging_limit_max(self, vehicle_index, queued= False, idempotent= None):
+    return self.__command(vehicle_index, COMMAND_CHARGE_MAX_RANGE, {}, queued, idempotent)
+
+
+  # Issue (or queue) a command to the specified vehicle to set standard charging limit
+  def set_charging_limit_standard(self, vehicle_index, queued= False, idempotent= None):
+    return self.__command(vehicle_index, COMMAND_CHARGE_STANDARD, {}, queued, idempotent)
+
+
+  # Issue (or queue) a command to the specified vehicle to turn Sentry Mode on
+  def set_sentry_mode_on(self, vehicle_index, queued= False, idempotent= None):
+    return self.__command(vehicle_index, COMMAND_SET_SENTRY_MODE, {'on' : True}, queued, idempotent)
+
+
+  # Issue (or queue) a command to the specified vehicle to turn Sentry Mode off
+  def set_sentry_mode_off(self, vehicle_index, queued= False, idempotent= None):
+    return self.__command(vehicle_index, COMMAND_SET_SENTRY_MODE, {'on' : False}, queued, idempotent)
+
+
+  # Issue a command right away, or queue it for flush_commands() (returning None)
+  def __command(self, vehicle_index, command, payload, queued, idempotent):
+    if queued:
+      self.queue_command(vehicle_index, command, payload, idempotent)
+      return None
+    else:
+      return self.issue_command(vehicle_index, command, payload, idempotent)
+
+
+#
+# Define our fleet manager: one TeslaRequest per account, sharing a connection pool, the state
+# cache, history, metrics and circuit breakers, with every account and vehicle task run under one concurrency limit
+# (each account keeps its own request scheduler, since the Owner API throttles per account)
+#
+class FleetManager:
+
+  # Constructor (source is a token directory or manifest, or a list of (account, token file) pairs)
+  def __init__(self, source, arguments= None, max_workers= FLEET_MAX_WORKERS):
+    if isinstance(source, str):
+      token_files= load_token_files(source)
+    else:
+      token_files= list(source)
+
+    if arguments is None:
+      arguments= types.SimpleNamespace()
+    self.__max_workers= max(1, max_workers)
+
+    # Share one pool, cache, history and metrics across accounts (closing only what we opened)
+    if getattr(arguments, 'session', None) is not None:
+      self.__session= arguments.session
+      self.__session_owned= False
+    else:
+      self.__session= create_session(
+        pool_connections= getattr(arguments, 'pool_connections', POOL_CONNECTIONS),
+        pool_maxsize= max(getattr(arguments, 'pool_maxsize', POOL_MAXSIZE), FLEET_POOL_MAXSIZE,
+          self.__max_workers),
+        pool_block= getattr(arguments, 'pool_block', POOL_BLOCK),
+        max_retries= getattr(arguments, 'max_retries', POOL_MAX_RETRIES),
+        adapter= getattr(arguments, 'adapter', None))
+      self.__session_owned= True
+
+    if getattr(arguments, 'cache_store', None) is not None:
+      self.__cache_store= arguments.cache_store
+      self.__cache_store_owned= False
+    elif getattr(arguments, 'cache_file', None):
+      self.__cache_store= StateCache(arguments.cache_file)
+      self.__cache_store_owned= True
+    else:
+      self.__cache_store= None
+      self.__cache_store_owned= False
+
+    if getattr(arguments, 'history', None) is not None:
+      self.__history= arguments.history
+    elif getattr(arguments, 'history_dir', None):
+      self.__history= HistoryRecorder(arguments.history_dir)
+    else:
+      self.__history= None
+
+    if getattr(arguments, 'metrics', None) is not None:
+      self.__metrics= arguments.metrics
+    else:
+      self.__metrics= RequestMetrics()
+    if getattr(arguments, 'metrics_file', None):
+      atexit.register(self.__metrics.dump, arguments.metrics_file,
+        getattr(arguments, 'metrics_format', None))
+
+    if getattr(arguments, 'breakers', None) is not None:
+      self.__breakers= arguments.breakers
+    else:
+      self.__breakers= CircuitBreakers(self.__cache_store,
+        failures= getattr(arguments, 'breaker_failures', BREAKER_FAILURES),
+        cooldown= getattr(arguments, 'breaker_cooldown', BREAKER_COOLDOWN))
+
+    # Build each account lazily: tokens are checked and vehicles listed concurrently on first use
+    # (an account whose token cannot be loaded is reported by every map instead of built)
+    self.__accounts= []
+    self.__arguments= {}
+    self.__requests= {}
+    self.__errors= {}
+    for account, token_file in token_files:
+      account_arguments= copy.copy(arguments)
+      for setting in FLEET_ACCOUNT_ARGUMENTS:
+        if hasattr(account_arguments, setting):
+          delattr(account_arguments, setting)
+
+      account_arguments.token_file= token_file
+      account_arguments.session= self.__session
+      account_arguments.cache_store= self.__cache_store
+      account_arguments.history= self.__history
+      account_arguments.metrics= self.__metrics
+      account_arguments.breakers= self.__breakers
+      account_arguments.lazy= True
+
+      self.__accounts.append(account)
+      self.__arguments[account]= account_arguments
+      try:
+        self.__requests[account]= TeslaRequest(account_arguments)
+      except Exception as error:
+        self.__errors[account]= error
+
+
+  # Return account names in load order
+  def get_accounts(self):
+    return list(self.__accounts)
+
+
+  # Return the TeslaRequest of the specified account (None if it could not be built)
+  def get_request(self, account):
+    return self.__requests.get(account)
+
+
+  # Return the errors of accounts that could not be built, by account
+  def get_errors(self):
+    return dict(self.__errors)
+
+
+  # Return the arguments the specified account's TeslaRequest was built with
+  def get_arguments(self, account):
+    return self.__arguments[account]
+
+
+  # Return the HTTP session every account shares
+  def get_session(self):
+    return self.__session
+
+
+  # Return a snapshot of request, wake-up and cache instrumentation across all accounts
+  def get_metrics(self):
+    return self.__metrics.get_metrics()
+
+
+  # Call function(account, request) for every account, several at a time, and return a list of
+  # {account, vehicle, result, error} in account order (vehicle is always None)
+  def map_accounts(self, function):
+    with concurrent.futures.ThreadPoolExecutor(max_workers= self.__max_workers) as executor:
+      futures= [self.__submit(executor, account, function, account, self.__requests.get(account))
+        for account in self.__accounts]
+      return [self.__get_outcome(account, None, future) for account, future in
+        zip(self.__accounts, futures)]
+
+
+  # Call function(account, request, vehicle_index) for every vehicle of every account, several at
+  # a time across the whole fleet, and return a list of {account, vehicle, result, error} in account
+  # and vehicle order (an account whose vehicles could not be listed appears once, without a vehicle)
+  def map_vehicles(self, function):
+    with concurrent.futures.ThreadPoolExecutor(max_workers= self.__max_workers) as executor:
+      listings= {self.__submit(executor, account,
+        lambda request: request.get_vehicle_count(), self.__requests.get(account)) : account
+        for account in self.__accounts}
+
+      # start on an account's vehicles as soon as its listing arrives
+      futures= {}
+      for listing in concurrent.futures.as_completed(listings):
+        account= listings[listing]
+        if listing.exception() is not None:
+          futures[account]= listing
+        else:
+          futures[account]= [executor.submit(function, account, self.__requests[account], counter)
+            for counter in range(0, listing.result())]
+
+      outcomes= []
+      for account in self.__accounts:
+        if isinstance(futures[account], concurrent.futures.Future):
+          outcomes.append(self.__get_outcome(account, None, futures[account]))
+        else:
+          outcomes.extend(self.__get_outcome(account, counter, future)
+            for counter, future in enumerate(futures[account]))
+
+      return outcomes
+
+
+  # Submit a task for the specified account (or a future failed with its load error)
+  def __submit(self, executor, account, function, *arguments):
+    if account in self.__errors:
+      future= concurrent.futures.Future()
+      future.set_exception(self.__errors[account])
+      return future
+
+    return executor.submit(function, *arguments)
+
+
+  # Return the outcome of a finished task
+  def __get_outcome(self, account, vehicle_index, future):
+    outcome= {'account' : account, 'vehicle' : vehicle_index, 'result' : None, 'error' : None}
+    try:
+      outcome['result']= future.result()
+    except Exception as error:
+      outcome['error']= error
+
+    return outcome
 
 
-  # Issue a command to the specified vehicle to set standard charging limit
-  def set_charging_limit_standard(self, vehicle_index):
-    payload= {}
-    self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_CHARGE)
-    return self.issue_command(vehicle_index, 'charge_standard', payload)
+  # Check every account's token and list its vehicles, several accounts at a time
+  def warm(self):
+    return self.map_accounts(lambda account, request: request.warm())
 
 
-  # Issue a command to the specified vehicle to set its charging limit
-  def set_sentry_mode_on(self, vehicle_index):
-    payload= {'on' : True}
-    self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_VEHICLE)
-    return self.issue_command(vehicle_index, 'set_sentry_mode', payload)
+  # Release pooled connections and the persistent cache (only those that are ours to close)
+  def close(self):
+    for request in self.__requests.values():
+      request.close()
 
+    if self.__session_owned:
+      self.__session.close()
 
-  # Issue a command to the specified vehicle to set its charging limit
-  def set_sentry_mode_off(self, vehicle_index):
-    payload= {'on' : False}
-    self.__expire_cache(vehicle_index, REQUEST_DATA_STATE_VEHICLE)
-    return self.issue_command(vehicle_index, 'set_sentry_mode', payload)
\ No newline at end of file
+    if self.__cache_store_owned:
+      self.__cache_store.close()
@@ -0,0 +1,116 @@
+#
+# Import all necessary libraries
+#
+
+import asyncio
+import os
+import tempfile
+import threading
+import types
+import unittest
+
+import teslafakeapi
+
+try:
+  import aiohttp
+  import asyncteslarequest
+except ImportError:
+  # aiohttp is an optional dependency (the async extra)
+  aiohttp= None
+
+from teslarequest import StateCache, KEY_VEHICLES, REQUEST_DATA_STATE_VEHICLE
+
+
+#
+# Define a state cache recording which threads touch it
+#
+class RecordingStateCache(StateCache):
+
+  # Constructor
+  def __init__(self, path):
+    super().__init__(path)
+    self.threads= set()
+
+
+  def get(self, vehicle_id, state_type):
+    self.threads.add(threading.get_ident())
+    return super().get(vehicle_id, state_type)
+
+
+  def put(self, vehicle_id, state_type, state):
+    self.threads.add(threading.get_ident())
+    return super().put(vehicle_id, state_type, state)
+
+
+  def invalidate(self, vehicle_id, state_type= None):
+    self.threads.add(threading.get_ident())
+    return super().invalidate(vehicle_id, state_type)
+
+
+#
+# Exercise AsyncTeslaRequest against the stand-in Owner API
+#
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncTeslaRequestTest(unittest.TestCase):
+
+  def setUp(self):
+    self.api= teslafakeapi.FakeOwnerAPI(fleet_size= 3, latency= 0, asleep_fraction= 0, seed= 1).start()
+    self.directory= tempfile.TemporaryDirectory()
+    self.cache= RecordingStateCache(os.path.join(self.directory.name, 'cache.db'))
+
+
+  def tearDown(self):
+    self.cache.close()
+    self.api.stop()
+    self.directory.cleanup()
+
+
+  # Connect a request to the stand-in Owner API with our recording cache
+  def connect(self):
+    return asyncteslarequest.AsyncTeslaRequest.create(types.SimpleNamespace(
+      token= self.api.make_token(), quiet= True, cache_store= self.cache))
+
+
+  def test_reads_state_and_issues_commands(self):
+    async def run():
+      async with await self.connect() as request:
+        self.assertEqual(request.get_vehicle_count(), 3)
+        levels= await asyncio.gather(*[request.get_battery_level(index) for index in range(0, 3)])
+        self.assertTrue(all(0 <= level <= 100 for level in levels))
+
+        self.assertTrue(await request.set_sentry_mode_on(0))
+        self.assertTrue(await request.is_vehicle_sentry_mode_active(0))
+
+    asyncio.run(run())
+
+
+  def test_cache_follows_vehicle_ids_when_listing_reorders(self):
+    async def run():
+      async with await self.connect() as request:
+        names= [(await request.get_vehicle_state(index))['vehicle_name'] for index in range(0, 3)]
+
+        # the same cars, listed in reverse order
+        request._AsyncTeslaRequest__vehicles[KEY_VEHICLES].reverse()
+        for index in range(0, 3):
+          state= await request.get_vehicle_state(index)
+          self.assertEqual(state['vehicle_name'], names[2 - index])
+          self.assertEqual(state['vehicle_name'], request.get_vehicle_name(index))
+
+    asyncio.run(run())
+
+
+  def test_state_cache_runs_off_the_event_loop(self):
+    async def run():
+      async with await self.connect() as request:
+        await request.get_vehicle_state(0)
+        await request.invalidate_cache(0, REQUEST_DATA_STATE_VEHICLE)
+        await request.get_vehicle_state(0)
+        return threading.get_ident()
+
+    loop_thread= asyncio.run(run())
+    self.assertTrue(self.cache.threads)
+    self.assertNotIn(loop_thread, self.cache.threads)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,96 @@
+#
+# Import all necessary libraries
+#
+
+import os
+import tempfile
+import time
+import unittest
+
+from teslarequest import CircuitBreakers, CircuitOpenError, StateCache, \
+  BREAKER_STATE_CLOSED, BREAKER_STATE_OPEN, BREAKER_STATE_HALF_OPEN
+
+
+#
+# Exercise the circuit breakers
+#
+class CircuitBreakersTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory= tempfile.TemporaryDirectory()
+    self.store= StateCache(os.path.join(self.directory.name, 'cache.db'))
+
+
+  def tearDown(self):
+    self.store.close()
+    self.directory.cleanup()
+
+
+  def test_opens_after_consecutive_failures(self):
+    breakers= CircuitBreakers(failures= 3, cooldown= 60)
+
+    for counter in range(0, 2):
+      breakers.check('vehicle/1')
+      breakers.record_failure('vehicle/1')
+    self.assertEqual(breakers.get_state('vehicle/1'), BREAKER_STATE_CLOSED)
+
+    # a success in between starts the count over
+    breakers.record_success('vehicle/1')
+    for counter in range(0, 3):
+      breakers.check('vehicle/1')
+      breakers.record_failure('vehicle/1')
+    self.assertEqual(breakers.get_state('vehicle/1'), BREAKER_STATE_OPEN)
+
+    with self.assertRaises(CircuitOpenError) as context:
+      breakers.check('vehicle/1')
+    self.assertEqual(context.exception.circuit, 'vehicle/1')
+    self.assertGreater(context.exception.retry_at, time.time())
+
+    # other circuits are unaffected
+    breakers.check('vehicle/2')
+
+
+  def test_half_open_circuit_lets_a_single_probe_through(self):
+    breakers= CircuitBreakers(failures= 1, cooldown= 0.1, backoff= 2)
+    breakers.record_failure('vehicle/1')
+    time.sleep(0.15)
+    self.assertEqual(breakers.get_state('vehicle/1'), BREAKER_STATE_HALF_OPEN)
+
+    breakers.check('vehicle/1')
+    with self.assertRaises(CircuitOpenError):
+      breakers.check('vehicle/1')
+
+    # a failed probe reopens the circuit for longer
+    breakers.record_failure('vehicle/1')
+    time.sleep(0.15)
+    self.assertEqual(breakers.get_state('vehicle/1'), BREAKER_STATE_OPEN)
+    time.sleep(0.1)
+
+    # a released probe goes to the next caller, a successful one closes the circuit
+    breakers.check('vehicle/1')
+    breakers.release_probe('vehicle/1')
+    breakers.check('vehicle/1')
+    breakers.record_success('vehicle/1')
+    self.assertEqual(breakers.get_state('vehicle/1'), BREAKER_STATE_CLOSED)
+    breakers.check('vehicle/1')
+    breakers.check('vehicle/1')
+
+
+  def test_circuits_persist_across_instances(self):
+    breakers= CircuitBreakers(self.store, failures= 2, cooldown= 60)
+    for counter in range(0, 2):
+      breakers.record_failure('vehicle/1')
+    breakers.record_failure('vehicle/2')
+
+    reloaded= CircuitBreakers(self.store, failures= 2, cooldown= 60)
+    self.assertEqual(reloaded.get_state('vehicle/1'), BREAKER_STATE_OPEN)
+    with self.assertRaises(CircuitOpenError):
+      reloaded.check('vehicle/1')
+    self.assertEqual(reloaded.get_circuits()['vehicle/2']['failures'], 1)
+
+    reloaded.reset('vehicle/1')
+    self.assertEqual(CircuitBreakers(self.store).get_state('vehicle/1'), BREAKER_STATE_CLOSED)
+
+
+if __name__ == '__main__':
+  unittest.main()
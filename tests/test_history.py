@@ -0,0 +1,93 @@
+#
+# Import all necessary libraries
+#
+
+import math
+import os
+import tempfile
+import unittest
+
+from teslarequest import HistoryRecorder, KEY_CACHE_TIMESTAMP, HISTORY_BOOLEAN_UNKNOWN
+
+
+#
+# Exercise the append-only state history
+#
+class HistoryRecorderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory= tempfile.TemporaryDirectory()
+    self.history= HistoryRecorder(self.directory.name)
+
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+
+  # Return a vehicle state sample taken at the specified time
+  def sample(self, timestamp, locked, odometer= 100.0):
+    return {KEY_CACHE_TIMESTAMP : timestamp, 'locked' : locked, 'sentry_mode' : False, 'odometer' : odometer}
+
+
+  def test_appends_changed_samples_only(self):
+    self.assertTrue(self.history.record(1, 'vehicle_state', self.sample(10, True)))
+    self.assertFalse(self.history.record(1, 'vehicle_state', self.sample(20, True)))
+    self.assertTrue(self.history.record(1, 'vehicle_state', self.sample(30, True, 101.5)))
+    self.assertTrue(self.history.record(1, 'vehicle_state', {KEY_CACHE_TIMESTAMP : 40}))
+
+    # state types without recorded fields are ignored
+    self.assertFalse(self.history.record(1, 'gui_settings', self.sample(50, True)))
+
+    timestamps, values= self.history.query(1, 'odometer')
+    self.assertEqual(list(timestamps), [10, 30, 40])
+    self.assertEqual(list(values)[0:2], [100.0, 101.5])
+    self.assertTrue(math.isnan(values[2]))
+    self.assertEqual(list(self.history.query(1, 'locked')[1]), [1, 1, HISTORY_BOOLEAN_UNKNOWN])
+
+
+  def test_queries_time_ranges(self):
+    for timestamp in range(10, 60, 10):
+      self.history.record(1, 'vehicle_state', self.sample(timestamp, True, float(timestamp)))
+
+    self.assertEqual(list(self.history.query(1, 'odometer', 20, 40)[0]), [20, 30, 40])
+    self.assertEqual(list(self.history.query(1, 'odometer', start= 45)[1]), [50.0])
+    self.assertEqual(list(self.history.query(1, 'odometer', end= 5)[0]), [])
+    self.assertEqual(list(self.history.query(2, 'odometer')[0]), [])
+    with self.assertRaises(ValueError):
+      self.history.query(1, 'vehicle_name')
+
+
+  def test_repairs_an_interrupted_append(self):
+    self.history.record(1, 'vehicle_state', self.sample(10, True))
+    self.history.record(1, 'vehicle_state', self.sample(20, False))
+
+    # an append cut short after its first value column
+    with open(os.path.join(self.directory.name, '1', 'vehicle_state.locked'), 'ab') as column_file:
+      column_file.write(b'\x01')
+
+    reopened= HistoryRecorder(self.directory.name)
+    timestamps, values= reopened.query(1, 'locked')
+    self.assertEqual(list(timestamps), [10, 20])
+    self.assertEqual(list(values), [1, 0])
+
+    self.assertTrue(reopened.record(1, 'vehicle_state', self.sample(30, True)))
+    self.assertEqual(list(reopened.query(1, 'locked')[1]), [1, 0, 1])
+    self.assertEqual(list(reopened.query(1, 'odometer')[0]), [10, 20, 30])
+
+
+  def test_deduplicates_against_rows_of_other_writers(self):
+    # a second recorder on the same directory stands in for another process
+    other= HistoryRecorder(self.directory.name)
+
+    self.assertTrue(self.history.record(1, 'vehicle_state', self.sample(10, True)))
+    self.assertTrue(other.record(1, 'vehicle_state', self.sample(20, False)))
+    self.assertTrue(self.history.record(1, 'vehicle_state', self.sample(30, True)))
+    self.assertFalse(other.record(1, 'vehicle_state', self.sample(40, True)))
+
+    timestamps, values= self.history.query(1, 'locked')
+    self.assertEqual(list(timestamps), [10, 20, 30])
+    self.assertEqual(list(values), [1, 0, 1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,96 @@
+#
+# Import all necessary libraries
+#
+
+import email.utils
+import threading
+import time
+import unittest
+
+from teslarequest import RequestScheduler, parse_retry_after, PRIORITY_COMMAND, PRIORITY_POLL, \
+  STATUS_CODE_OK, STATUS_CODE_TOO_MANY_REQUESTS, SCHEDULER_MAX_RETRY_AFTER
+
+
+#
+# Exercise the per-account request scheduler
+#
+class RequestSchedulerTest(unittest.TestCase):
+
+  # Send the specified number of requests through the scheduler and return how long it took
+  def send(self, scheduler, count, status= STATUS_CODE_OK):
+    started= time.monotonic()
+    for counter in range(0, count):
+      scheduler.acquire()
+      scheduler.release(status)
+
+    return time.monotonic() - started
+
+
+  def test_token_bucket_paces_requests_after_a_burst(self):
+    scheduler= RequestScheduler(rate= 20.0, burst= 4)
+
+    self.assertLess(self.send(scheduler, 4), 0.05)
+    # the next four wait for tokens earned at 20 per second
+    self.assertGreaterEqual(self.send(scheduler, 4), 0.15)
+
+
+  def test_retry_after_pauses_the_account(self):
+    scheduler= RequestScheduler(rate= 100.0, burst= 10, max_concurrency= 4)
+    scheduler.acquire()
+    scheduler.release(STATUS_CODE_TOO_MANY_REQUESTS, retry_after= 0.3)
+
+    state= scheduler.get_state()
+    self.assertGreater(state['paused'], 0.2)
+    self.assertEqual(state['concurrency'], 2)
+    self.assertGreaterEqual(self.send(scheduler, 1), 0.25)
+
+
+  def test_commands_go_ahead_of_waiting_polls(self):
+    scheduler= RequestScheduler(rate= 10.0, burst= 1)
+    scheduler.acquire()
+    scheduler.release(STATUS_CODE_OK)
+
+    order= []
+    def run(priority):
+      scheduler.acquire(priority)
+      order.append(priority)
+      scheduler.release(STATUS_CODE_OK)
+
+    poll= threading.Thread(target= run, args= (PRIORITY_POLL,))
+    poll.start()
+    time.sleep(0.02)
+    command= threading.Thread(target= run, args= (PRIORITY_COMMAND,))
+    command.start()
+    poll.join()
+    command.join()
+    self.assertEqual(order, [PRIORITY_COMMAND, PRIORITY_POLL])
+
+
+  def test_parses_retry_after_headers(self):
+    self.assertEqual(parse_retry_after('7'), 7.0)
+    self.assertEqual(parse_retry_after('-3'), 0.0)
+    self.assertEqual(parse_retry_after('86400'), SCHEDULER_MAX_RETRY_AFTER)
+    self.assertIsNone(parse_retry_after(None))
+    self.assertIsNone(parse_retry_after('soon'))
+
+    later= email.utils.formatdate(time.time() + 30, usegmt= True)
+    self.assertAlmostEqual(parse_retry_after(later), 30, delta= 2)
+
+
+  def test_open_applies_new_settings_to_a_shared_scheduler(self):
+    scheduler= RequestScheduler.open('test_open_applies_new_settings', rate= 1.0, burst= 8, max_concurrency= 6)
+    self.assertEqual(scheduler.get_state()['concurrency'], 6)
+
+    reopened= RequestScheduler.open('test_open_applies_new_settings', burst= 2, max_concurrency= 3)
+    self.assertIs(reopened, scheduler)
+    state= scheduler.get_state()
+    self.assertEqual(state['concurrency'], 3)
+    self.assertLessEqual(state['tokens'], 2)
+
+    # limits left out stay as they were
+    self.assertIs(RequestScheduler.open('test_open_applies_new_settings'), scheduler)
+    self.assertEqual(scheduler.get_state()['concurrency'], 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+#
+# Import all necessary libraries
+#
+
+import os
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+import teslafakeapi
+
+from teslarequest import TeslaRequest, WakeStrategy, REQUEST_DATA_STATE_VEHICLE
+
+
+#
+# Exercise TeslaRequest against the stand-in Owner API
+#
+class TeslaRequestTest(unittest.TestCase):
+
+  def setUp(self):
+    self.api= teslafakeapi.FakeOwnerAPI(fleet_size= 1, latency= 0, asleep_fraction= 0, seed= 1).start()
+    self.directory= tempfile.TemporaryDirectory()
+    self.request= TeslaRequest(types.SimpleNamespace(token= self.api.make_token(), quiet= True,
+      history_dir= os.path.join(self.directory.name, 'history')))
+
+
+  def tearDown(self):
+    self.request.close()
+    self.api.stop()
+    self.directory.cleanup()
+
+
+  def test_command_state_stays_out_of_history(self):
+    active= self.request.is_vehicle_sentry_mode_active(0)
+    fetched= time.time()
+    revision= self.request.get_state_revision(0, REQUEST_DATA_STATE_VEHICLE)
+    timestamps, values= self.request.get_history(0, 'sentry_mode')
+    self.assertEqual(list(values), [int(active)])
+
+    # history stores whole seconds: keep the command and the next fetch apart
+    time.sleep(1.1)
+    if active:
+      self.assertTrue(self.request.set_sentry_mode_off(0))
+    else:
+      self.assertTrue(self.request.set_sentry_mode_on(0))
+    self.assertEqual(self.request.is_vehicle_sentry_mode_active(0), not active)
+
+    # the assumed state is neither a sample nor a revision
+    self.assertEqual(list(self.request.get_history(0, 'sentry_mode')[1]), [int(active)])
+    self.assertEqual(self.request.get_state_revision(0, REQUEST_DATA_STATE_VEHICLE), revision)
+
+    # the next fetch records the change at its own time
+    self.request.invalidate_cache(0, REQUEST_DATA_STATE_VEHICLE)
+    self.assertEqual(self.request.is_vehicle_sentry_mode_active(0), not active)
+    timestamps, values= self.request.get_history(0, 'sentry_mode')
+    self.assertEqual(list(values), [int(active), int(not active)])
+    self.assertGreater(timestamps[-1], int(fetched))
+    self.assertEqual(self.request.get_state_revision(0, REQUEST_DATA_STATE_VEHICLE), revision + 1)
+    self.assertIn('sentry_mode', self.request.get_changes(0, REQUEST_DATA_STATE_VEHICLE))
+
+
+  def test_passive_state_follows_vehicle_ids_when_listing_reorders(self):
+    api= teslafakeapi.FakeOwnerAPI(fleet_size= 2, latency= 0, asleep_fraction= 0, seed= 1).start()
+    self.addCleanup(api.stop)
+    request= TeslaRequest(types.SimpleNamespace(token= api.make_token(), quiet= True, passive= True,
+      cache_expiration_limit= 0, wake_strategy= WakeStrategy(online_freshness= 0)))
+    self.addCleanup(request.close)
+
+    dozing= request.get_vehicle_id(0)
+    state= request.get_vehicle_state(0)
+
+    # the first car falls asleep and the next listing brings it last
+    api.vehicles[dozing].listing['state']= 'asleep'
+    api.vehicles= dict(reversed(list(api.vehicles.items())))
+    api.counters.clear()
+
+    self.assertIs(request.get_vehicle_state(0), state)
+    self.assertEqual(request.get_vehicle_id(1), dozing)
+    self.assertTrue(request.is_state_served_stale(1, REQUEST_DATA_STATE_VEHICLE))
+    self.assertNotIn('wake_up', api.get_stats()['endpoints'])
+
+
+  def test_vehicle_listing_runs_outside_the_instance_lock(self):
+    self.request.get_vehicle_state(0)
+    self.api.counters.clear()
+    self.api.latency= 1.0
+
+    listings= [threading.Thread(target= self.request.refresh_vehicles) for counter in range(0, 3)]
+    for listing in listings:
+      listing.start()
+    time.sleep(0.2)
+
+    # cached state stays readable while the listing is on its way
+    started= time.time()
+    self.assertIn('battery_level', self.request.get_changes(0, 'charge_state'))
+    self.assertFalse(self.request.is_state_served_stale(0, 'charge_state'))
+    self.assertLess(time.time() - started, 0.5)
+
+    for listing in listings:
+      listing.join()
+    self.assertEqual(self.api.get_stats()['endpoints']['vehicles'], 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,95 @@
+#
+# Import all necessary libraries
+#
+
+import json
+import os
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+import teslafakeapi
+
+from teslarequest import TeslaRequest, TokenStore, KEY_TOKEN, KEY_TOKEN_CREATION
+
+
+#
+# Exercise the shared token store
+#
+class TokenStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory= tempfile.TemporaryDirectory()
+    self.path= os.path.join(self.directory.name, 'token.json')
+
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+
+  # Write a token file holding the specified token
+  def write_token(self, token):
+    with open(self.path, 'w') as token_file:
+      json.dump(token, token_file)
+
+
+  # Run the specified function on several threads at once and return their results
+  def run_concurrently(self, function, count= 8):
+    results= [None] * count
+    barrier= threading.Barrier(count)
+
+    def run(index):
+      barrier.wait()
+      results[index]= function()
+
+    threads= [threading.Thread(target= run, args= (index,)) for index in range(0, count)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    return results
+
+
+  def test_refresh_runs_once_for_concurrent_callers(self):
+    self.write_token({KEY_TOKEN : 'stale'})
+    store= TokenStore(self.path)
+    stale= store.get()
+    calls= []
+
+    def refresh(token):
+      calls.append(token[KEY_TOKEN])
+      time.sleep(0.1)
+      return {KEY_TOKEN : 'fresh'}
+
+    results= self.run_concurrently(lambda: store.refresh(refresh, stale))
+    self.assertEqual(calls, ['stale'])
+    self.assertEqual([token[KEY_TOKEN] for token, refreshed in results], ['fresh'] * len(results))
+    self.assertEqual(sum(refreshed for token, refreshed in results), 1)
+
+    # the refreshed token is on disk for other processes
+    self.assertEqual(TokenStore(self.path).get()[KEY_TOKEN], 'fresh')
+
+
+  def test_requests_sharing_a_token_file_refresh_once(self):
+    api= teslafakeapi.FakeOwnerAPI(fleet_size= 1, latency= 0.05, asleep_fraction= 0, seed= 1).start()
+    self.addCleanup(api.stop)
+    token= api.make_token()
+    token[KEY_TOKEN_CREATION]= 0
+    self.write_token(token)
+
+    def connect():
+      request= TeslaRequest(types.SimpleNamespace(token_file= self.path, quiet= True, lazy= True))
+      try:
+        return request.get_token()[KEY_TOKEN]
+      finally:
+        request.close()
+
+    self.assertEqual(set(self.run_concurrently(connect)), {'fake-access-token-1'})
+    self.assertEqual(api.tokens_issued, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()